@@ -1,66 +1,46 @@
 # consumers.py
 
-from channels.generic.websocket import AsyncWebsocketConsumer
-from channels.generic.websocket import WebsocketConsumer
-import json
+from channels.generic.websocket import AsyncJsonWebsocketConsumer
+
+from Inventory import live
+
+
+class LiveConsumer(AsyncJsonWebsocketConsumer):
+    """Join ``groups`` for signed-in users; everyone else is turned away."""
 
-class UserStatusConsumer(AsyncWebsocketConsumer):
     async def connect(self):
-        # Create or join a group for user status updates
-        self.room_group_name = 'user_status_group'
-        await self.channel_layer.group_add(
-            self.room_group_name,
-            self.channel_name
-        )
+        user = self.scope.get('user')
+        if user is None or not user.is_authenticated:
+            await self.close()
+            return
         await self.accept()
 
-    async def disconnect(self, close_code):
-        # Remove from the group on disconnect
-        await self.channel_layer.group_discard(
-            self.room_group_name,
-            self.channel_name
-        )
 
-    async def receive(self, text_data):
-        # Receive message from WebSocket
-        data = json.loads(text_data)
-        status = data['status']
-        user = data['user']
+class UserStatusConsumer(LiveConsumer):
+    groups = [live.PRESENCE_GROUP]
 
-        # Broadcast the status change to all clients in the group
-        await self.channel_layer.group_send(
-            self.room_group_name,
-            {
-                'type': 'user_status_update',
-                'status': status,
-                'user': user
-            }
-        )
+    async def receive_json(self, content):
+        # A page reports its own user going idle or active again
+        status = content.get('status')
+        if status not in ('online', 'offline'):
+            return
+        await self.channel_layer.group_send(live.PRESENCE_GROUP, {
+            'type': 'user.status',
+            'user': self.scope['user'].get_username(),
+            'status': status,
+        })
 
     # Handle broadcasted messages to all clients
-    async def user_status_update(self, event):
-        status = event['status']
-        user = event['user']
+    async def user_status(self, event):
+        await self.send_json({'user': event['user'], 'status': event['status']})
 
-        # Send status update to WebSocket
-        await self.send(text_data=json.dumps({
-            'status': status,
-            'user': user
-        }))
-class UserStatusConsumer(WebsocketConsumer):
-    def connect(self):
-        self.accept()
 
-    def disconnect(self, close_code):
-        pass
+class StockConsumer(LiveConsumer):
+    groups = [live.STOCK_GROUP]
 
-    def receive(self, text_data):
-        data = json.loads(text_data)
-        username = data['user']
-        status = data['status']
-        
-        # Broadcast the status change to all connected clients
-        self.send(text_data=json.dumps({
-            'user': username,
-            'status': status
-        }))
\ No newline at end of file
+    async def stock_changed(self, event):
+        await self.send_json({
+            'operation': event['operation'],
+            'drug': event['drug'],
+            'summary': event['summary'],
+        })
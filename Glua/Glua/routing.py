@@ -0,0 +1,8 @@
+from django.urls import path
+
+from .consumers import UserStatusConsumer, StockConsumer
+
+websocket_urlpatterns = [
+    path('ws/user_status/', UserStatusConsumer.as_asgi()),
+    path('ws/stock/', StockConsumer.as_asgi()),
+]
@@ -13,6 +13,9 @@ https://docs.djangoproject.com/en/3.1/ref/settings/
 from pathlib import Path
 import os
 
+import django
+from django.core.exceptions import ImproperlyConfigured
+
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -46,10 +49,14 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'Inventory.instrumentation.InstrumentationMiddleware',
+    'Inventory.metrics.MetricsMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'Inventory.sessions.SessionRefreshMiddleware',
+    'Inventory.presence.PresenceMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -70,22 +77,77 @@ TEMPLATES = [
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
+                'Inventory.context_processors.exports',
             ],
         },
     },
 ]
 
 WSGI_APPLICATION = 'Glua.wsgi.application'
+ASGI_APPLICATION = 'Glua.asgi.application'
 
 
 # Database
 # https://docs.djangoproject.com/en/3.1/ref/settings/#databases
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+# GLUA_DB_ENGINE picks the backend: 'sqlite' (default, one file, fine for a
+# single counter) or 'postgresql' (needs the psycopg package, for several
+# workers writing at once).
+#
+# SQLite connections get the SQLITE_PRAGMAS below when they open (see
+# Inventory.database): WAL lets readers carry on while a sale is written,
+# synchronous=NORMAL is safe with WAL, and busy_timeout makes a writer wait
+# for the lock instead of failing with 'database is locked'.
+#
+# PostgreSQL keeps connections open for GLUA_DB_CONN_MAX_AGE seconds and
+# checks them before reuse. GLUA_DB_POOL=1 uses psycopg's connection pool
+# instead (Django 5.1+, psycopg[pool]); behind PgBouncer in transaction
+# mode set GLUA_DB_PGBOUNCER=1, which turns off server-side cursors.
+DB_ENGINE = os.environ.get('GLUA_DB_ENGINE', 'sqlite')
+
+if DB_ENGINE == 'postgresql':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': os.environ.get('GLUA_DB_NAME', 'glua'),
+            'USER': os.environ.get('GLUA_DB_USER', 'glua'),
+            'PASSWORD': os.environ.get('GLUA_DB_PASSWORD', ''),
+            'HOST': os.environ.get('GLUA_DB_HOST', '127.0.0.1'),
+            'PORT': os.environ.get('GLUA_DB_PORT', '5432'),
+            'CONN_MAX_AGE': int(os.environ.get('GLUA_DB_CONN_MAX_AGE', 60)),
+            'CONN_HEALTH_CHECKS': True,
+            'DISABLE_SERVER_SIDE_CURSORS': os.environ.get('GLUA_DB_PGBOUNCER', '0') == '1',
+            'OPTIONS': {},
+        }
+    }
+    if os.environ.get('GLUA_DB_POOL', '0') == '1':
+        if django.VERSION < (5, 1):
+            # Older versions hand the option straight to psycopg, which rejects it on connect
+            raise ImproperlyConfigured('GLUA_DB_POOL=1 needs Django 5.1 or later')
+        # Pooled connections are returned to the pool, not kept per thread
+        DATABASES['default']['CONN_MAX_AGE'] = 0
+        DATABASES['default']['OPTIONS']['pool'] = {
+            'min_size': int(os.environ.get('GLUA_DB_POOL_MIN', 2)),
+            'max_size': int(os.environ.get('GLUA_DB_POOL_MAX', 10)),
+        }
+else:
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.environ.get('GLUA_DB_NAME', BASE_DIR / 'db.sqlite3'),
+            'OPTIONS': {},
+        }
     }
+    if django.VERSION >= (5, 1):
+        # Take the write lock when a transaction starts, so busy_timeout applies;
+        # a deferred transaction that later writes fails at once when locked
+        DATABASES['default']['OPTIONS']['transaction_mode'] = 'IMMEDIATE'
+
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'busy_timeout': int(os.environ.get('GLUA_SQLITE_BUSY_TIMEOUT_MS', 5000)),
+    'mmap_size': int(os.environ.get('GLUA_SQLITE_MMAP_SIZE', 256 * 1024 * 1024)),
 }
 
 
@@ -121,9 +183,163 @@ USE_L10N = True
 
 USE_TZ = True
 
+# Caching
+# GLUA_CACHE_BACKEND picks the backend: 'locmem' (default, private to each
+# worker process), 'file' (shared by the workers on one host) or 'redis'
+# (shared by every host, needs the redis package). Cached fragments are
+# invalidated through versioned keys in the cache itself, so with more
+# than one worker use 'file' or 'redis'.
+CACHE_BACKEND = os.environ.get('GLUA_CACHE_BACKEND', 'locmem')
+CACHE_TTL = int(os.environ.get('GLUA_CACHE_TTL', 300))  # Seconds before a cached fragment is recomputed
+
+if CACHE_BACKEND == 'redis':
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.environ.get('GLUA_CACHE_LOCATION', 'redis://127.0.0.1:6379/1'),
+            'TIMEOUT': CACHE_TTL,
+        }
+    }
+elif CACHE_BACKEND == 'file':
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': os.environ.get('GLUA_CACHE_LOCATION', os.path.join(BASE_DIR, '.cache')),
+            'TIMEOUT': CACHE_TTL,
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'glua',
+            'TIMEOUT': CACHE_TTL,
+        }
+    }
+
+# Live updates
+# Presence and stock changes are pushed to open pages over WebSockets
+# (Glua.asgi, Inventory.live). GLUA_CHANNEL_LAYER picks how they travel:
+# 'memory' (default) only reaches sockets served by the same process, so
+# run a single ASGI process with it; 'redis' (needs channels_redis) reaches
+# every process and host, including messages sent by WSGI workers.
+CHANNEL_LAYER = os.environ.get('GLUA_CHANNEL_LAYER', 'memory')
+
+if CHANNEL_LAYER == 'redis':
+    CHANNEL_LAYERS = {
+        'default': {
+            'BACKEND': 'channels_redis.core.RedisChannelLayer',
+            'CONFIG': {'hosts': [os.environ.get('GLUA_CHANNEL_LAYER_LOCATION', 'redis://127.0.0.1:6379/2')]},
+        }
+    }
+else:
+    CHANNEL_LAYERS = {
+        'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'},
+    }
+
+# Async views
+# GLUA_ASYNC_VIEWS=1 routes the read-only report and search pages to their
+# async versions in Inventory.async_views. Turn it on when serving
+# Glua.asgi with an ASGI server (uvicorn, daphne); under WSGI each async
+# view needs its own event loop and is slower than the sync one.
+ASYNC_VIEWS = os.environ.get('GLUA_ASYNC_VIEWS', '0') == '1'
+
+# Request instrumentation
+# GLUA_INSTRUMENTATION=1 turns on InstrumentationMiddleware, which adds a
+# Server-Timing header to every response and logs one line per request
+# with its view, wall time, DB time and query count. Requests slower than
+# SLOW_REQUEST_MS are logged as warnings, and so is the SQL of every query
+# slower than SLOW_QUERY_MS.
+INSTRUMENTATION = os.environ.get('GLUA_INSTRUMENTATION', '0') == '1'
+SLOW_REQUEST_MS = float(os.environ.get('GLUA_SLOW_REQUEST_MS', 500))
+SLOW_QUERY_MS = float(os.environ.get('GLUA_SLOW_QUERY_MS', 100))
+
+# Background exports
+# Large Excel exports can be queued instead of streamed: the workbook is
+# written under EXPORT_ROOT by `manage.py run_export_jobs`, or, with
+# GLUA_EXPORT_WORKER_THREADS above 0, by a thread pool inside each web
+# process. Pages only queue exports when a worker runs: set GLUA_EXPORT_QUEUE=1
+# where run_export_jobs is deployed; otherwise they download directly.
+# Jobs pending or running longer than EXPORT_JOB_TIMEOUT are failed, and
+# finished jobs and their files are removed after EXPORT_JOB_TTL.
+EXPORT_ROOT = os.environ.get('GLUA_EXPORT_ROOT', os.path.join(BASE_DIR, 'exports'))
+EXPORT_WORKER_THREADS = int(os.environ.get('GLUA_EXPORT_WORKER_THREADS', 0))
+EXPORT_QUEUE = EXPORT_WORKER_THREADS > 0 or os.environ.get('GLUA_EXPORT_QUEUE', '0') == '1'
+EXPORT_JOB_TIMEOUT = int(os.environ.get('GLUA_EXPORT_JOB_TIMEOUT', 1800))  # Seconds
+EXPORT_JOB_TTL = int(os.environ.get('GLUA_EXPORT_JOB_TTL', 86400))  # Seconds
+
+# Bulk data exports
+# exports/data/<dataset>/ streams CSV or NDJSON for logged-in users. BI jobs
+# without a session may instead send 'Authorization: Bearer <token>' when
+# GLUA_BULK_EXPORT_TOKEN is set. Rows written in the last BULK_EXPORT_LAG
+# seconds are left for the next pull, so that PostgreSQL transactions
+# committing out of id order are not skipped by the returned cursor;
+# SQLite commits in id order and needs no lag.
+BULK_EXPORT_TOKEN = os.environ.get('GLUA_BULK_EXPORT_TOKEN', '')
+BULK_EXPORT_LAG = int(os.environ.get('GLUA_BULK_EXPORT_LAG', 60 if DB_ENGINE == 'postgresql' else 0))
+
+# JSON API
+# api/ lists stock, sales and clients and takes batched sales, locks and
+# stock additions. Logged-in users use their session; scripts send
+# 'Authorization: Bearer <token>' with a token from GLUA_API_TOKENS, a
+# comma-separated list of token:username pairs, and act as that user.
+API_TOKENS = dict(
+    pair.split(':', 1) for pair in os.environ.get('GLUA_API_TOKENS', '').split(',') if ':' in pair
+)
+
+# Metrics
+# /metrics serves Prometheus text exposition for this worker process.
+# GLUA_METRICS=0 turns recording and the endpoint off. The exposition
+# names views and their query costs, so it is only served to staff users
+# and to scrapers sending 'Authorization: Bearer <token>' with
+# GLUA_METRICS_TOKEN; GLUA_METRICS_PUBLIC=1 serves it to anyone, for
+# endpoints only reachable from inside the network.
+METRICS = os.environ.get('GLUA_METRICS', '1') == '1'
+METRICS_TOKEN = os.environ.get('GLUA_METRICS_TOKEN', '')
+METRICS_PUBLIC = os.environ.get('GLUA_METRICS_PUBLIC', '0') == '1'
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'plain': {'format': '%(asctime)s %(levelname)s %(name)s %(message)s'},
+    },
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler', 'formatter': 'plain'},
+    },
+    'loggers': {
+        'Inventory': {
+            'handlers': ['console'],
+            'level': os.environ.get('GLUA_LOG_LEVEL', 'INFO'),
+        },
+    },
+}
+
+# Sessions
+# GLUA_SESSION_ENGINE picks where sessions live: 'cached_db' (read from the
+# cache and written through to the database), 'db', or 'signed_cookies' (no
+# server-side storage at all, but the contents are readable by the client
+# and a logout cannot revoke a copied cookie). 'cached_db' is the default
+# when the cache is shared between workers; with the per-process locmem
+# cache another worker would keep serving a logged-out session from its own
+# copy, so the default is then 'db' and 'cached_db' is refused outside DEBUG.
+# Instead of saving the session on every request, SessionRefreshMiddleware
+# pushes its expiry back at most once every SESSION_REFRESH_INTERVAL
+# seconds; GLUA_SESSION_SAVE_EVERY_REQUEST=1 restores the old behaviour.
+SESSION_STORE = os.environ.get('GLUA_SESSION_ENGINE', 'db' if CACHE_BACKEND == 'locmem' else 'cached_db')
+if SESSION_STORE == 'cached_db' and CACHE_BACKEND == 'locmem' and not DEBUG:
+    raise ImproperlyConfigured(
+        "GLUA_SESSION_ENGINE=cached_db needs a shared cache; set GLUA_CACHE_BACKEND to 'file' or 'redis'"
+    )
+SESSION_ENGINE = {
+    'cached_db': 'django.contrib.sessions.backends.cached_db',
+    'db': 'django.contrib.sessions.backends.db',
+    'signed_cookies': 'django.contrib.sessions.backends.signed_cookies',
+}[SESSION_STORE]
 SESSION_COOKIE_AGE = 3600  # 1 hour in seconds
 SESSION_EXPIRE_AT_BROWSER_CLOSE = False
-SESSION_SAVE_EVERY_REQUEST = True
+SESSION_SAVE_EVERY_REQUEST = os.environ.get('GLUA_SESSION_SAVE_EVERY_REQUEST', '0') == '1'
+SESSION_REFRESH_INTERVAL = int(os.environ.get('GLUA_SESSION_REFRESH_MINUTES', 5)) * 60
 
 
 
@@ -1,6 +1,6 @@
 from django.contrib import admin
 from django.core.exceptions import PermissionDenied
-from .models import Drug, Sale, Stocked, Measurement, LockedProduct, MarketingItem, IssuedItem, PickingList, Cannister, IssuedCannister, Client
+from .models import Drug, Sale, Stocked, Measurement, LockedProduct, MarketingItem, IssuedItem, PickingList, Cannister, IssuedCannister, Client, ProductSalesTotal, UserPresence, ExportJob
 
 
 class LockedProductAdmin(admin.ModelAdmin):
@@ -27,4 +27,7 @@ admin.site.register(IssuedItem)  # If you want to use the default admin for Issu
 admin.site.register(LockedProduct, LockedProductAdmin)
 admin.site.register(PickingList)
 admin.site.register(Cannister)
-admin.site.register(IssuedCannister)
\ No newline at end of file
+admin.site.register(IssuedCannister)
+admin.site.register(ProductSalesTotal)
+admin.site.register(UserPresence)
+admin.site.register(ExportJob)
@@ -0,0 +1,301 @@
+"""JSON API over stock, sales and clients for scanners and integrations.
+
+List endpoints page with the keyset cursors of ``pagination`` and read
+only the columns asked for in ``fields``. Batch endpoints apply every
+line of an order through the stock ledger inside one transaction: either
+all lines are recorded or, on the first line that fails, none are.
+
+Requests are authenticated by the session, with the usual CSRF check on
+writes, or by ``Authorization: Bearer <token>`` with a token from
+``settings.API_TOKENS``, which acts as the user it is mapped to.
+"""
+import json
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.middleware.csrf import CsrfViewMiddleware
+from django.utils.crypto import constant_time_compare
+
+from . import ledger
+from .models import Drug, Sale, Client, LockedProduct, PickingList, Cannister, Stocked
+from .pagination import InvalidCursor, KeysetPaginator, get_per_page
+
+
+DEFAULT_PER_PAGE = 50
+MAX_BATCH = 500
+
+
+class ApiError(Exception):
+    """A request the API rejects; ``status`` is the HTTP status to answer with."""
+
+    def __init__(self, message, status=400, line=None):
+        super().__init__(message)
+        self.status = status
+        self.line = line
+
+    def as_json(self):
+        error = {'error': str(self)}
+        if self.line is not None:
+            error['line'] = self.line
+        return error
+
+
+class Resource:
+    """A model listed as flat JSON objects.
+
+    ``columns`` are ``(field, lookup)`` pairs; ``ordering`` must end in
+    ``id`` so that every row has a distinct cursor position.
+    """
+
+    def __init__(self, name, model, ordering, columns):
+        self.name = name
+        self.model = model
+        self.ordering = ordering
+        self.columns = dict(columns)
+
+    def select(self, fields=None):
+        """The ``{field: lookup}`` pairs for a comma-separated ``fields`` parameter."""
+        if not fields:
+            return self.columns
+        names = [name.strip() for name in fields.split(',') if name.strip()]
+        unknown = [name for name in names if name not in self.columns]
+        if unknown:
+            raise ApiError(f'Unknown fields: {", ".join(unknown)}')
+        return {name: self.columns[name] for name in names}
+
+    def values(self, queryset, columns):
+        # Ordering columns are read too, for the cursors
+        lookups = set(columns.values()) | {term.lstrip('-') for term in self.ordering}
+        return queryset.values(*lookups)
+
+    def page(self, request):
+        """One page of rows and the cursors around it, as a JSON-ready dict."""
+        columns = self.select(request.GET.get('fields'))
+        cursor = request.GET.get('cursor')
+        paginator = KeysetPaginator(
+            self.values(self.model._default_manager.all(), columns), self.ordering,
+            get_per_page(request, DEFAULT_PER_PAGE),
+        )
+        if cursor:
+            try:
+                paginator.position(cursor)
+            except InvalidCursor as e:
+                raise ApiError(str(e))
+        page = paginator.page(cursor)
+        return {
+            'results': [self.row(values, columns) for values in page],
+            'next_cursor': page.next_cursor,
+            'previous_cursor': page.previous_cursor,
+        }
+
+    def rows(self, pks):
+        """Every column of the rows with ``pks``, in that order."""
+        found = {
+            values['id']: self.row(values, self.columns)
+            for values in self.values(self.model._default_manager.filter(pk__in=pks), self.columns)
+        }
+        return [found[pk] for pk in pks]
+
+    @staticmethod
+    def row(values, columns):
+        return {name: values[lookup] for name, lookup in columns.items()}
+
+
+RESOURCES = {
+    resource.name: resource for resource in [
+        Resource('drugs', Drug, ('name', 'id'), [
+            ('id', 'id'),
+            ('name', 'name'),
+            ('batch_no', 'batch_no'),
+            ('stock', 'stock'),
+            ('reorder_level', 'reorder_level'),
+            ('dose_pack', 'dose_pack'),
+            ('expiry_date', 'expiry_date'),
+            ('measurement_units', 'measurement_units__name'),
+        ]),
+        Resource('sales', Sale, ('-date_sold', '-id'), [
+            ('id', 'id'),
+            ('date_sold', 'date_sold'),
+            ('drug_id', 'drug_id'),
+            ('drug', 'drug_sold'),
+            ('batch_no', 'batch_no'),
+            ('quantity', 'quantity'),
+            ('remaining_quantity', 'remaining_quantity'),
+            ('client_id', 'client_id'),
+            ('client', 'client__name'),
+            ('seller', 'seller__username'),
+        ]),
+        Resource('clients', Client, ('name', 'id'), [
+            ('id', 'id'),
+            ('name', 'name'),
+            ('email', 'email'),
+            ('phone', 'phone'),
+            ('date_created', 'date_created'),
+        ]),
+        Resource('locked-products', LockedProduct, ('-date_locked', '-id'), [
+            ('id', 'id'),
+            ('date_locked', 'date_locked'),
+            ('drug_id', 'drug_id'),
+            ('drug', 'drug__name'),
+            ('batch_no', 'drug__batch_no'),
+            ('quantity', 'quantity'),
+            ('client_id', 'client_id'),
+            ('client', 'client__name'),
+            ('locked_by', 'locked_by__username'),
+        ]),
+        Resource('picking-list', PickingList, ('-date', '-id'), [
+            ('id', 'id'),
+            ('date', 'date'),
+            ('drug_id', 'drug_id'),
+            ('product', 'product'),
+            ('batch_no', 'batch_no'),
+            ('quantity', 'quantity'),
+            ('client_id', 'client_id'),
+            ('client', 'client__name'),
+        ]),
+        Resource('cannisters', Cannister, ('name', 'id'), [
+            ('id', 'id'),
+            ('name', 'name'),
+            ('batch_no', 'batch_no'),
+            ('stock', 'stock'),
+            ('litres', 'litres'),
+        ]),
+    ]
+}
+
+# Records written by the batch endpoints, listed like the resources
+STOCKED = Resource('stocked', Stocked, ('-date_added', '-id'), [
+    ('id', 'id'),
+    ('date_added', 'date_added'),
+    ('drug_id', 'drug_name_id'),
+    ('drug', 'drug_name__name'),
+    ('batch_no', 'drug_name__batch_no'),
+    ('number_added', 'number_added'),
+    ('total', 'total'),
+    ('supplier', 'supplier'),
+    ('staff', 'staff__username'),
+])
+
+
+def _token_user(request):
+    header = request.headers.get('Authorization', '')
+    if not header.startswith('Bearer '):
+        return None
+    token = header[len('Bearer '):]
+    for known, username in settings.API_TOKENS.items():
+        if constant_time_compare(token, known):
+            return User.objects.filter(username=username, is_active=True).first()
+    return None
+
+
+def authenticate(request):
+    """The user making an API request; raises ``ApiError`` when there is none.
+
+    The API views are CSRF exempt so that token clients need no cookie,
+    which makes the check here the only one for session requests.
+    """
+    user = _token_user(request)
+    if user is not None:
+        return user
+    if not request.user.is_authenticated:
+        raise ApiError('Authentication required', status=401)
+    rejected = CsrfViewMiddleware(lambda request: None).process_view(request, None, (), {})
+    if rejected is not None:
+        raise ApiError('CSRF check failed', status=403)
+    return request.user
+
+
+def parse_lines(request):
+    """The ``lines`` of a batch request body, each with the body's defaults filled in."""
+    try:
+        body = json.loads(request.body)
+    except ValueError:
+        raise ApiError('Body must be JSON')
+    if not isinstance(body, dict) or not isinstance(body.get('lines'), list) or not body['lines']:
+        raise ApiError('Body must be an object with a non-empty "lines" list')
+    if len(body['lines']) > MAX_BATCH:
+        raise ApiError(f'At most {MAX_BATCH} lines per request')
+    defaults = {key: value for key, value in body.items() if key != 'lines'}
+    lines = []
+    for index, line in enumerate(body['lines']):
+        if not isinstance(line, dict):
+            raise ApiError('Each line must be an object', line=index)
+        lines.append({**defaults, **line})
+    return lines
+
+
+def _is_int(value):
+    # bool is an int subclass, but true is not a quantity or an id
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+def _quantity(line, index):
+    # Stock is counted in whole units, like the ledger requires
+    quantity = line.get('quantity')
+    if not _is_int(quantity):
+        raise ApiError('quantity must be a whole number', line=index)
+    if quantity <= 0:
+        raise ApiError('Quantity must be greater than zero', line=index)
+    return quantity
+
+
+def _lookup(model, lines, key):
+    """The ``model`` rows named by ``key`` in ``lines``, fetched in one query."""
+    for index, line in enumerate(lines):
+        if not _is_int(line.get(key)):
+            raise ApiError(f'{key} must be an id', line=index)
+    found = model.objects.in_bulk({line[key] for line in lines})
+    for index, line in enumerate(lines):
+        if line[key] not in found:
+            raise ApiError(f'{model._meta.verbose_name} {line[key]} does not exist', status=404, line=index)
+    return found
+
+
+def _apply(lines, move):
+    """Run ``move(index, line)`` for every line in one transaction; return the created pks in line order.
+
+    Lines are applied in drug order, so two batches over the same drugs
+    lock their rows in the same order and cannot deadlock each other.
+    """
+    created = [None] * len(lines)
+    with transaction.atomic():
+        for index in sorted(range(len(lines)), key=lambda index: lines[index]['drug']):
+            try:
+                created[index] = move(index, lines[index]).pk
+            except ledger.InsufficientStock as e:
+                raise ApiError(str(e), status=409, line=index)
+            except ledger.StockError as e:
+                raise ApiError(str(e), line=index)
+    return created
+
+
+def _sell_or_lock(lines, user, operation):
+    drugs = _lookup(Drug, lines, 'drug')
+    clients = _lookup(Client, lines, 'client')
+    quantities = [_quantity(line, index) for index, line in enumerate(lines)]
+    return _apply(lines, lambda index, line: operation(
+        drugs[line['drug']], quantities[index], clients[line['client']], user
+    ))
+
+
+def sell(lines, user):
+    """Sell every line; return the ``Sale`` rows."""
+    return RESOURCES['sales'].rows(_sell_or_lock(lines, user, ledger.sell))
+
+
+def lock(lines, user):
+    """Lock every line for its client; return the ``LockedProduct`` rows."""
+    return RESOURCES['locked-products'].rows(_sell_or_lock(lines, user, ledger.lock))
+
+
+def add_stock(lines, user):
+    """Receive every line into stock; return the ``Stocked`` rows."""
+    drugs = _lookup(Drug, lines, 'drug')
+    quantities = [_quantity(line, index) for index, line in enumerate(lines)]
+    for index, line in enumerate(lines):
+        if not isinstance(line.get('supplier', ''), (str, type(None))):
+            raise ApiError('supplier must be a string', line=index)
+    return STOCKED.rows(_apply(lines, lambda index, line: ledger.add_stock(
+        drugs[line['drug']], quantities[index], line.get('supplier'), user
+    )))
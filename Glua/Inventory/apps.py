@@ -3,3 +3,7 @@ from django.apps import AppConfig
 
 class InventoryConfig(AppConfig):
     name = 'Inventory'
+
+    def ready(self):
+        # Connect the search index, presence, session, cache invalidation and connection setup signal handlers
+        from . import search, presence, sessions, caching, database  # noqa: F401
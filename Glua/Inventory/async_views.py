@@ -0,0 +1,216 @@
+"""Async versions of the read-only report and search views.
+
+They produce the same pages as their namesakes in ``views`` but query
+through the async ORM, so under an ASGI server a request waiting on the
+database does not hold a worker thread. Independent queries, such as the
+dashboard counts, are awaited together with ``asyncio.gather``; Django
+still runs async ORM calls one at a time on its database thread, so
+this shortens the wait only as far as the event loop can overlap the
+rest of the work. Templates are rendered in that thread as well, since
+rendering may touch the session or lazy objects.
+
+``urls`` routes to these views when ``settings.ASYNC_VIEWS`` is on.
+Under WSGI each of them would need its own event loop, so leave it off
+there.
+"""
+import asyncio
+from datetime import timedelta
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.contrib.auth.views import redirect_to_login
+from django.db.models import F, Q
+from django.http import JsonResponse
+from django.shortcuts import render
+from django.utils import timezone
+
+from . import caching
+from .dashboard import EXPIRING_SOON_DAYS, acached_drugs, acached_summary, drug_filters, has_alerts
+from .models import Drug, Sale, LockedProduct, MarketingItem, Cannister, Client, ProductSalesTotal
+from .presence import ausers_with_presence
+from .search import search_filter, match as search_match
+
+
+def login_required(view):
+    """``login_required`` for async views, resolving the lazy user off the event loop."""
+    @wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        if not await sync_to_async(lambda: request.user.is_authenticated)():
+            return redirect_to_login(request.get_full_path())
+        return await view(request, *args, **kwargs)
+    return wrapper
+
+
+async def arender(request, template_name, context):
+    return await sync_to_async(render)(request, template_name, context)
+
+
+async def alist(queryset):
+    return [obj async for obj in queryset]
+
+
+async def aclient_choices():
+    """All clients ordered by name, for the client dropdowns."""
+    return await caching.acached(
+        'client_choices', lambda: alist(Client.objects.order_by('name')), models=[Client]
+    )
+
+
+async def asearch(queryset, kind, query, fallback, columns=None):
+    """Evaluate ``search_filter()``; finding the index may need a synchronous query."""
+    return await alist(await sync_to_async(search_filter)(queryset, kind, query, fallback, columns))
+
+
+@login_required
+async def dashboard(request):
+    today = timezone.now().date()
+    filters = drug_filters(today)
+    summary, top_sold_products = await asyncio.gather(
+        acached_summary(today),
+        alist(ProductSalesTotal.objects.values("drug_sold", "total_quantity")),
+    )
+
+    # Check if the modal should be shown (only when there are low stock or expiring soon products)
+    show_modal = False
+    if has_alerts(summary):
+        show_modal = not await sync_to_async(request.session.get)('modal_shown', False)
+
+    if show_modal:
+        request.session['modal_shown'] = True  # Set the session variable to True after showing the modal
+        request.session.modified = True  # Ensure the session is saved
+
+    # The modal lists are only read when the modal is shown
+    expired, expiring, low, out = [], [], [], []
+    if show_modal:
+        expired, expiring, low, out = await asyncio.gather(
+            alist(Drug.objects.filter(filters['expired'])),
+            alist(Drug.objects.filter(filters['expiring_soon']).order_by('expiry_date')),
+            alist(Drug.objects.filter(filters['low_stock'])),
+            alist(Drug.objects.filter(filters['out_of_stock'])),
+        )
+
+    context = dict(summary)
+    context.update({
+        'top_sold_products': top_sold_products,
+        'expired_drugs': expired,
+        'expiring_soon': expiring,
+        'low_stock': low,
+        'out_of_stock': out,
+        'show_modal': show_modal,
+    })
+    return await arender(request, 'Inventory/dashboard.html', context)
+
+
+@login_required
+async def low_stock_view(request):
+    low_stock = await acached_drugs('low_stock', Q(stock__lte=F('reorder_level'), stock__gt=0))
+    return await arender(request, 'Inventory/lowstock.html', {'low_stock': low_stock})
+
+
+async def get_online_offline_users(request):
+    all_users = await ausers_with_presence()
+    return JsonResponse({
+        'online_users': [user.username for user in all_users if user.is_online],
+        'offline_users': [user.username for user in all_users if not user.is_online],
+    })
+
+
+@login_required
+async def out_of_stock(request):
+    out_of_stock_products = await acached_drugs('out_of_stock', Q(stock=0))
+    return await arender(request, 'Inventory/out_of_stock.html', {'out_of_stock': out_of_stock_products})
+
+
+@login_required
+async def expiring_soon(request):
+    today = timezone.now().date()
+    expiring_products = await acached_drugs(
+        'expiring_soon',
+        Q(expiry_date__lte=today + timedelta(days=EXPIRING_SOON_DAYS), stock__gt=0),
+        ('expiry_date',), today,
+    )
+    return await arender(request, 'Inventory/expiring_soon.html', {'expiring_soon': expiring_products})
+
+
+async def search(request):
+    query = request.POST.get('q')
+    if query:
+        drugs = asearch(
+            Drug.objects.all(), 'drug', query, Q(name__icontains=query) | Q(batch_no__icontains=query)
+        )
+    else:
+        drugs = alist(Drug.objects.all().order_by('name'))
+    drugs, clients = await asyncio.gather(drugs, aclient_choices())
+    return await arender(request, 'Inventory/home.html', {'drugs': drugs, 'clients': clients})
+
+
+async def binsearch(request):
+    bins = Sale.objects.for_report().order_by('drug_sold')
+    query = request.GET.get('search') or request.POST.get('quiz')
+    if query:
+        sales = await sync_to_async(search_filter)(
+            bins, 'sale', query,
+            Q(drug_sold__icontains=query) |
+            Q(batch_no__icontains=query) |
+            Q(client__name__icontains=query)
+        )
+        bins = sales.order_by('date_sold')
+    return await arender(request, 'Inventory/bin.html', {'sales': await alist(bins)})
+
+
+async def searchstock(request):
+    query = request.POST.get('s')
+    if query:
+        drugs = await sync_to_async(search_filter)(
+            Drug.objects.all(), 'drug', query, Q(name__icontains=query), columns=['name']
+        )
+        drugs = drugs.order_by('name')
+    else:
+        drugs = Drug.objects.all().order_by('name')
+    return await arender(request, 'Inventory/stock.html', {'drugs': await alist(drugs)})
+
+
+@login_required
+async def locked_search(request):
+    query = request.POST.get('quiz', '').strip()
+    drug_matches = await sync_to_async(search_match)('drug', query, columns=['name']) if query else None
+    drug_q = Q(drug__in=drug_matches) if drug_matches is not None else Q(drug__name__icontains=query)
+    locked_products = LockedProduct.objects.for_listing().filter(
+        drug_q | Q(locked_by__username__icontains=query)
+    ).order_by('-date_locked')
+    return await arender(request, 'Inventory/locked.html', {'locked_products': await alist(locked_products)})
+
+
+@login_required
+async def marketing_search(request):
+    if request.method != 'POST':
+        return await arender(request, 'Inventory/marketing_items.html', {
+            'marketing_items': [],
+            'search_query': '',
+        })
+    search_query = request.POST.get('search', '').strip()
+    marketing_items = await asearch(
+        MarketingItem.objects.all(), 'marketingitem', search_query, Q(name__icontains=search_query)
+    )
+    return await arender(request, 'Inventory/marketing_items.html', {
+        'marketing_items': marketing_items,
+        'search_query': search_query,
+    })
+
+
+async def search_cannister(request):
+    query = request.POST.get('q', '')
+    if query:
+        results = asearch(
+            Cannister.objects.all(), 'cannister', query,
+            Q(name__icontains=query) |
+            Q(batch_no__icontains=query) |
+            Q(stock__icontains=query) |
+            Q(litres__icontains=query)
+        )
+    else:
+        results = alist(Cannister.objects.none())
+    results, clients = await asyncio.gather(results, aclient_choices())
+    return await arender(request, 'Inventory/cannister.html', {
+        'cannisters': results, 'query': query, 'clients': clients,
+    })
@@ -0,0 +1,249 @@
+"""Timing harness for the report, search and export endpoints.
+
+Each ``Endpoint`` is requested through the Django test client as a
+logged-in user. Every request starts with an empty cache, so the
+numbers measure the work a cache miss costs and stay comparable between
+runs. Wall time is taken over several plain runs; the query count and
+peak Python memory come from one extra run with a query timer and
+``tracemalloc`` switched on, since both slow the request down.
+
+Streaming responses are consumed inside the timed region, so exports
+are measured to their last byte.
+
+``load()`` measures throughput instead: several clients request one
+endpoint at once, either through the WSGI handler from a thread pool or
+through the ASGI handler from concurrent tasks on one event loop, which
+is how uvicorn or daphne drive it. Both run in this process, without a
+network in between, so the numbers compare the handlers and views
+rather than the servers.
+"""
+import asyncio
+import statistics
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from io import StringIO
+
+from asgiref.sync import async_to_sync
+from django.core.management import call_command
+from django.db import connection
+from django.test import AsyncClient, Client as TestClient
+from django.urls import reverse
+
+from . import caching
+
+
+class Endpoint:
+    """A named request against one URL."""
+
+    def __init__(self, name, url_name, method='get', data=None):
+        self.name = name
+        self.url_name = url_name
+        self.method = method
+        self.data = data or {}
+
+    def request(self, client):
+        response = getattr(client, self.method)(reverse(self.url_name), self.data)
+        if response.status_code != 200:
+            raise AssertionError(f'{self.name} returned {response.status_code}')
+        if response.streaming:
+            size = sum(len(chunk) for chunk in response.streaming_content)
+        else:
+            size = len(response.content)
+        response.close()
+        return size
+
+    async def arequest(self, client):
+        response = await getattr(client, self.method)(reverse(self.url_name), self.data)
+        if response.status_code != 200:
+            raise AssertionError(f'{self.name} returned {response.status_code}')
+        return len(response.content)
+
+
+class QueryTimer:
+    """``execute_wrapper`` that counts queries and adds up their time."""
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.count += 1
+            self.seconds += time.perf_counter() - started
+
+
+# Search terms match rows generated by ``populate_dummy_data``
+ENDPOINTS = [
+    Endpoint('dashboard', 'dashboard'),
+    Endpoint('home', 'home'),
+    Endpoint('bin_report', 'bin_report'),
+    Endpoint('bin_card', 'bin_card'),
+    Endpoint('picking_list', 'picking_list'),
+    Endpoint('picking_list_search', 'picking_list', data={'search': 'Client 1'}),
+    Endpoint('search', 'search', 'post', {'q': 'Drug 1'}),
+    Endpoint('searchstock', 'searchstock', 'post', {'s': 'Aspirin'}),
+    Endpoint('bin_search', 'bin_search', data={'search': 'BATCH001'}),
+    Endpoint('locked_search', 'locked_search', 'post', {'quiz': 'Drug 1'}),
+    Endpoint('marketing_search', 'marketing_search', 'post', {'search': 'Item'}),
+    Endpoint('issued_items_search', 'issued_items_search', 'post', {'query': 'Department 1'}),
+    Endpoint('can_search', 'can_search', data={'search': 'Liquid A'}),
+    Endpoint('search_cannister', 'search_cannister', 'post', {'q': 'Liquid'}),
+    Endpoint('download_bin_report_excel', 'download_bin_report_excel'),
+    Endpoint('download_bin_card_excel', 'download_bin_card_excel'),
+    Endpoint('download_top_sold', 'download_top_sold'),
+]
+
+
+# The pages that have async versions, for comparing the WSGI and ASGI paths
+LOAD_ENDPOINTS = [
+    Endpoint('dashboard', 'dashboard'),
+    Endpoint('low_stock', 'low_stock'),
+    Endpoint('out_of_stock', 'out_of_stock'),
+    Endpoint('expiring_soon', 'expiring_soon'),
+    Endpoint('online_users', 'get_online_offline_users'),
+    Endpoint('search', 'search', 'post', {'q': 'Drug 1'}),
+    Endpoint('searchstock', 'searchstock', 'post', {'s': 'Aspirin'}),
+    Endpoint('locked_search', 'locked_search', 'post', {'quiz': 'Drug 1'}),
+]
+
+
+@contextmanager
+def scratch_database():
+    """Point the default connection at a throwaway test database for the duration."""
+    old_name = connection.settings_dict['NAME']
+    connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+    try:
+        yield
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+
+
+def seed(scale, seed=1):
+    """Fill the database with ``scale`` sales and proportionate drugs and clients."""
+    call_command(
+        'populate_dummy_data',
+        sales=scale, drugs=max(scale // 100, 10), clients=max(scale // 400, 5), days=90, seed=seed,
+        stdout=StringIO(),
+    )
+
+
+def measure(client, endpoint, repeat=5):
+    """Request ``endpoint`` ``repeat`` times and return its timings, query count and peak memory."""
+    timings = []
+    for _ in range(repeat):
+        caching.get_cache().clear()
+        started = time.perf_counter()
+        size = endpoint.request(client)
+        timings.append((time.perf_counter() - started) * 1000)
+
+    caching.get_cache().clear()
+    queries = QueryTimer()
+    tracemalloc.start()
+    try:
+        with connection.execute_wrapper(queries):
+            endpoint.request(client)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return {
+        'wall_ms': {
+            'min': round(min(timings), 2),
+            'median': round(statistics.median(timings), 2),
+            'max': round(max(timings), 2),
+        },
+        'queries': queries.count,
+        'db_ms': round(queries.seconds * 1000, 2),
+        'peak_kb': round(peak / 1024, 1),
+        'bytes': size,
+    }
+
+
+def run(user, endpoints=ENDPOINTS, repeat=5):
+    """Measure every endpoint as ``user``, returning results keyed by endpoint name."""
+    client = TestClient()
+    client.force_login(user)
+    return {endpoint.name: measure(client, endpoint, repeat) for endpoint in endpoints}
+
+
+def throughput(latencies, elapsed):
+    latencies = sorted(latencies)
+    return {
+        'requests': len(latencies),
+        'per_second': round(len(latencies) / elapsed, 1),
+        'p50_ms': round(statistics.median(latencies), 2),
+        'p95_ms': round(latencies[int(len(latencies) * 0.95) - 1], 2),
+        'max_ms': round(latencies[-1], 2),
+    }
+
+
+def _warm_clients(user, endpoint, count):
+    # Logged in and warmed one at a time, since the first request of a
+    # session may write to it and concurrent writes would contend on SQLite
+    clients = []
+    for _ in range(count):
+        client = TestClient()
+        client.force_login(user)
+        endpoint.request(client)
+        clients.append(client)
+    return clients
+
+
+def load_wsgi(clients, endpoint, requests):
+    """Send ``requests`` through the WSGI handler, one thread per client."""
+    per_client = max(requests // len(clients), 1)
+
+    def worker(client):
+        latencies = []
+        try:
+            for _ in range(per_client):
+                started = time.perf_counter()
+                endpoint.request(client)
+                latencies.append((time.perf_counter() - started) * 1000)
+        finally:
+            connection.close()
+        return latencies
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(len(clients)) as pool:
+        results = list(pool.map(worker, clients))
+    return throughput([ms for latencies in results for ms in latencies], time.perf_counter() - started)
+
+
+async def load_asgi(clients, endpoint, requests):
+    """Send ``requests`` through the ASGI handler, one task per client's session."""
+    async_clients = []
+    for client in clients:
+        async_client = AsyncClient()
+        async_client.cookies = client.cookies
+        async_clients.append(async_client)
+    per_client = max(requests // len(clients), 1)
+
+    async def worker(client):
+        latencies = []
+        for _ in range(per_client):
+            started = time.perf_counter()
+            await endpoint.arequest(client)
+            latencies.append((time.perf_counter() - started) * 1000)
+        return latencies
+
+    started = time.perf_counter()
+    results = await asyncio.gather(*(worker(client) for client in async_clients))
+    return throughput([ms for latencies in results for ms in latencies], time.perf_counter() - started)
+
+
+def load(user, endpoints=LOAD_ENDPOINTS, concurrency=10, requests=200):
+    """Throughput of every endpoint through both handlers, keyed by handler and endpoint name."""
+    report = {'wsgi': {}, 'asgi': {}}
+    for endpoint in endpoints:
+        caching.get_cache().clear()
+        report['wsgi'][endpoint.name] = load_wsgi(_warm_clients(user, endpoint, concurrency), endpoint, requests)
+        caching.get_cache().clear()
+        clients = _warm_clients(user, endpoint, concurrency)
+        report['asgi'][endpoint.name] = async_to_sync(load_asgi)(clients, endpoint, requests)
+    return report
@@ -0,0 +1,280 @@
+"""Streaming CSV and NDJSON exports of the transaction tables for BI jobs.
+
+Each ``Dataset`` names a model, the columns exported from it and the
+date column that ``start_date``/``end_date`` filter on. Rows are always
+ordered by ``id`` and read in keyset batches (``id > last``), so no
+cursor or transaction stays open while the response is sent and every
+batch is an index range scan whatever the table size.
+
+Incremental pulls pass the cursor returned by the previous pull as
+``since_id``. The upper bound is fixed when the request starts and sent
+back in the ``X-Next-Cursor`` header, so rows committed while a pull is
+streaming are left for the next one rather than half-read.
+
+Ids follow commit order on SQLite, which has one writer at a time, but
+PostgreSQL hands them out from a sequence before commit: a transaction
+that commits after a pull with an id below its cursor would be skipped
+by every later pull. Pulls therefore stop below the oldest row written
+in the last ``settings.BULK_EXPORT_LAG`` seconds, which holds back rows
+that may still have slower transactions interleaved with them. That
+covers transactions shorter than the lag, which stock movements are, but
+only for datasets with a timestamp; ``picking_list`` has just a date, so
+it is not capped and a pull can miss a line committed concurrently.
+"""
+import csv
+import json
+import zlib
+from datetime import datetime, time, timedelta
+
+from django.conf import settings
+from django.db import models
+from django.utils import timezone
+
+from . import metrics
+from .models import Sale, Stocked, IssuedCannister, IssuedItem, PickingList
+
+
+FORMATS = {
+    'csv': 'text/csv; charset=utf-8',
+    'ndjson': 'application/x-ndjson',
+}
+BATCH_SIZE = 2000
+MAX_LIMIT = 1000000
+
+
+class Dataset:
+    """A model exported as flat rows.
+
+    ``columns`` are ``(header, lookup)`` pairs and must start with ``id``,
+    which the keyset batches continue from.
+    """
+
+    def __init__(self, name, model, date_field, columns):
+        self.name = name
+        self.model = model
+        self.date_field = date_field
+        self.headers = [header for header, _ in columns]
+        self.lookups = [lookup for _, lookup in columns]
+
+    def queryset(self, start=None, end=None):
+        queryset = self.model._default_manager.all()
+        if start is not None:
+            queryset = queryset.filter(**{f'{self.date_field}__gte': self._bound(start)})
+        if end is not None:
+            # Dates are inclusive; datetimes stop before midnight of the next day
+            if self._is_datetime():
+                queryset = queryset.filter(**{f'{self.date_field}__lt': self._bound(end + timedelta(days=1))})
+            else:
+                queryset = queryset.filter(**{f'{self.date_field}__lte': end})
+        return queryset
+
+    def _is_datetime(self):
+        return isinstance(self.model._meta.get_field(self.date_field), models.DateTimeField)
+
+    def _bound(self, day):
+        if self._is_datetime():
+            return timezone.make_aware(datetime.combine(day, time.min))
+        return day
+
+    def rows(self, queryset, after, until, batch_size=BATCH_SIZE):
+        """Yield value tuples for ids in ``(after, until]``, one keyset batch at a time."""
+        last = after
+        while True:
+            batch = list(
+                queryset.filter(id__gt=last, id__lte=until)
+                .order_by('id')
+                .values_list(*self.lookups)[:batch_size]
+            )
+            yield from batch
+            if len(batch) < batch_size:
+                return
+            last = batch[-1][0]
+
+
+DATASETS = {
+    dataset.name: dataset for dataset in [
+        Dataset('sales', Sale, 'date_sold', [
+            ('id', 'id'),
+            ('date_sold', 'date_sold'),
+            ('drug_id', 'drug_id'),
+            ('drug', 'drug_sold'),
+            ('batch_no', 'batch_no'),
+            ('quantity', 'quantity'),
+            ('remaining_quantity', 'remaining_quantity'),
+            ('client_id', 'client_id'),
+            ('client', 'client__name'),
+            ('seller', 'seller__username'),
+        ]),
+        Dataset('stocked', Stocked, 'date_added', [
+            ('id', 'id'),
+            ('date_added', 'date_added'),
+            ('drug_id', 'drug_name_id'),
+            ('drug', 'drug_name__name'),
+            ('batch_no', 'drug_name__batch_no'),
+            ('number_added', 'number_added'),
+            ('total', 'total'),
+            ('supplier', 'supplier'),
+            ('staff', 'staff__username'),
+        ]),
+        Dataset('issued_cannisters', IssuedCannister, 'date_issued', [
+            ('id', 'id'),
+            ('date_issued', 'date_issued'),
+            ('date_returned', 'date_returned'),
+            ('cannister_id', 'cannister_id'),
+            ('name', 'name'),
+            ('batch_no', 'batch_no'),
+            ('quantity', 'quantity'),
+            ('balance', 'balance'),
+            ('returned', 'action'),
+            ('client', 'client__name'),
+            ('staff_on_duty', 'staff_on_duty__username'),
+            ('returned_by', 'returned_by__username'),
+        ]),
+        Dataset('issued_items', IssuedItem, 'date_issued', [
+            ('id', 'id'),
+            ('date_issued', 'date_issued'),
+            ('marketing_item_id', 'marketing_item_id'),
+            ('item', 'item'),
+            ('issued_to', 'issued_to'),
+            ('quantity_issued', 'quantity_issued'),
+            ('stock', 'stock'),
+            ('issued_by', 'issued_by__username'),
+        ]),
+        Dataset('picking_list', PickingList, 'date', [
+            ('id', 'id'),
+            ('date', 'date'),
+            ('drug_id', 'drug_id'),
+            ('product', 'product'),
+            ('batch_no', 'batch_no'),
+            ('quantity', 'quantity'),
+            ('client', 'client__name'),
+        ]),
+    ]
+}
+
+
+def _plain(value):
+    return value.isoformat() if hasattr(value, 'isoformat') else value
+
+
+class _Echo:
+    """File object for ``csv.writer`` that returns each line instead of storing it."""
+
+    def write(self, value):
+        return value
+
+
+def encode_csv(headers, rows):
+    writer = csv.writer(_Echo())
+    yield writer.writerow(headers).encode('utf-8')
+    for row in rows:
+        yield writer.writerow([_plain(value) for value in row]).encode('utf-8')
+
+
+def encode_ndjson(headers, rows):
+    for row in rows:
+        record = {header: _plain(value) for header, value in zip(headers, row)}
+        yield (json.dumps(record, separators=(',', ':')) + '\n').encode('utf-8')
+
+
+ENCODERS = {'csv': encode_csv, 'ndjson': encode_ndjson}
+
+
+def batched(chunks, size=64 * 1024):
+    """Join small encoded lines into chunks of roughly ``size`` bytes."""
+    buffer = []
+    buffered = 0
+    for chunk in chunks:
+        buffer.append(chunk)
+        buffered += len(chunk)
+        if buffered >= size:
+            yield b''.join(buffer)
+            buffer = []
+            buffered = 0
+    if buffer:
+        yield b''.join(buffer)
+
+
+def gzipped(chunks, level=6):
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)  # wbits=31 writes a gzip header
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def parse_params(params):
+    """Validate the query string of a bulk export; raises ``ValueError`` with a message."""
+    fmt = params.get('format', 'csv')
+    if fmt not in FORMATS:
+        raise ValueError(f'format must be one of {", ".join(FORMATS)}')
+
+    def day(name):
+        value = params.get(name)
+        if not value:
+            return None
+        try:
+            return datetime.strptime(value, '%Y-%m-%d').date()
+        except ValueError:
+            raise ValueError(f'{name} must be a YYYY-MM-DD date')
+
+    def number(name, default):
+        value = params.get(name)
+        if not value:
+            return default
+        try:
+            number = int(value)
+        except ValueError:
+            raise ValueError(f'{name} must be an integer')
+        if number < 0:
+            raise ValueError(f'{name} must not be negative')
+        return number
+
+    limit = number('limit', None)
+    return {
+        'format': fmt,
+        'gzip': params.get('gzip') in ('1', 'true', 'yes'),
+        'start_date': day('start_date'),
+        'end_date': day('end_date'),
+        'since_id': number('since_id', 0),
+        'limit': None if limit is None else min(limit, MAX_LIMIT),
+    }
+
+
+def _settled(dataset, after, until):
+    """Lower ``until`` below rows written within ``BULK_EXPORT_LAG`` seconds; see the module docstring."""
+    if not settings.BULK_EXPORT_LAG or not dataset._is_datetime():
+        return until
+    recent = timezone.now() - timedelta(seconds=settings.BULK_EXPORT_LAG)
+    first_recent = dataset.model._default_manager.filter(
+        **{f'{dataset.date_field}__gte': recent}, id__gt=after, id__lte=until
+    ).aggregate(first=models.Min('id'))['first']
+    return until if first_recent is None else first_recent - 1
+
+
+def prepare(dataset, options):
+    """Return ``(chunks, next_cursor)`` for an export of ``dataset``.
+
+    ``next_cursor`` is the highest id included, or ``since_id`` when
+    there are no new rows; it is known before any row is streamed.
+    """
+    queryset = dataset.queryset(options['start_date'], options['end_date'])
+    after = options['since_id']
+    newer = queryset.filter(id__gt=after).order_by('id').values_list('id', flat=True)
+    limit = options['limit']
+    until = None
+    if limit == 0:
+        until = after
+    elif limit is not None:
+        # The id of the last row inside the limit, if there are that many
+        until = next(iter(newer[limit - 1:limit]), None)
+    if until is None:
+        until = newer.order_by('-id').first() or after
+    until = _settled(dataset, after, until)
+
+    rows = metrics.track_export(f'bulk_{dataset.name}', dataset.rows(queryset, after, until))
+    chunks = batched(ENCODERS[options['format']](dataset.headers, rows))
+    if options['gzip']:
+        chunks = gzipped(chunks)
+    return chunks, until
@@ -0,0 +1,134 @@
+"""Versioned caching for read-only fragments.
+
+Every cached value names the models it was computed from. Each model has
+a version number stored in the cache, and the versions of a value's
+models are part of its key, so bumping a model's version makes every
+dependent key unreachable without having to find and delete them. Writes
+bump versions through ``post_save``/``post_delete`` signals and, for the
+``UPDATE`` statements issued by the stock ledger, through ``touch()``.
+A write bumps straight away and again once its transaction commits, so
+a reader that re-cached the old data in between is invalidated too.
+
+A missing version is seeded from the clock rather than restarting at 1,
+so an evicted version can never make old entries reachable again.
+"""
+import time
+
+from django.core.cache import caches
+from django.core.cache.backends.base import DEFAULT_TIMEOUT
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+
+from . import metrics
+from .models import (
+    Drug, Sale, Stocked, LockedProduct, Client, Cannister, IssuedCannister, MarketingItem, PickingList
+)
+
+
+KEY_PREFIX = 'inventory'
+# Models whose writes invalidate cached fragments
+TRACKED_MODELS = [
+    Drug, Sale, Stocked, LockedProduct, Client, Cannister, IssuedCannister, MarketingItem, PickingList
+]
+
+
+def get_cache():
+    return caches['default']
+
+
+def _version_key(model):
+    return f'{KEY_PREFIX}:version:{model._meta.label_lower}'
+
+
+def versions(models):
+    """Return the current version of each model, seeding any that are missing."""
+    cache = get_cache()
+    keys = [_version_key(model) for model in models]
+    found = cache.get_many(keys)
+    for key in keys:
+        if key not in found:
+            cache.add(key, time.time_ns(), timeout=None)
+            found[key] = cache.get(key)
+    return [found[key] for key in keys]
+
+
+def _key(name, model_versions, parts):
+    stamp = '.'.join(str(version) for version in model_versions)
+    suffix = ':'.join(str(part) for part in parts)
+    return f'{KEY_PREFIX}:{name}:{stamp}:{suffix}'
+
+
+def make_key(name, models=(), *parts):
+    return _key(name, versions(models), parts)
+
+
+def cached(name, compute, models=(), parts=(), timeout=DEFAULT_TIMEOUT):
+    """Return the cached value of ``compute()``, keyed on ``parts`` and the models' versions.
+
+    ``timeout`` defaults to the cache's ``TIMEOUT``; ``None`` caches forever.
+    """
+    cache = get_cache()
+    key = make_key(name, models, *parts)
+    value = cache.get(key)
+    if value is None:
+        metrics.CACHE_REQUESTS.inc(fragment=name, result='miss')
+        value = compute()
+        cache.set(key, value, timeout)
+    else:
+        metrics.CACHE_REQUESTS.inc(fragment=name, result='hit')
+    return value
+
+
+async def aversions(models):
+    """``versions()`` through the cache's async API."""
+    cache = get_cache()
+    keys = [_version_key(model) for model in models]
+    found = await cache.aget_many(keys)
+    for key in keys:
+        if key not in found:
+            await cache.aadd(key, time.time_ns(), timeout=None)
+            found[key] = await cache.aget(key)
+    return [found[key] for key in keys]
+
+
+async def acached(name, compute, models=(), parts=(), timeout=DEFAULT_TIMEOUT):
+    """``cached()`` for async views: ``compute`` is a coroutine function.
+
+    Keys are shared with ``cached()``, so sync and async views reuse each
+    other's values.
+    """
+    cache = get_cache()
+    key = _key(name, await aversions(models), parts)
+    value = await cache.aget(key)
+    if value is None:
+        metrics.CACHE_REQUESTS.inc(fragment=name, result='miss')
+        value = await compute()
+        await cache.aset(key, value, timeout)
+    else:
+        metrics.CACHE_REQUESTS.inc(fragment=name, result='hit')
+    return value
+
+
+def bump(*models):
+    cache = get_cache()
+    for model in models:
+        key = _version_key(model)
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.add(key, time.time_ns(), timeout=None)
+
+
+def touch(*models):
+    """Invalidate everything cached from ``models``, now and when the current transaction commits."""
+    bump(*models)
+    transaction.on_commit(lambda: bump(*models))
+
+
+def _invalidate(sender, **kwargs):
+    touch(sender)
+
+
+for _model in TRACKED_MODELS:
+    post_save.connect(_invalidate, sender=_model, dispatch_uid=f'cache_invalidate_save_{_model.__name__}')
+    post_delete.connect(_invalidate, sender=_model, dispatch_uid=f'cache_invalidate_delete_{_model.__name__}')
@@ -0,0 +1,6 @@
+from django.conf import settings
+
+
+def exports(request):
+    """Whether pages should queue Excel exports for a worker or download them directly."""
+    return {'export_queue': settings.EXPORT_QUEUE}
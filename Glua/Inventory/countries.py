@@ -0,0 +1,92 @@
+"""Country calling codes for the client phone fields.
+
+The table is built once per process, on first use, from ``phonenumbers``
+and ``pycountry`` when they are installed and from a short built-in list
+otherwise. Stored phones are split back into code and number with a
+longest-prefix lookup in a digit trie of the calling codes.
+"""
+from functools import lru_cache
+
+try:
+    import pycountry
+    import phonenumbers
+except Exception:
+    pycountry = None
+    phonenumbers = None
+
+
+FALLBACK_COUNTRIES = (
+    {'code': '254', 'name': 'Kenya'},
+    {'code': '1', 'name': 'United States'},
+    {'code': '44', 'name': 'United Kingdom'},
+    {'code': '234', 'name': 'Nigeria'},
+    {'code': '91', 'name': 'India'},
+)
+
+# Marks the end of a complete calling code in the trie
+_CODE = '$'
+
+
+def _region_name(region):
+    try:
+        country = pycountry.countries.get(alpha_2=region)
+    except Exception:
+        country = None
+    return country.name if country else region
+
+
+@lru_cache(maxsize=None)
+def country_table():
+    """Return a tuple of ``{'code', 'name'}`` dicts ordered by calling code."""
+    if not (phonenumbers and pycountry):
+        return FALLBACK_COUNTRIES
+    names = {
+        str(code): ', '.join(sorted({_region_name(region) for region in regions}))
+        for code, regions in phonenumbers.COUNTRY_CODE_TO_REGION_CODE.items()
+    }
+    return tuple({'code': code, 'name': name} for code, name in sorted(names.items(), key=lambda x: int(x[0])))
+
+
+def get_countries():
+    """Return the list of country calling codes and names."""
+    return list(country_table())
+
+
+@lru_cache(maxsize=None)
+def calling_code_trie():
+    """Digit trie of every calling code in ``country_table()``."""
+    root = {}
+    for country in country_table():
+        node = root
+        for digit in country['code']:
+            node = node.setdefault(digit, {})
+        node[_CODE] = country['code']
+    return root
+
+
+def match_calling_code(digits):
+    """Return the longest calling code that ``digits`` starts with, or ''."""
+    node = calling_code_trie()
+    found = ''
+    for digit in digits:
+        node = node.get(digit)
+        if node is None:
+            break
+        found = node.get(_CODE, found)
+    return found
+
+
+def split_phone(phone):
+    """Split a stored phone such as ``+254712345678`` into ``(code, number)``.
+
+    Numbers without a leading ``+``, or whose code is unknown, come back
+    with an empty code and all their digits as the number.
+    """
+    if not phone:
+        return '', ''
+    cleaned = ''.join(ch for ch in phone if ch.isdigit() or ch == '+')
+    if not cleaned.startswith('+'):
+        return '', ''.join(ch for ch in cleaned if ch.isdigit())
+    digits = cleaned[1:]
+    code = match_calling_code(digits)
+    return code, digits[len(code):]
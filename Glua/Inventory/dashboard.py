@@ -0,0 +1,127 @@
+import asyncio
+from datetime import timedelta
+
+from django.db.models import Count, F, Q
+from django.utils import timezone
+
+from . import caching
+from .models import Drug, LockedProduct, MarketingItem, PickingList, Cannister
+
+
+# Products expiring within this many days count as "expiring soon"
+EXPIRING_SOON_DAYS = 180
+
+
+def drug_filters(today=None):
+    """Return the Q objects behind each dashboard drug KPI.
+
+    The same conditions are used for the aggregate counts and for the
+    modal lists, so the two can never disagree.
+    """
+    today = today or timezone.now().date()
+    return {
+        'expired': Q(expiry_date__lt=today, stock__gt=0),
+        'expiring_soon': Q(
+            expiry_date__lte=today + timedelta(days=EXPIRING_SOON_DAYS),
+            expiry_date__gt=today,
+            stock__gt=0,
+        ),
+        'low_stock': Q(stock__lte=F('reorder_level'), stock__gt=0),
+        'out_of_stock': Q(stock=0),
+        'zero_stock': Q(stock__lte=5),
+    }
+
+
+def dashboard_summary(today=None):
+    """Compute every dashboard KPI.
+
+    All Drug counts come from a single conditional-aggregation query; the
+    remaining tables need one COUNT each.
+    """
+    filters = drug_filters(today)
+    drugs = Drug.objects.aggregate(
+        total_products=Count('id'),
+        low_stock_products=Count('id', filter=filters['low_stock']),
+        out_of_stock_products=Count('id', filter=filters['out_of_stock']),
+        zero_stock_products=Count('id', filter=filters['zero_stock']),
+        expired_drugs_count=Count('id', filter=filters['expired']),
+        expiring_soon_count=Count('id', filter=filters['expiring_soon']),
+    )
+
+    summary = dict(drugs)
+    summary['total_expiring_count'] = drugs['expired_drugs_count'] + drugs['expiring_soon_count']
+    summary['locked_products'] = LockedProduct.objects.count()
+    summary['marketing_items'] = MarketingItem.objects.count()
+    summary['total_picking_list'] = PickingList.objects.count()
+    summary['cannisters'] = Cannister.objects.count()
+    return summary
+
+
+async def adashboard_summary(today=None):
+    """``dashboard_summary()`` with the async ORM, running its independent queries together."""
+    filters = drug_filters(today)
+    drugs, locked, marketing, picking, cannisters = await asyncio.gather(
+        Drug.objects.aaggregate(
+            total_products=Count('id'),
+            low_stock_products=Count('id', filter=filters['low_stock']),
+            out_of_stock_products=Count('id', filter=filters['out_of_stock']),
+            zero_stock_products=Count('id', filter=filters['zero_stock']),
+            expired_drugs_count=Count('id', filter=filters['expired']),
+            expiring_soon_count=Count('id', filter=filters['expiring_soon']),
+        ),
+        LockedProduct.objects.acount(),
+        MarketingItem.objects.acount(),
+        PickingList.objects.acount(),
+        Cannister.objects.acount(),
+    )
+
+    summary = dict(drugs)
+    summary['total_expiring_count'] = drugs['expired_drugs_count'] + drugs['expiring_soon_count']
+    summary['locked_products'] = locked
+    summary['marketing_items'] = marketing
+    summary['total_picking_list'] = picking
+    summary['cannisters'] = cannisters
+    return summary
+
+
+def cached_summary(today=None):
+    """``dashboard_summary()``, served from the cache until one of its tables changes."""
+    today = today or timezone.now().date()
+    return caching.cached(
+        'dashboard_summary', lambda: dashboard_summary(today),
+        models=[Drug, LockedProduct, MarketingItem, PickingList, Cannister], parts=[today],
+    )
+
+
+def cached_drugs(name, condition, ordering=(), today=None):
+    """The drugs matching ``condition`` as a cached list.
+
+    ``name`` identifies the list; ``today`` must be given when ``condition``
+    depends on the date.
+    """
+    def compute():
+        return list(Drug.objects.filter(condition).order_by(*ordering))
+    return caching.cached(f'drugs_{name}', compute, models=[Drug], parts=[today or ''])
+
+
+async def acached_summary(today=None):
+    today = today or timezone.now().date()
+    return await caching.acached(
+        'dashboard_summary', lambda: adashboard_summary(today),
+        models=[Drug, LockedProduct, MarketingItem, PickingList, Cannister], parts=[today],
+    )
+
+
+async def acached_drugs(name, condition, ordering=(), today=None):
+    async def compute():
+        return [drug async for drug in Drug.objects.filter(condition).order_by(*ordering)]
+    return await caching.acached(f'drugs_{name}', compute, models=[Drug], parts=[today or ''])
+
+
+def has_alerts(summary):
+    """True when the dashboard modal has something to report."""
+    return bool(
+        summary['low_stock_products']
+        or summary['expiring_soon_count']
+        or summary['out_of_stock_products']
+    )
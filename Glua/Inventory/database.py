@@ -0,0 +1,18 @@
+"""Per-connection database setup.
+
+SQLite reads its pragmas from ``settings.SQLITE_PRAGMAS`` each time a
+connection opens, since only ``journal_mode`` is stored in the file;
+the others last as long as the connection.
+"""
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+
+@receiver(connection_created)
+def apply_sqlite_pragmas(sender, connection, **kwargs):
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        for name, value in getattr(settings, 'SQLITE_PRAGMAS', {}).items():
+            cursor.execute(f'PRAGMA {name} = {value}')
@@ -0,0 +1,341 @@
+"""Streaming Excel exports built on the inventory transfer record template.
+
+The template is only used as a source of layout and styles: its header
+rows are rebuilt in an openpyxl write-only workbook, and the data rows
+are streamed straight into the zipped worksheet, so memory stays flat
+and the first bytes reach the client before the queryset is exhausted.
+``template_header()`` parses the template once per process and again
+only when the file changes on disk.
+
+Rows come from ``RowSource`` objects, which read only the exported
+columns, joins included, in one chunked query shared by the Excel and
+CSV downloads. ``EXPORTS`` names each Excel export together with the
+filters it accepts, so the download views and the background export
+jobs produce identical files.
+"""
+import io
+import os
+import threading
+import zipfile
+from copy import copy
+from datetime import datetime
+from xml.sax.saxutils import escape
+
+from django.conf import settings
+from django.db.models import Q
+from openpyxl import Workbook, load_workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.cell.cell import ILLEGAL_CHARACTERS_RE
+from openpyxl.utils import get_column_letter
+
+from .models import Sale, IssuedCannister
+
+
+TEMPLATE_NAME = 'Inventory transfer record template11.xlsx'
+TEMPLATE_SHEET = 'Template'
+HEADER_ROWS = 2  # Row 1 is the title band, row 2 holds the column labels
+BODY_STYLE_ROW = 3  # First placeholder data row, used for the body cell styles
+SHEET_PATH = 'xl/worksheets/sheet1.xml'
+XLSX_CONTENT_TYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+EXPORT_CHUNK_SIZE = 2000
+
+
+def template_path():
+    return os.path.join(settings.BASE_DIR, TEMPLATE_NAME)
+
+
+def _copy_style(source, target):
+    target.font = copy(source.font)
+    target.fill = copy(source.fill)
+    target.border = copy(source.border)
+    target.alignment = copy(source.alignment)
+    target.number_format = source.number_format
+    target.protection = copy(source.protection)
+
+
+class TemplateHeader:
+    """Header layout and cell styles read from the export template.
+
+    The template is parsed once and turned into a header-only workbook,
+    of which only the zip members are kept, so an export starts by copying
+    a few kilobytes of XML instead of loading the full template. The body
+    styles are registered with that workbook but never written, so their
+    ids are valid ``s=`` attributes for streamed cells.
+    """
+
+    def __init__(self, path=None):
+        wb = load_workbook(path or template_path())
+        ws = wb[TEMPLATE_SHEET]
+        columns = range(1, ws.max_column + 1)
+
+        self.widths = {
+            letter: dim.width for letter, dim in ws.column_dimensions.items() if dim.width
+        }
+        self.heights = {
+            idx: ws.row_dimensions[idx].height
+            for idx in range(1, HEADER_ROWS + 1)
+            if ws.row_dimensions[idx].height
+        }
+        self.merged = [
+            rng.coord for rng in ws.merged_cells.ranges if rng.max_row <= HEADER_ROWS
+        ]
+        rows = [[ws.cell(idx, col) for col in columns] for idx in range(1, HEADER_ROWS + 1)]
+        body = [ws.cell(BODY_STYLE_ROW, col) for col in columns]
+
+        xlsx, self.body_styles = self._build(rows, body)
+        with zipfile.ZipFile(io.BytesIO(xlsx)) as source:
+            self.files = [
+                (info.filename, source.read(info.filename))
+                for info in source.infolist() if info.filename != SHEET_PATH
+            ]
+            self.sheet_head, self.sheet_tail = source.read(SHEET_PATH).split(b'</sheetData>', 1)
+
+    def _build(self, rows, body):
+        wb = Workbook(write_only=True)
+        ws = wb.create_sheet(TEMPLATE_SHEET)
+        for letter, width in self.widths.items():
+            ws.column_dimensions[letter].width = width
+        for idx, height in self.heights.items():
+            ws.row_dimensions[idx].height = height
+        for coord in self.merged:
+            ws.merged_cells.add(coord)
+
+        for source_row in rows:
+            row = []
+            for source in source_row:
+                cell = WriteOnlyCell(ws, value=source.value)
+                _copy_style(source, cell)
+                row.append(cell)
+            ws.append(row)
+
+        body_styles = []
+        for source in body:
+            cell = WriteOnlyCell(ws)
+            _copy_style(source, cell)
+            body_styles.append(cell.style_id)
+
+        buffer = io.BytesIO()
+        wb.save(buffer)
+        return buffer.getvalue(), body_styles
+
+
+_headers = {}
+_headers_lock = threading.Lock()
+
+
+def template_header(path=None):
+    """The parsed ``TemplateHeader`` for ``path``, reloaded when the file's mtime changes."""
+    path = path or template_path()
+    mtime = os.stat(path).st_mtime_ns
+    cached = _headers.get(path)
+    if cached is not None and cached[0] == mtime:
+        return cached[1]
+    with _headers_lock:
+        cached = _headers.get(path)
+        if cached is None or cached[0] != mtime:
+            cached = _headers[path] = (mtime, TemplateHeader(path))
+    return cached[1]
+
+
+class _StreamBuffer:
+    """Unseekable file object that hands back what was written since the last drain."""
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def _cell_xml(ref, value, style):
+    style_attr = f' s="{style}"' if style else ''
+    if value is None or value == '':
+        return f'<c r="{ref}"{style_attr}/>' if style else ''
+    if isinstance(value, bool):
+        return f'<c r="{ref}"{style_attr} t="b"><v>{int(value)}</v></c>'
+    if isinstance(value, (int, float)):
+        return f'<c r="{ref}"{style_attr}><v>{value!r}</v></c>'
+    text = escape(ILLEGAL_CHARACTERS_RE.sub('', str(value)))
+    return f'<c r="{ref}"{style_attr} t="inlineStr"><is><t xml:space="preserve">{text}</t></is></c>'
+
+
+def _row_xml(row_idx, values, body_styles):
+    cells = []
+    for col_idx, value in enumerate(values, 1):
+        style = body_styles[col_idx - 1] if col_idx <= len(body_styles) else 0
+        cells.append(_cell_xml(f'{get_column_letter(col_idx)}{row_idx}', value, style))
+    return f'<row r="{row_idx}">{"".join(cells)}</row>'
+
+
+def stream_xlsx(rows, header=None, flush_every=500):
+    """Yield the bytes of an .xlsx export, writing ``rows`` below the template header.
+
+    ``rows`` may be any iterable of value sequences and is consumed lazily;
+    output is flushed every ``flush_every`` rows.
+    """
+    header = header or template_header()
+    body_styles = header.body_styles
+
+    output = _StreamBuffer()
+    with zipfile.ZipFile(output, 'w', zipfile.ZIP_DEFLATED) as archive:
+        for filename, data in header.files:
+            archive.writestr(filename, data)
+        yield output.drain()
+
+        with archive.open(SHEET_PATH, 'w', force_zip64=True) as sheet:
+            sheet.write(header.sheet_head)
+            for row_idx, values in enumerate(rows, HEADER_ROWS + 1):
+                sheet.write(_row_xml(row_idx, values, body_styles).encode('utf-8'))
+                if row_idx % flush_every == 0:
+                    yield output.drain()
+            sheet.write(b'</sheetData>' + header.sheet_tail)
+    yield output.drain()
+
+
+def _text(value):
+    return value if value else ''
+
+
+def _day(value):
+    return value.strftime('%Y-%m-%d') if value else ''
+
+
+class RowSource:
+    """Flat export rows read with a single joined ``values_list()`` query.
+
+    ``columns`` is a list of ``(lookup, formatter)`` pairs; lookups may span
+    relations (``client__name``) and are resolved by the database join
+    rather than by a lazy foreign key fetch per row.
+    """
+
+    def __init__(self, columns, chunk_size=EXPORT_CHUNK_SIZE):
+        self.fields = [lookup for lookup, _ in columns]
+        self.formatters = [formatter for _, formatter in columns]
+        self.chunk_size = chunk_size
+
+    def rows(self, queryset):
+        values = queryset.values_list(*self.fields).iterator(chunk_size=self.chunk_size)
+        for row in values:
+            yield tuple(
+                formatter(value) if formatter else value
+                for formatter, value in zip(self.formatters, row)
+            )
+
+
+BIN_REPORT_ROWS = RowSource([
+    ('drug_sold', _text),
+    ('batch_no', _text),
+    ('quantity', None),
+    ('client__name', _text),
+    ('date_sold', _day),
+])
+
+BIN_CARD_ROWS = RowSource([
+    ('name', _text),
+    ('batch_no', _text),
+    ('staff_on_duty__username', _text),
+    ('client__name', _text),
+    ('quantity', None),
+    ('balance', None),
+    ('date_issued', _day),
+    ('date_returned', _day),
+])
+
+TOP_SOLD_ROWS = RowSource([
+    ('drug_sold', None),
+    ('total_quantity', None),
+])
+
+
+def export_params(request):
+    """The filters an export accepts, read from the query string or the posted form."""
+    def first(*names):
+        for source in (request.GET, request.POST):
+            for name in names:
+                if source.get(name):
+                    return source.get(name)
+        return ''
+    return {
+        'search': first('search', 'q'),
+        'start_date': first('start_date'),
+        'end_date': first('end_date'),
+    }
+
+
+def _date_range(params):
+    """``(start, end)`` dates from ``params``, or None unless both are valid."""
+    try:
+        start = datetime.strptime(params.get('start_date') or '', "%Y-%m-%d").date()
+        end = datetime.strptime(params.get('end_date') or '', "%Y-%m-%d").date()
+    except ValueError:
+        return None
+    return start, end
+
+
+def check_export_params(params):
+    """Raise ``ValueError`` if a date filter in ``params`` is not a ``YYYY-MM-DD`` date."""
+    for name in ('start_date', 'end_date'):
+        try:
+            datetime.strptime(params.get(name) or '1970-01-01', "%Y-%m-%d")
+        except ValueError:
+            raise ValueError(f'{name} must be a YYYY-MM-DD date')
+
+
+def bin_report_sales(params):
+    sales = Sale.objects.all()
+    search = params.get('search')
+    if search:
+        sales = sales.filter(
+            Q(drug_sold__icontains=search) |
+            Q(batch_no__icontains=search) |
+            Q(client__name__icontains=search)
+        )
+    date_range = _date_range(params)
+    if date_range:
+        return sales.filter(date_sold__range=date_range).order_by('date_sold')
+    return sales.order_by('-date_sold')
+
+
+def bin_card_issues(params):
+    issued_cannisters = IssuedCannister.objects.all()
+    search = params.get('search')
+    if search:
+        issued_cannisters = issued_cannisters.filter(
+            Q(name__icontains=search) |
+            Q(batch_no__icontains=search) |
+            Q(staff_on_duty__username__icontains=search)
+        )
+    date_range = _date_range(params)
+    if date_range:
+        return issued_cannisters.filter(date_issued__range=date_range).order_by('date_issued')
+    return issued_cannisters.order_by('-date_issued')
+
+
+class Export:
+    """An Excel export: where its rows come from and what the file is called."""
+
+    def __init__(self, name, filename, queryset, rows):
+        self.name = name
+        self.filename = filename
+        self.queryset = queryset
+        self.row_source = rows
+
+    def rows(self, params):
+        return self.row_source.rows(self.queryset(params))
+
+
+EXPORTS = {
+    export.name: export for export in [
+        Export('bin_report', 'bin_report.xlsx', bin_report_sales, BIN_REPORT_ROWS),
+        Export('bin_card', 'bin_card.xlsx', bin_card_issues, BIN_CARD_ROWS),
+    ]
+}
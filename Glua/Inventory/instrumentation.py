@@ -0,0 +1,101 @@
+"""Per-request timing of views and their database queries.
+
+``InstrumentationMiddleware`` wraps every query the request runs with
+``connection.execute_wrapper`` and, once the response is ready, records:
+
+* a ``Server-Timing`` header (``total``, ``db`` and the query count),
+  which browser dev tools show next to the request;
+* one ``key=value`` log line per request on the ``Inventory.instrumentation``
+  logger, at WARNING when the request took longer than ``SLOW_REQUEST_MS``;
+* the SQL of every query slower than ``SLOW_QUERY_MS``.
+
+``duplicates`` counts queries whose SQL was already run by the same
+request, which is how N+1 loops in templates show up.
+
+The middleware is only loaded when ``settings.INSTRUMENTATION`` is true.
+Streaming responses are timed up to the point the response is returned,
+not until their last byte is sent.
+"""
+import logging
+import time
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connection
+
+
+logger = logging.getLogger(__name__)
+
+
+class RequestTiming:
+    """Queries run while handling one request, and how long they took."""
+
+    def __init__(self, slow_query_ms=None):
+        self.slow_query_ms = slow_query_ms
+        self.started = time.perf_counter()
+        self.total_ms = 0.0
+        self.queries = 0
+        self.db_ms = 0.0
+        self.statements = set()
+        self.duplicates = 0
+        self.slow_queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = (time.perf_counter() - started) * 1000
+            self.queries += 1
+            self.db_ms += elapsed
+            if sql in self.statements:
+                self.duplicates += 1
+            else:
+                self.statements.add(sql)
+            if self.slow_query_ms is not None and elapsed >= self.slow_query_ms:
+                self.slow_queries.append((elapsed, sql))
+
+    def finish(self):
+        self.total_ms = (time.perf_counter() - self.started) * 1000
+
+    def server_timing(self):
+        return (
+            f'total;dur={self.total_ms:.1f}, '
+            f'db;dur={self.db_ms:.1f};desc="{self.queries} queries"'
+        )
+
+
+def view_name(request):
+    match = getattr(request, 'resolver_match', None)
+    return match.view_name if match is not None else 'unresolved'
+
+
+class InstrumentationMiddleware:
+    """Time each request and its queries; see the module docstring."""
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'INSTRUMENTATION', False):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.slow_query_ms = settings.SLOW_QUERY_MS
+        self.slow_request_ms = settings.SLOW_REQUEST_MS
+
+    def __call__(self, request):
+        timing = RequestTiming(self.slow_query_ms)
+        request.timing = timing
+        with connection.execute_wrapper(timing):
+            response = self.get_response(request)
+        timing.finish()
+
+        response['Server-Timing'] = timing.server_timing()
+        view = view_name(request)
+        level = logging.WARNING if timing.total_ms >= self.slow_request_ms else logging.INFO
+        logger.log(
+            level,
+            'view=%s method=%s path=%s status=%s total_ms=%.1f db_ms=%.1f queries=%d duplicates=%d',
+            view, request.method, request.path, response.status_code,
+            timing.total_ms, timing.db_ms, timing.queries, timing.duplicates,
+        )
+        for elapsed, sql in timing.slow_queries:
+            logger.warning('slow_query view=%s db_ms=%.1f sql=%s', view, elapsed, sql)
+        return response
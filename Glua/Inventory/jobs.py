@@ -0,0 +1,169 @@
+"""Background Excel exports.
+
+A download request only records an ``ExportJob`` and returns; the
+workbook is written to ``settings.EXPORT_ROOT`` by a worker, and the
+browser polls the job until it can download the finished file.
+
+Workers are either the ``run_export_jobs`` management command, which
+can run as several processes, or, with ``EXPORT_WORKER_THREADS`` set, a
+thread pool inside the web process that picks jobs up as soon as they
+commit. Either way a job is claimed with a conditional ``UPDATE`` from
+``pending`` to ``running``, so two workers never produce the same job.
+
+Pages only queue jobs when ``settings.EXPORT_QUEUE`` says a worker is
+running. Jobs that stay pending or running longer than
+``EXPORT_JOB_TIMEOUT``, because no worker took them or their worker
+died, are failed by ``fail_stale()`` so that the page stops polling.
+"""
+import logging
+import os
+import secrets
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from . import metrics
+from .exports import EXPORTS, stream_xlsx, template_header
+from .models import ExportJob
+
+
+logger = logging.getLogger(__name__)
+
+# Rows written between progress updates
+PROGRESS_EVERY = 1000
+
+_executor = None
+
+
+def enqueue(kind, params, user):
+    """Record an export of ``kind`` with ``params`` and return the pending ``ExportJob``."""
+    job = ExportJob.objects.create(kind=kind, params=params, requested_by=user)
+    if settings.EXPORT_WORKER_THREADS:
+        transaction.on_commit(lambda: get_executor().submit(_run_in_thread))
+    return job
+
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(settings.EXPORT_WORKER_THREADS, thread_name_prefix='export')
+    return _executor
+
+
+def _run_in_thread():
+    try:
+        purge_expired()
+        run_pending()
+    except Exception:
+        logger.exception('Export worker thread failed')
+    finally:
+        connection.close()
+
+
+def claim():
+    """Mark the oldest pending job as running and return it, or None when there is none."""
+    pending = ExportJob.objects.filter(status=ExportJob.PENDING).order_by('created_at', 'pk')
+    for pk in pending.values_list('pk', flat=True)[:10]:
+        claimed = ExportJob.objects.filter(pk=pk, status=ExportJob.PENDING).update(
+            status=ExportJob.RUNNING, started_at=timezone.now()
+        )
+        if claimed:
+            return ExportJob.objects.get(pk=pk)
+    return None
+
+
+def _with_progress(job, rows):
+    written = 0
+    for row in rows:
+        yield row
+        written += 1
+        if written % PROGRESS_EVERY == 0:
+            ExportJob.objects.filter(pk=job.pk).update(progress=written)
+
+
+def output_path(job):
+    # The random part keeps file names unguessable if EXPORT_ROOT is ever served directly
+    return os.path.join(settings.EXPORT_ROOT, f'{job.kind}-{job.pk}-{secrets.token_hex(8)}.xlsx')
+
+
+def run(job):
+    """Write ``job``'s workbook and record the outcome on the job."""
+    export = EXPORTS.get(job.kind)
+    path = output_path(job)
+    partial = f'{path}.part'
+    try:
+        if export is None:
+            raise ValueError(f'Unknown export {job.kind!r}')
+        queryset = export.queryset(job.params)
+        total = queryset.count()
+        ExportJob.objects.filter(pk=job.pk).update(total=total)
+
+        os.makedirs(settings.EXPORT_ROOT, exist_ok=True)
+        rows = _with_progress(job, metrics.track_export(job.kind, export.row_source.rows(queryset)))
+        with open(partial, 'wb') as f:
+            for chunk in stream_xlsx(rows, template_header()):
+                f.write(chunk)
+        os.replace(partial, path)
+    except Exception as e:
+        logger.exception('Export job %s failed', job.pk)
+        if os.path.exists(partial):
+            os.remove(partial)
+        ExportJob.objects.filter(pk=job.pk).update(
+            status=ExportJob.FAILED, error=str(e), finished_at=timezone.now()
+        )
+        return False
+
+    finished = ExportJob.objects.filter(pk=job.pk, status=ExportJob.RUNNING).update(
+        status=ExportJob.DONE, progress=total, output_path=path, finished_at=timezone.now()
+    )
+    if not finished:
+        # Timed out by fail_stale() while it ran; nobody will download it
+        os.remove(path)
+        return False
+    return True
+
+
+def run_pending():
+    """Run jobs until none are pending; return how many were run."""
+    count = 0
+    while True:
+        job = claim()
+        if job is None:
+            return count
+        run(job)
+        count += 1
+
+
+def fail_stale(jobs=None, now=None):
+    """Fail ``jobs`` pending or running for longer than ``EXPORT_JOB_TIMEOUT``; return how many."""
+    now = now or timezone.now()
+    cutoff = now - timedelta(seconds=settings.EXPORT_JOB_TIMEOUT)
+    jobs = ExportJob.objects.all() if jobs is None else jobs
+    stale = (
+        Q(status=ExportJob.PENDING, created_at__lt=cutoff) |
+        Q(status=ExportJob.RUNNING, started_at__lt=cutoff)
+    )
+    return jobs.filter(stale).update(
+        status=ExportJob.FAILED, error='Timed out waiting for an export worker', finished_at=now
+    )
+
+
+def purge_expired(now=None):
+    """Fail stale jobs, then delete finished jobs older than ``EXPORT_JOB_TTL`` seconds and their files."""
+    now = now or timezone.now()
+    fail_stale(now=now)
+    expired = ExportJob.objects.filter(
+        status__in=[ExportJob.DONE, ExportJob.FAILED],
+        finished_at__lt=now - timedelta(seconds=settings.EXPORT_JOB_TTL),
+    )
+    count = 0
+    for job in expired:
+        if job.output_path and os.path.exists(job.output_path):
+            os.remove(job.output_path)
+        job.delete()
+        count += 1
+    return count
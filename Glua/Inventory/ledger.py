@@ -0,0 +1,219 @@
+"""Stock ledger: every change to a stock level goes through here.
+
+Stock is never read, changed in Python and saved back. Decrements are a
+single conditional ``UPDATE ... SET stock = stock - q WHERE stock >= q``,
+so two workers selling the last units of a product cannot both succeed,
+and the movement record (``Sale``, ``Stocked``, ``LockedProduct``,
+``IssuedItem``, ``IssuedCannister``) is written in the same transaction
+as the stock change. The row stays locked by the ``UPDATE`` until
+commit, so the balance read back for the record is the one this
+transaction produced. Updates send no ``post_save``, so search documents
+that include the stock are rewritten here, in the same transaction.
+"""
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from . import caching, live, metrics, search
+from .models import (
+    Drug, Sale, Stocked, LockedProduct, MarketingItem, IssuedItem, Cannister, IssuedCannister
+)
+
+
+class StockError(Exception):
+    """A stock movement could not be applied."""
+
+
+class InsufficientStock(StockError):
+    def __init__(self, obj, quantity):
+        self.obj = obj
+        self.quantity = quantity
+        super().__init__(f'Not enough stock of {obj} to take {quantity}')
+
+
+class AlreadyProcessed(StockError):
+    """The lock or issue was already released by another request."""
+
+
+def _take(model, pk, quantity):
+    """Atomically remove ``quantity`` from ``model.stock``; return the new balance or None."""
+    updated = model.objects.filter(pk=pk, stock__gte=quantity).update(stock=F('stock') - quantity)
+    if not updated:
+        return None
+    caching.touch(model)
+    search.reindex_updated(model.objects.filter(pk=pk), ['stock'])
+    return model.objects.filter(pk=pk).values_list('stock', flat=True).get()
+
+
+def _give(queryset, quantity):
+    """Atomically add ``quantity`` to ``stock`` of the rows in ``queryset``; return the new balance."""
+    queryset.update(stock=F('stock') + quantity)
+    caching.touch(queryset.model)
+    search.reindex_updated(queryset, ['stock'])
+    return queryset.values_list('stock', flat=True).first()
+
+
+def _record(operation, quantity, drug=None):
+    """Count the movement in the metrics, and announce ``drug``'s new stock, once it has committed."""
+    stock = None
+    if drug is not None:
+        stock = {
+            'id': drug.pk, 'name': drug.name, 'batch_no': drug.batch_no,
+            'stock': drug.stock, 'reorder_level': drug.reorder_level,
+        }
+
+    def committed():
+        metrics.record_stock(operation, quantity)
+        if stock is not None:
+            live.stock_changed(operation, stock)
+    transaction.on_commit(committed)
+
+
+def _check_quantity(quantity):
+    # Stock columns are integers: a fraction would be stored as a REAL by
+    # SQLite and rounded by PostgreSQL, so only whole quantities move
+    if isinstance(quantity, bool) or not isinstance(quantity, int):
+        raise StockError('Quantity must be a whole number')
+    if quantity <= 0:
+        raise StockError('Quantity must be greater than zero')
+
+
+def sell(drug, quantity, client, seller):
+    """Sell ``quantity`` of ``drug`` to ``client`` and return the ``Sale``."""
+    _check_quantity(quantity)
+    with transaction.atomic():
+        balance = _take(Drug, drug.pk, quantity)
+        if balance is None:
+            raise InsufficientStock(drug, quantity)
+        drug.stock = balance
+        _record('sale', quantity, drug)
+        return Sale.objects.create(
+            seller=seller,
+            drug=drug,
+            drug_sold=drug.name,
+            client=client,
+            batch_no=drug.batch_no,
+            quantity=quantity,
+            remaining_quantity=balance,
+        )
+
+
+def lock(drug, quantity, client, locked_by):
+    """Reserve ``quantity`` of ``drug`` for ``client`` and return the ``LockedProduct``."""
+    _check_quantity(quantity)
+    with transaction.atomic():
+        balance = _take(Drug, drug.pk, quantity)
+        if balance is None:
+            raise InsufficientStock(drug, quantity)
+        drug.stock = balance
+        _record('lock', quantity, drug)
+        return LockedProduct.objects.create(
+            drug=drug, locked_by=locked_by, quantity=quantity, client=client
+        )
+
+
+def _release(locked):
+    deleted, _ = LockedProduct.objects.filter(pk=locked.pk).delete()
+    if not deleted:
+        raise AlreadyProcessed(f'{locked.drug} lock was already released')
+
+
+def unlock(locked):
+    """Cancel a lock and put its quantity back into stock; return the new balance."""
+    with transaction.atomic():
+        _release(locked)
+        if not locked.quantity:
+            _record('unlock', locked.quantity)
+            return locked.drug.stock
+        balance = _give(Drug.objects.filter(pk=locked.drug_id), int(locked.quantity))
+        locked.drug.stock = balance
+        _record('unlock', locked.quantity, locked.drug)
+        return balance
+
+
+def post_lock(locked, seller):
+    """Turn a lock into a sale. The stock already left when it was locked."""
+    with transaction.atomic():
+        _release(locked)
+        _record('lock_posted', locked.quantity)
+        drug = locked.drug
+        return Sale.objects.create(
+            seller=seller,
+            drug=drug,
+            drug_sold=drug.name,
+            client=locked.client,
+            batch_no=drug.batch_no,
+            quantity=locked.quantity,
+            remaining_quantity=Drug.objects.filter(pk=drug.pk).values_list('stock', flat=True).get(),
+        )
+
+
+def add_stock(drug, quantity, supplier, staff):
+    """Receive ``quantity`` of ``drug`` and return the ``Stocked`` record."""
+    _check_quantity(quantity)
+    with transaction.atomic():
+        balance = _give(Drug.objects.filter(pk=drug.pk), quantity)
+        drug.stock = balance
+        _record('stock_addition', quantity, drug)
+        return Stocked.objects.create(
+            drug_name=drug, supplier=supplier, staff=staff, number_added=quantity, total=balance
+        )
+
+
+def issue_item(item, quantity, issued_to, issued_by):
+    """Issue ``quantity`` of a marketing item and return the ``IssuedItem``."""
+    _check_quantity(quantity)
+    with transaction.atomic():
+        balance = _take(MarketingItem, item.pk, quantity)
+        if balance is None:
+            raise InsufficientStock(item, quantity)
+        item.stock = balance
+        _record('item_issue', quantity)
+        return IssuedItem.objects.create(
+            marketing_item=item,
+            item=item.name,
+            stock=balance,
+            issued_to=issued_to,
+            quantity_issued=quantity,
+            issued_by=issued_by,
+        )
+
+
+def issue_cannister(cannister, quantity, client, staff):
+    """Issue ``quantity`` cannisters to ``client`` and return the ``IssuedCannister``."""
+    _check_quantity(quantity)
+    with transaction.atomic():
+        balance = _take(Cannister, cannister.pk, quantity)
+        if balance is None:
+            raise InsufficientStock(cannister, quantity)
+        cannister.stock = balance
+        _record('cannister_issue', quantity)
+        return IssuedCannister.objects.create(
+            cannister=cannister,
+            name=cannister.name,
+            batch_no=cannister.batch_no,
+            staff_on_duty=staff,
+            client=client,
+            quantity=quantity,
+            balance=balance,
+        )
+
+
+def return_cannister(issued, returned_by):
+    """Mark an issue as returned and put the cannisters back; return the new balance."""
+    returned_at = timezone.now()
+    with transaction.atomic():
+        updated = IssuedCannister.objects.filter(pk=issued.pk, action=False).update(
+            action=True, returned_by=returned_by, date_returned=returned_at
+        )
+        if not updated:
+            raise AlreadyProcessed(f'{issued.name} {issued.batch_no} was already returned')
+        issued.action = True
+        issued.returned_by = returned_by
+        issued.date_returned = returned_at
+        _record('cannister_return', issued.quantity)
+        if issued.cannister_id is not None:
+            cannisters = Cannister.objects.filter(pk=issued.cannister_id)
+        else:
+            cannisters = Cannister.objects.filter(batch_no=issued.batch_no)
+        return _give(cannisters, issued.quantity)
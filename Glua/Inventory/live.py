@@ -0,0 +1,54 @@
+"""Live updates pushed to open pages over the channel layer.
+
+Two groups are used: ``user_status`` carries presence changes to every
+page (``base.html``), and ``stock`` carries a drug's new stock level,
+with the dashboard counts, after each committed sale, lock, unlock or
+stock addition, so open ``home`` and ``dashboard`` tabs update without
+a reload.
+
+Messages are sent from synchronous code once the change has committed.
+The default in-memory channel layer only reaches sockets served by the
+same process; with several processes, or with WSGI workers alongside
+the ASGI server, set ``GLUA_CHANNEL_LAYER=redis``. A broadcast that
+fails is logged and never fails the request that caused it.
+"""
+import logging
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+
+from .dashboard import cached_summary
+
+
+logger = logging.getLogger(__name__)
+
+PRESENCE_GROUP = 'user_status'
+STOCK_GROUP = 'stock'
+
+
+def broadcast(group, message):
+    layer = get_channel_layer()
+    if layer is None:
+        return
+    try:
+        async_to_sync(layer.group_send)(group, message)
+    except Exception:
+        logger.exception('Could not broadcast to %s', group)
+
+
+def presence_changed(username, status):
+    broadcast(PRESENCE_GROUP, {'type': 'user.status', 'user': username, 'status': status})
+
+
+def stock_changed(operation, drug):
+    """Announce ``drug``'s stock, a dict of ``id``, ``name``, ``batch_no``, ``stock`` and ``reorder_level``."""
+    summary = cached_summary()
+    broadcast(STOCK_GROUP, {
+        'type': 'stock.changed',
+        'operation': operation,
+        'drug': drug,
+        'summary': {
+            name: summary[name]
+            for name in ('total_products', 'low_stock_products', 'out_of_stock_products')
+        },
+    })
@@ -0,0 +1,64 @@
+import json
+import platform
+
+import django
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from Inventory import benchmarks
+
+
+class Command(BaseCommand):
+    help = (
+        'Time the report, search and export endpoints against seeded data sets, '
+        'writing JSON that can be diffed between releases. Runs in a throwaway test database.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scales', default='1000,10000',
+                            help='Comma-separated numbers of sales to seed, one run each (default 1000,10000)')
+        parser.add_argument('--repeat', type=int, default=5, help='Timed requests per endpoint (default 5)')
+        parser.add_argument('--seed', type=int, default=1, help='Random seed for the data sets (default 1)')
+        parser.add_argument('--only', default='', help='Comma-separated endpoint names to run (default all)')
+        parser.add_argument('--output', help='Write the JSON report to this file instead of stdout')
+
+    def handle(self, *args, **options):
+        try:
+            scales = [int(scale) for scale in options['scales'].split(',') if scale.strip()]
+        except ValueError:
+            raise CommandError('--scales must be a comma-separated list of integers')
+        endpoints = benchmarks.ENDPOINTS
+        if options['only']:
+            names = {name.strip() for name in options['only'].split(',')}
+            unknown = names - {endpoint.name for endpoint in endpoints}
+            if unknown:
+                raise CommandError(f'Unknown endpoints: {", ".join(sorted(unknown))}')
+            endpoints = [endpoint for endpoint in endpoints if endpoint.name in names]
+
+        report = {
+            'django': django.get_version(),
+            'python': platform.python_version(),
+            'database': connection.vendor,
+            'seed': options['seed'],
+            'repeat': options['repeat'],
+            'scales': {},
+        }
+
+        # Never seed or time the real database
+        with benchmarks.scratch_database():
+            for scale in scales:
+                self.stderr.write(f'Seeding {scale} sales...')
+                benchmarks.seed(scale, options['seed'])
+                user = User.objects.get(username='admin')
+                self.stderr.write(f'Timing {len(endpoints)} endpoints...')
+                report['scales'][str(scale)] = benchmarks.run(user, endpoints, options['repeat'])
+
+        output = json.dumps(report, indent=2, sort_keys=True)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(output + '\n')
+            self.stderr.write(self.style.SUCCESS(f'Benchmark report written to {options["output"]}'))
+        else:
+            self.stdout.write(output)
+
@@ -0,0 +1,63 @@
+import json
+import platform
+
+import django
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from Inventory import benchmarks
+
+
+class Command(BaseCommand):
+    help = (
+        'Compare the throughput of the report and search pages through the WSGI and ASGI handlers '
+        'under concurrent clients. Run it once with GLUA_ASYNC_VIEWS=0 and once with GLUA_ASYNC_VIEWS=1 '
+        'to compare the sync and async views. Runs in a throwaway test database.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sales', type=int, default=10000, help='Number of sales to seed (default 10000)')
+        parser.add_argument('--concurrency', type=int, default=10, help='Concurrent clients (default 10)')
+        parser.add_argument('--requests', type=int, default=200,
+                            help='Requests per endpoint and handler, shared between the clients (default 200)')
+        parser.add_argument('--seed', type=int, default=1, help='Random seed for the data set (default 1)')
+        parser.add_argument('--only', default='', help='Comma-separated endpoint names to run (default all)')
+        parser.add_argument('--output', help='Write the JSON report to this file instead of stdout')
+
+    def handle(self, *args, **options):
+        if options['concurrency'] < 1 or options['requests'] < 1:
+            raise CommandError('--concurrency and --requests must be at least 1')
+        endpoints = benchmarks.LOAD_ENDPOINTS
+        if options['only']:
+            names = {name.strip() for name in options['only'].split(',')}
+            unknown = names - {endpoint.name for endpoint in endpoints}
+            if unknown:
+                raise CommandError(f'Unknown endpoints: {", ".join(sorted(unknown))}')
+            endpoints = [endpoint for endpoint in endpoints if endpoint.name in names]
+
+        report = {
+            'django': django.get_version(),
+            'python': platform.python_version(),
+            'database': connection.vendor,
+            'async_views': settings.ASYNC_VIEWS,
+            'sales': options['sales'],
+            'seed': options['seed'],
+            'concurrency': options['concurrency'],
+        }
+
+        with benchmarks.scratch_database():
+            self.stderr.write(f'Seeding {options["sales"]} sales...')
+            benchmarks.seed(options['sales'], options['seed'])
+            user = User.objects.get(username='admin')
+            self.stderr.write(f'Loading {len(endpoints)} endpoints with {options["concurrency"]} clients...')
+            report.update(benchmarks.load(user, endpoints, options['concurrency'], options['requests']))
+
+        output = json.dumps(report, indent=2, sort_keys=True)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(output + '\n')
+            self.stderr.write(self.style.SUCCESS(f'Load test report written to {options["output"]}'))
+        else:
+            self.stdout.write(output)
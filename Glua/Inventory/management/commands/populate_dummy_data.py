@@ -1,208 +1,296 @@
-from django.core.management.base import BaseCommand
+import random
+import time
+from contextlib import contextmanager
+from datetime import timedelta
+from itertools import accumulate
+
 from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
 from django.utils import timezone
-from datetime import datetime, timedelta
+
+from Inventory import caching, search
 from Inventory.models import (
-    Measurement, Drug, Sale, Stocked, LockedProduct, 
-    MarketingItem, IssuedItem, PickingList, Cannister, IssuedCannister, Client
+    Measurement, Drug, Sale, Stocked, LockedProduct,
+    MarketingItem, IssuedItem, PickingList, Cannister, IssuedCannister, Client,
+    ProductSalesTotal
 )
 
 
+DRUG_NAMES = [
+    'Paracetamol', 'Amoxicillin', 'Aspirin', 'Ibuprofen', 'Metformin',
+    'Ciprofloxacin', 'Atorvastatin', 'Lisinopril', 'Omeprazole', 'Loratadine',
+]
+MEASUREMENTS = ['Tablets', 'Capsules', 'Liquid (ml)', 'Syrup (ml)', 'Injection (ml)']
+STAFF = ['admin', 'staff1', 'staff2', 'staff3', 'staff4']
+# Relative trading volume by weekday, Monday first
+WEEKDAY_WEIGHTS = [1.0, 1.0, 1.0, 1.0, 0.9, 0.4, 0.1]
+OPENING_HOUR, PEAK_HOUR, CLOSING_HOUR = 8, 11, 18
+
+# Tables in the order they can be emptied without breaking foreign keys
+CLEAR_ORDER = [
+    Sale, ProductSalesTotal, LockedProduct, Stocked, IssuedCannister, IssuedItem,
+    PickingList, MarketingItem, Cannister, Drug, Measurement, Client,
+]
+
+
+@contextmanager
+def explicit_dates(model, *field_names):
+    """Let bulk_create keep the given values for ``auto_now_add`` fields."""
+    fields = [model._meta.get_field(name) for name in field_names]
+    for field in fields:
+        field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field in fields:
+            field.auto_now_add = True
+
+
 class Command(BaseCommand):
-    help = 'Populate database with dummy data for testing'
+    help = 'Populate database with dummy data for testing, at any scale'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--drugs', type=int, default=50, help='Number of drugs (default 50)')
+        parser.add_argument('--clients', type=int, default=25, help='Number of clients (default 25)')
+        parser.add_argument('--sales', type=int, default=150, help='Number of sales (default 150)')
+        parser.add_argument('--days', type=int, default=30,
+                            help='Spread sales and issues over this many past days (default 30)')
+        parser.add_argument('--seed', type=int, default=None, help='Random seed for a repeatable data set')
+        parser.add_argument('--batch-size', type=int, default=5000, help='Rows per bulk insert (default 5000)')
+
+    def handle(self, *args, **options):
+        self.rng = random.Random(options['seed'])
+        self.batch_size = options['batch_size']
+        self.days = max(options['days'], 1)
+        self.now = timezone.localtime()
+        n_drugs = max(options['drugs'], 1)
+        n_clients = max(options['clients'], 1)
+        n_sales = max(options['sales'], 0)
+        started = time.monotonic()
 
-    def handle(self, *args, **kwargs):
-        # Clear existing data (in correct order due to foreign key constraints)
         self.stdout.write('Clearing existing data...')
-        Sale.objects.all().delete()
-        LockedProduct.objects.all().delete()
-        Stocked.objects.all().delete()
-        IssuedCannister.objects.all().delete()
-        IssuedItem.objects.all().delete()
-        PickingList.objects.all().delete()
-        MarketingItem.objects.all().delete()
-        Cannister.objects.all().delete()
-        Drug.objects.all().delete()
-        Measurement.objects.all().delete()
-        Client.objects.all().delete()
-
-        # Get or create admin user
-        admin_user, _ = User.objects.get_or_create(
-            username='admin',
-            defaults={'email': 'admin@pharmsaver.com', 'is_staff': True, 'is_superuser': True}
-        )
-
-        # Create Measurements
-        self.stdout.write('Creating Measurements...')
-        measurements_data = ['Tablets', 'Capsules', 'Liquid (ml)', 'Syrup (ml)', 'Injection (ml)']
-        measurements = []
-        for i, name in enumerate(measurements_data):
-            measurement, _ = Measurement.objects.get_or_create(
-                name=name,
-                defaults={'expiry_date': timezone.now().date() + timedelta(days=365)}
+        self.clear()
+
+        self.staff = self.create_staff()
+        self.measurements = self.load(Measurement, (
+            Measurement(name=name, expiry_date=self.now.date() + timedelta(days=365)) for name in MEASUREMENTS
+        ), len(MEASUREMENTS), keep=True)
+        self.clients = self.load(Client, self.generate_clients(n_clients), n_clients, keep=True)
+        self.drugs = self.load(Drug, self.generate_drugs(n_drugs), n_drugs, keep=True)
+
+        # Popularity follows a long tail: a few products and clients account for most activity
+        self.drug_weights = self.long_tail(len(self.drugs))
+        self.client_weights = self.long_tail(len(self.clients))
+        self.day_weights = list(accumulate(
+            WEEKDAY_WEIGHTS[(self.now - timedelta(days=day)).weekday()] for day in range(self.days)
+        ))
+
+        with explicit_dates(Sale, 'date_sold'):
+            self.load(Sale, self.generate_sales(n_sales), n_sales)
+        with explicit_dates(Stocked, 'date_added'):
+            self.load(Stocked, self.generate_stocked(n_sales), n_sales)
+        n_locked = min(n_drugs * 2, max(n_sales // 2, 1))
+        with explicit_dates(LockedProduct, 'date_locked'):
+            self.load(LockedProduct, self.generate_locked(n_locked), n_locked)
+
+        self.marketing_items = self.load(MarketingItem, (
+            MarketingItem(name=f'Marketing Item {i}', stock=100 + i * 50) for i in range(1, 11)
+        ), 10, keep=True)
+        n_issued_items = max(n_sales // 5, 1)
+        self.load(IssuedItem, self.generate_issued_items(n_issued_items), n_issued_items)
+        n_picking = max(n_sales // 3, 1)
+        self.load(PickingList, self.generate_picking_list(n_picking), n_picking)
+
+        self.cannisters = self.load(Cannister, (
+            Cannister(name=f'Liquid {chr(65 + i)}', batch_no=f'CAN{i:03d}', stock=50 + i * 5, litres=f'{20 + i}L')
+            for i in range(15)
+        ), 15, keep=True)
+        n_issued_cannisters = max(n_sales // 2, 1)
+        self.load(IssuedCannister, self.generate_issued_cannisters(n_issued_cannisters), n_issued_cannisters)
+
+        # bulk_create skips the signals that maintain these
+        self.stdout.write('Rebuilding sales totals and search index...')
+        with transaction.atomic():
+            ProductSalesTotal.rebuild()
+            search.rebuild()
+        caching.bump(*caching.TRACKED_MODELS)
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Successfully populated database with dummy data in {time.monotonic() - started:.1f}s!'
+        ))
+
+    def clear(self):
+        # Plain DELETEs: QuerySet.delete() would load every row to send signals
+        with transaction.atomic(), connection.cursor() as cursor:
+            for model in CLEAR_ORDER:
+                cursor.execute(f'DELETE FROM {connection.ops.quote_name(model._meta.db_table)}')
+
+    def create_staff(self):
+        staff = []
+        for username in STAFF:
+            user, _ = User.objects.get_or_create(
+                username=username,
+                defaults={'email': f'{username}@pharmsaver.com', 'is_staff': True,
+                          'is_superuser': username == 'admin'}
+            )
+            staff.append(user)
+        return staff
+
+    def load(self, model, objects, total, keep=False):
+        """bulk_create ``objects`` in batches, reporting progress.
+
+        With ``keep`` the saved rows are returned, for tables that later
+        rows refer to; large tables are not held in memory.
+        """
+        label = model._meta.verbose_name_plural.title()
+        self.stdout.write(f'Creating {total} {label}...')
+        started = time.monotonic()
+        created = []
+        batch = []
+        for obj in objects:
+            batch.append(obj)
+            if len(batch) >= self.batch_size:
+                created.extend(self.insert(model, batch, keep))
+                batch = []
+        if batch:
+            created.extend(self.insert(model, batch, keep))
+        self.stdout.write(f'  ...done in {time.monotonic() - started:.1f}s')
+        return created
+
+    def insert(self, model, batch, keep):
+        with transaction.atomic():
+            rows = model.objects.bulk_create(batch, batch_size=self.batch_size)
+        if not keep:
+            return []
+        if rows and rows[0].pk is None:
+            # Backends that can't return ids from bulk inserts
+            rows = list(model.objects.order_by('-pk')[:len(rows)])[::-1]
+        return rows
+
+    def long_tail(self, count):
+        """Cumulative Zipf-like weights for ``count`` items."""
+        return list(accumulate(1 / (rank + 1) ** 0.8 for rank in range(count)))
+
+    def pick(self, items, cum_weights):
+        return self.rng.choices(items, cum_weights=cum_weights)[0]
+
+    def moment(self):
+        """A trading-hours timestamp within the last ``days`` days, weighted by weekday."""
+        day = self.rng.choices(range(self.days), cum_weights=self.day_weights)[0]
+        hour = self.rng.triangular(OPENING_HOUR, CLOSING_HOUR, PEAK_HOUR)
+        midnight = self.now.replace(hour=0, minute=0, second=0, microsecond=0) - timedelta(days=day)
+        moment = midnight + timedelta(hours=hour)
+        return min(moment, self.now)
+
+    def generate_clients(self, count):
+        for i in range(1, count + 1):
+            yield Client(
+                name=f'Client {i}',
+                email=f'client_{i}@example.com',
+                phone=f'+2547{self.rng.randrange(10 ** 8):08d}',
+            )
+
+    def generate_drugs(self, count):
+        today = self.now.date()
+        for i in range(1, count + 1):
+            reorder_level = 50 + (i % 100)
+            roll = self.rng.random()
+            if roll < 0.05:
+                stock = 0
+            elif roll < 0.15:
+                stock = self.rng.randint(1, reorder_level)
+            else:
+                stock = self.rng.randint(reorder_level + 1, 2000)
+            yield Drug(
+                name=f'Drug {i} - {DRUG_NAMES[i % len(DRUG_NAMES)]}',
+                batch_no=f'BATCH{i:04d}',
+                stock=stock,
+                dose_pack=250 + (i % 500),
+                expiry_date=today + timedelta(days=self.rng.randint(-60, 720)),
+                reorder_level=reorder_level,
+                measurement_units=self.measurements[i % len(self.measurements)],
             )
-            measurements.append(measurement)
-
-        # Create Clients
-        self.stdout.write('Creating Clients...')
-        clients_data = [f'Client {i}' for i in range(1, 26)]  # 25 clients
-        clients = []
-        for name in clients_data:
-            client, _ = Client.objects.get_or_create(
-                name=name,
-                defaults={
-                    'email': f'{name.lower().replace(" ", "_")}@example.com',
-                    'phone': '+254712345678'
-                }
+
+    def generate_sales(self, count):
+        for _ in range(count):
+            drug = self.pick(self.drugs, self.drug_weights)
+            quantity = self.rng.randint(1, 20) * 5
+            yield Sale(
+                seller=self.rng.choice(self.staff),
+                drug=drug,
+                drug_sold=drug.name,
+                client=self.pick(self.clients, self.client_weights),
+                batch_no=drug.batch_no,
+                quantity=quantity,
+                remaining_quantity=self.rng.randint(0, 500),
+                date_sold=self.moment(),
             )
-            clients.append(client)
-
-        # Create Drugs - significantly more drugs for ~500 data points
-        self.stdout.write('Creating Drugs...')
-        drugs_data = [
-            {'name': f'Drug {i} - {["Paracetamol", "Amoxicillin", "Aspirin", "Ibuprofen", "Metformin", "Ciprofloxacin", "Atorvastatin", "Lisinopril", "Omeprazole", "Loratadine"][i % 10]}', 
-             'batch_no': f'BATCH{i:04d}', 'stock': 100 + (i * 2), 'dose_pack': 250 + (i % 500), 'reorder_level': 50 + (i % 100)}
-            for i in range(1, 51)  # 50 different drugs
-        ]
-        
-        drugs = []
-        for drug_data in drugs_data:
-            drug, _ = Drug.objects.get_or_create(
-                name=drug_data['name'],
-                batch_no=drug_data['batch_no'],
-                defaults={
-                    'stock': drug_data['stock'],
-                    'dose_pack': drug_data['dose_pack'],
-                    'expiry_date': timezone.now().date() + timedelta(days=180 + (hash(drug_data['name']) % 365)),
-                    'reorder_level': drug_data['reorder_level'],
-                    'measurement_units': measurements[0]
-                }
+
+    def generate_stocked(self, count):
+        for _ in range(count):
+            drug = self.pick(self.drugs, self.drug_weights)
+            yield Stocked(
+                drug_name=drug,
+                staff=self.rng.choice(self.staff),
+                number_added=self.rng.randint(5, 50) * 10,
+                supplier=f'Supplier {self.rng.randint(1, 10)}',
+                total=drug.stock,
+                date_added=self.moment(),
             )
-            drugs.append(drug)
-
-        # Create Sales - scale up to ~150 sales
-        self.stdout.write('Creating Sales...')
-        for i, drug in enumerate(drugs):
-            for j in range(3):  # 3 sales per drug = 150 sales
-                client = clients[j % len(clients)]
-                Sale.objects.get_or_create(
-                    seller=admin_user,
-                    drug_sold=drug.name,
-                    client=client,
-                    batch_no=drug.batch_no,
-                    quantity=10 + (j * 5),
-                    remaining_quantity=5 + (j * 2),
-                    defaults={
-                        'date_sold': timezone.now() - timedelta(days=j)
-                    }
-                )
-
-        # Create Stocked Items - scale up to ~150 stocked items
-        self.stdout.write('Creating Stocked Items...')
-        for i, drug in enumerate(drugs):
-            for j in range(3):  # 3 stocked per drug = 150 stocked
-                Stocked.objects.get_or_create(
-                    drug_name=drug,
-                    staff=admin_user,
-                    number_added=50 + (j * 10),
-                    supplier=f'Supplier {j+1}',
-                    defaults={
-                        'date_added': timezone.now() - timedelta(days=j),
-                        'total': drug.stock
-                    }
-                )
-
-        # Create Locked Products - scale up to ~100 locked products
-        self.stdout.write('Creating Locked Products...')
-        for i, drug in enumerate(drugs):
-            for j in range(2):  # 2 locked per drug = 100 locked
-                if j < 2:
-                    client = clients[j % len(clients)]
-                    LockedProduct.objects.get_or_create(
-                        drug=drug,
-                        locked_by=admin_user,
-                        quantity=20 + (j * 5),
-                        client=client,
-                        defaults={
-                            'date_locked': timezone.now() - timedelta(days=j)
-                        }
-                    )
-
-        # Create Marketing Items
-        self.stdout.write('Creating Marketing Items...')
-        marketing_items_data = [
-            {'name': f'Marketing Item {i}', 'stock': 100 + (i * 50)}
-            for i in range(1, 11)  # 10 marketing items
-        ]
-        
-        for item_data in marketing_items_data:
-            MarketingItem.objects.get_or_create(
-                name=item_data['name'],
-                defaults={'stock': item_data['stock']}
+
+    def generate_locked(self, count):
+        for _ in range(count):
+            yield LockedProduct(
+                drug=self.pick(self.drugs, self.drug_weights),
+                locked_by=self.rng.choice(self.staff),
+                quantity=self.rng.randint(1, 10) * 5,
+                client=self.pick(self.clients, self.client_weights),
+                date_locked=self.moment(),
             )
 
-        # Create Issued Items - scale up to ~30 issued items
-        self.stdout.write('Creating Issued Items...')
-        for i in range(30):
-            IssuedItem.objects.get_or_create(
-                item=f'Issued Item {i+1}',
-                stock=100 + (i * 20),
-                issued_to=f'Department {(i % 5)+1}',
-                quantity_issued=25 + (i * 5),
-                issued_by=admin_user,
-                defaults={
-                    'date_issued': timezone.now() - timedelta(days=i % 30)
-                }
+    def generate_issued_items(self, count):
+        for _ in range(count):
+            item = self.rng.choice(self.marketing_items)
+            yield IssuedItem(
+                marketing_item=item,
+                item=item.name,
+                stock=self.rng.randint(0, 600),
+                issued_to=f'Department {self.rng.randint(1, 5)}',
+                quantity_issued=self.rng.randint(1, 20) * 5,
+                issued_by=self.rng.choice(self.staff),
+                date_issued=self.moment(),
             )
 
-        # Create Picking Lists - scale up to ~50 picking lists
-        self.stdout.write('Creating Picking Lists...')
-        for i in range(50):
-            client = clients[i % len(clients)]
-            PickingList.objects.get_or_create(
-                date=timezone.now().date() - timedelta(days=i % 30),
-                client=client,
-                product=drugs[i % len(drugs)].name,
-                batch_no=drugs[i % len(drugs)].batch_no,
-                quantity=30 + (i * 10),
+    def generate_picking_list(self, count):
+        for _ in range(count):
+            drug = self.pick(self.drugs, self.drug_weights)
+            yield PickingList(
+                date=self.moment().date(),
+                client=self.pick(self.clients, self.client_weights),
+                drug=drug,
+                product=drug.name,
+                batch_no=drug.batch_no,
+                quantity=self.rng.randint(1, 30) * 10,
             )
 
-        # Create Cannisters
-        self.stdout.write('Creating Cannisters...')
-        cannisters_data = [
-            {'name': f'Liquid {chr(65 + i)}', 'batch_no': f'CAN{i:03d}', 'stock': 50 + (i * 5), 'litres': f'{20 + i}L'}
-            for i in range(15)  # 15 different cannisters
-        ]
-        
-        cannisters = []
-        for cannister_data in cannisters_data:
-            cannister, _ = Cannister.objects.get_or_create(
-                name=cannister_data['name'],
-                batch_no=cannister_data['batch_no'],
-                defaults={
-                    'stock': cannister_data['stock'],
-                    'litres': cannister_data['litres']
-                }
+    def generate_issued_cannisters(self, count):
+        for _ in range(count):
+            cannister = self.rng.choice(self.cannisters)
+            issued = self.moment()
+            # Most cannisters come back within a fortnight; recent ones may still be out
+            returned = issued + timedelta(days=self.rng.expovariate(1 / 5))
+            is_returned = returned < self.now
+            yield IssuedCannister(
+                cannister=cannister,
+                name=cannister.name,
+                batch_no=cannister.batch_no,
+                staff_on_duty=self.rng.choice(self.staff),
+                returned_by=self.rng.choice(self.staff) if is_returned else None,
+                client=self.pick(self.clients, self.client_weights),
+                quantity=self.rng.randint(1, 10),
+                balance=self.rng.randint(0, cannister.stock),
+                action=is_returned,
+                date_issued=issued,
+                date_returned=returned if is_returned else issued,
             )
-            cannisters.append(cannister)
-
-        # Create Issued Cannisters - scale up to ~75 issued cannisters
-        self.stdout.write('Creating Issued Cannisters...')
-        for i, cannister in enumerate(cannisters):
-            for j in range(5):  # 5 issued per cannister = 75 issued
-                client = clients[j % len(clients)]
-                IssuedCannister.objects.get_or_create(
-                    name=cannister.name,
-                    batch_no=cannister.batch_no,
-                    staff_on_duty=admin_user,
-                    client=client,
-                    quantity=20 + (j * 5),
-                    balance=10 + (j * 2),
-                    action=j % 2 == 0,
-                    defaults={
-                        'date_issued': timezone.now() - timedelta(days=j),
-                        'date_returned': timezone.now() - timedelta(days=j-1) if j > 0 else timezone.now()
-                    }
-                )
-
-        self.stdout.write(self.style.SUCCESS('Successfully populated database with dummy data!'))
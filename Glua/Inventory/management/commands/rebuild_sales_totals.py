@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from Inventory.models import ProductSalesTotal
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the per-product sales totals from the full sales history'
+
+    def handle(self, *args, **kwargs):
+        self.stdout.write('Rebuilding product sales totals...')
+        with transaction.atomic():
+            count = ProductSalesTotal.rebuild()
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt sales totals for {count} products'))
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from Inventory import search
+
+
+class Command(BaseCommand):
+    help = 'Drop and rebuild the full-text search index for every searchable model'
+
+    def handle(self, *args, **kwargs):
+        if search.backend_for(search.connection) is None:
+            self.stdout.write(self.style.WARNING(
+                f'No search index for the {search.connection.vendor} backend; searches use plain lookups'))
+            return
+
+        self.stdout.write('Rebuilding search index...')
+        with transaction.atomic():
+            counts = search.rebuild()
+        for kind, count in counts.items():
+            self.stdout.write(f'  {kind}: {count} rows')
+        self.stdout.write(self.style.SUCCESS('Search index rebuilt'))
@@ -0,0 +1,28 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from Inventory import jobs
+
+
+class Command(BaseCommand):
+    help = 'Produce queued Excel exports, polling for new jobs until stopped'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Run the pending jobs and exit')
+        parser.add_argument('--interval', type=float, default=2.0,
+                            help='Seconds to wait between polls when idle (default 2)')
+
+    def handle(self, *args, **options):
+        while True:
+            close_old_connections()
+            purged = jobs.purge_expired()
+            if purged:
+                self.stdout.write(f'Removed {purged} expired export jobs')
+            count = jobs.run_pending()
+            if count:
+                self.stdout.write(self.style.SUCCESS(f'Finished {count} export jobs'))
+            if options['once']:
+                return
+            time.sleep(options['interval'])
@@ -0,0 +1,249 @@
+"""Prometheus-style metrics, served as plain text from ``/metrics``.
+
+Metrics live in memory in the worker process that recorded them, the
+same model as the official client library without its multiprocess
+mode: scrape each worker, or sum across them in the query. Nothing is
+written to the database or cache on the request path; recording is a
+dictionary update under a lock.
+
+Recorded here:
+
+* request latency per URL name, by ``MetricsMiddleware``;
+* stock movements and their quantities, by the stock ledger once the
+  movement has committed;
+* export durations and row counts, by ``track_export()``;
+* cached fragment hits and misses, by ``caching.cached()``;
+* queries and DB time per URL name, when ``InstrumentationMiddleware``
+  is also enabled, and the open database connections at scrape time.
+"""
+import threading
+import time
+from bisect import bisect_left
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+
+
+# Upper bounds in seconds, as in the reference client
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+def _number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def _key(self, labels):
+        return tuple(str(labels[name]) for name in self.label_names)
+
+    def samples(self):
+        """Yield ``(suffix, label_values, extra_labels, value)`` for every series."""
+        raise NotImplementedError
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.kind}']
+        for suffix, key, extra, value in self.samples():
+            lines.append(f'{self.name}{suffix}{_labels(self.label_names, key, extra)} {_number(value)}')
+        return lines
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(self._key(labels), 0)
+
+    def samples(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            yield '', key, (), value
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            series = self._values.get(key)
+            if series is None:
+                series = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][bisect_left(self.buckets, value)] += 1
+            series[1] += value
+
+    def count(self, **labels):
+        series = self._values.get(self._key(labels))
+        return sum(series[0]) if series else 0
+
+    def samples(self):
+        with self._lock:
+            items = sorted((key, (list(counts), total)) for key, (counts, total) in self._values.items())
+        for key, (counts, total) in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                yield '_bucket', key, [('le', _number(bound))], cumulative
+            yield '_sum', key, (), total
+            yield '_count', key, (), cumulative
+
+
+class Gauge(Metric):
+    """A value read when the metrics are rendered: ``collect()`` returns ``{label_values: value}``."""
+    kind = 'gauge'
+
+    def __init__(self, name, help, collect, labels=()):
+        super().__init__(name, help, labels)
+        self.collect = collect
+
+    def samples(self):
+        for key, value in sorted(self.collect().items()):
+            yield '', key, (), value
+
+
+def _open_connections():
+    counts = {}
+    for conn in connections.all(initialized_only=True):
+        key = (conn.alias, conn.vendor)
+        counts[key] = counts.get(key, 0) + (conn.connection is not None)
+    return counts
+
+
+def _cache_hit_ratios():
+    totals = {}
+    with CACHE_REQUESTS._lock:
+        items = list(CACHE_REQUESTS._values.items())
+    for (fragment, result), value in items:
+        hits, lookups = totals.get((fragment,), (0, 0))
+        totals[(fragment,)] = (hits + (value if result == 'hit' else 0), lookups + value)
+    return {key: hits / lookups for key, (hits, lookups) in totals.items() if lookups}
+
+
+REQUEST_LATENCY = Histogram(
+    'inventory_request_duration_seconds', 'Time to produce a response, by URL name.', ['view', 'method'])
+REQUEST_QUERIES = Counter(
+    'inventory_request_queries_total', 'Database queries run by requests, by URL name.', ['view'])
+REQUEST_DB_SECONDS = Counter(
+    'inventory_request_db_seconds_total', 'Time spent in database queries, by URL name.', ['view'])
+STOCK_OPERATIONS = Counter(
+    'inventory_stock_operations_total', 'Committed stock movements.', ['operation'])
+STOCK_QUANTITY = Counter(
+    'inventory_stock_quantity_total', 'Units moved by committed stock movements.', ['operation'])
+EXPORT_DURATION = Histogram(
+    'inventory_export_duration_seconds', 'Time to produce every row of an export.', ['export'],
+    buckets=(0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0))
+EXPORT_ROWS = Counter('inventory_export_rows_total', 'Rows written by exports.', ['export'])
+CACHE_REQUESTS = Counter(
+    'inventory_cache_requests_total', 'Cached fragment lookups.', ['fragment', 'result'])
+CACHE_HIT_RATIO = Gauge(
+    'inventory_cache_hit_ratio', 'Share of cached fragment lookups served from the cache.',
+    _cache_hit_ratios, ['fragment'])
+DB_CONNECTIONS = Gauge(
+    'inventory_db_connections_open', 'Database connections open in this process.',
+    _open_connections, ['alias', 'vendor'])
+
+REGISTRY = [
+    REQUEST_LATENCY, REQUEST_QUERIES, REQUEST_DB_SECONDS, STOCK_OPERATIONS, STOCK_QUANTITY,
+    EXPORT_DURATION, EXPORT_ROWS, CACHE_REQUESTS, CACHE_HIT_RATIO, DB_CONNECTIONS,
+]
+
+
+def render():
+    """The text exposition of every metric."""
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+
+def record_stock(operation, quantity):
+    STOCK_OPERATIONS.inc(operation=operation)
+    STOCK_QUANTITY.inc(quantity or 0, operation=operation)
+
+
+def track_export(name, rows):
+    """Pass ``rows`` through, recording the export's row count and duration once it is exhausted."""
+    started = time.perf_counter()
+    count = 0
+    for row in rows:
+        count += 1
+        yield row
+    EXPORT_ROWS.inc(count, export=name)
+    EXPORT_DURATION.observe(time.perf_counter() - started, export=name)
+
+
+def url_name(request):
+    match = getattr(request, 'resolver_match', None)
+    return (match.url_name or match.view_name) if match is not None else 'unresolved'
+
+
+class MetricsMiddleware:
+    """Record each request's latency under its URL name."""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'METRICS', False):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        started = time.perf_counter()
+        response = self.get_response(request)
+        return self.observe(request, response, started)
+
+    async def __acall__(self, request):
+        started = time.perf_counter()
+        response = await self.get_response(request)
+        return self.observe(request, response, started)
+
+    def observe(self, request, response, started):
+        view = url_name(request)
+        REQUEST_LATENCY.observe(time.perf_counter() - started, view=view, method=request.method)
+        timing = getattr(request, 'timing', None)
+        if timing is not None:
+            REQUEST_QUERIES.inc(timing.queries, view=view)
+            REQUEST_DB_SECONDS.inc(timing.db_ms / 1000, view=view)
+        return response
@@ -0,0 +1,38 @@
+from django.db import migrations, models
+from django.db.models import Sum
+
+
+def populate_totals(apps, schema_editor):
+    """Seed the rollup from the existing sales history"""
+    Sale = apps.get_model('Inventory', 'Sale')
+    ProductSalesTotal = apps.get_model('Inventory', 'ProductSalesTotal')
+
+    totals = Sale.objects.values('drug_sold').annotate(total_quantity=Sum('quantity')).order_by()
+    ProductSalesTotal.objects.bulk_create(
+        [ProductSalesTotal(drug_sold=row['drug_sold'], total_quantity=row['total_quantity'] or 0) for row in totals],
+        batch_size=500,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Inventory', '0026_client_country_code'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductSalesTotal',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('drug_sold', models.CharField(max_length=200, unique=True)),
+                ('total_quantity', models.FloatField(default=0)),
+            ],
+            options={
+                'verbose_name': 'Product Sales Total',
+                'verbose_name_plural': 'Product Sales Totals',
+                'ordering': ['-total_quantity'],
+            },
+        ),
+        migrations.RunPython(populate_totals, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,61 @@
+# Generated by Django 4.2.17 on 2026-10-17 16:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Inventory', '0027_productsalestotal'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='drug',
+            index=models.Index(fields=['expiry_date', 'stock'], name='drug_expiry_stock_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='drug',
+            index=models.Index(fields=['stock'], name='drug_stock_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='drug',
+            index=models.Index(fields=['name'], name='drug_name_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='issuedcannister',
+            index=models.Index(fields=['-date_issued'], name='issuedcan_date_issued_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='issuedcannister',
+            index=models.Index(fields=['batch_no'], name='issuedcan_batch_no_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='issueditem',
+            index=models.Index(fields=['-date_issued'], name='issueditem_date_issued_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='lockedproduct',
+            index=models.Index(fields=['-date_locked'], name='locked_date_locked_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='pickinglist',
+            index=models.Index(fields=['-date'], name='pickinglist_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='sale',
+            index=models.Index(fields=['date_sold'], name='sale_date_sold_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='sale',
+            index=models.Index(fields=['drug_sold', 'date_sold'], name='sale_drug_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='sale',
+            index=models.Index(fields=['batch_no'], name='sale_batch_no_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='stocked',
+            index=models.Index(fields=['-date_added'], name='stocked_date_added_idx'),
+        ),
+    ]
@@ -0,0 +1,56 @@
+import sqlite3
+
+from django.db import migrations
+
+
+# The index tables as they stood in this migration, frozen here so that a
+# later change to Inventory.search cannot change what a fresh migrate builds
+TABLES = {
+    'drug': ['name', 'batch_no'],
+    'sale': ['drug_sold', 'batch_no', 'client_name'],
+    'client': ['name', 'email', 'phone'],
+    'cannister': ['name', 'batch_no', 'stock', 'litres'],
+    'issuedcannister': ['name', 'batch_no', 'client_name', 'staff_on_duty_username'],
+    'issueditem': ['item', 'issued_to', 'issued_by_username'],
+    'marketingitem': ['name'],
+    'pickinglist': ['product', 'batch_no', 'client_name', 'quantity', 'date'],
+}
+
+
+def create_search_index(apps, schema_editor):
+    """Create the full-text index tables.
+
+    They start empty; on a database that already holds rows, fill them with
+    the rebuild_search_index command.
+    """
+    vendor = schema_editor.connection.vendor
+    for kind, columns in TABLES.items():
+        table = f'inventory_fts_{kind}'
+        if vendor == 'sqlite' and sqlite3.sqlite_version_info >= (3, 34):
+            schema_editor.execute(
+                f"CREATE VIRTUAL TABLE IF NOT EXISTS {table} "
+                f"USING fts5({', '.join(columns)}, tokenize='trigram')"
+            )
+        elif vendor == 'postgresql':
+            schema_editor.execute(
+                f'CREATE TABLE IF NOT EXISTS {table} '
+                f'(object_id integer PRIMARY KEY, document tsvector NOT NULL)'
+            )
+            schema_editor.execute(f'CREATE INDEX IF NOT EXISTS {table}_gin ON {table} USING GIN (document)')
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor in ('sqlite', 'postgresql'):
+        for kind in TABLES:
+            schema_editor.execute(f'DROP TABLE IF EXISTS inventory_fts_{kind}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Inventory', '0028_report_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
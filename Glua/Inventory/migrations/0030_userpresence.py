@@ -0,0 +1,27 @@
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('Inventory', '0029_search_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserPresence',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='presence', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('last_seen', models.DateTimeField()),
+                ('logged_in', models.BooleanField(default=True)),
+            ],
+            options={
+                'verbose_name': 'User Presence',
+                'verbose_name_plural': 'User Presence',
+                'indexes': [models.Index(fields=['logged_in', 'last_seen'], name='presence_online_idx')],
+            },
+        ),
+    ]
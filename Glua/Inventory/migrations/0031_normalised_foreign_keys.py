@@ -0,0 +1,36 @@
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Inventory', '0030_userpresence'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='issuedcannister',
+            name='cannister',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='issues', to='Inventory.cannister'),
+        ),
+        migrations.AddField(
+            model_name='issueditem',
+            name='marketing_item',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='issues', to='Inventory.marketingitem'),
+        ),
+        migrations.AddField(
+            model_name='pickinglist',
+            name='drug',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='picking_lines', to='Inventory.drug'),
+        ),
+        migrations.AddField(
+            model_name='sale',
+            name='drug',
+            field=models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='sales', to='Inventory.drug'),
+        ),
+        migrations.AddIndex(
+            model_name='sale',
+            index=models.Index(fields=['drug', 'date_sold'], name='sale_drug_id_date_idx'),
+        ),
+    ]
@@ -0,0 +1,51 @@
+from django.db import migrations
+from django.db.models import Max, Min, OuterRef, Q, Subquery
+
+
+# Rows updated per UPDATE statement, so no single statement holds the table for long
+BATCH_SIZE = 5000
+
+
+def _backfill(model, field, subquery, condition=Q()):
+    """Set ``field`` from ``subquery`` on unlinked rows, one primary key range at a time"""
+    unlinked = model.objects.filter(condition, **{f'{field}__isnull': True})
+    bounds = unlinked.aggregate(low=Min('pk'), high=Max('pk'))
+    if bounds['low'] is None:
+        return
+    for start in range(bounds['low'], bounds['high'] + 1, BATCH_SIZE):
+        unlinked.filter(pk__gte=start, pk__lt=start + BATCH_SIZE).update(**{field: Subquery(subquery[:1])})
+
+
+def link_rows(apps, schema_editor):
+    """Point the copied names at the rows they were copied from"""
+    Drug = apps.get_model('Inventory', 'Drug')
+    Sale = apps.get_model('Inventory', 'Sale')
+    PickingList = apps.get_model('Inventory', 'PickingList')
+    Cannister = apps.get_model('Inventory', 'Cannister')
+    IssuedCannister = apps.get_model('Inventory', 'IssuedCannister')
+    MarketingItem = apps.get_model('Inventory', 'MarketingItem')
+    IssuedItem = apps.get_model('Inventory', 'IssuedItem')
+
+    # Name and batch first; sales recorded without a batch fall back to the name alone
+    _backfill(Sale, 'drug', Drug.objects.filter(
+        name=OuterRef('drug_sold'), batch_no=OuterRef('batch_no')).order_by('pk').values('pk'))
+    _backfill(Sale, 'drug', Drug.objects.filter(name=OuterRef('drug_sold')).order_by('pk').values('pk'),
+              Q(batch_no__isnull=True) | Q(batch_no=''))
+    _backfill(PickingList, 'drug', Drug.objects.filter(
+        name=OuterRef('product'), batch_no=OuterRef('batch_no')).order_by('pk').values('pk'))
+    # Cannister batch numbers are unique
+    _backfill(IssuedCannister, 'cannister', Cannister.objects.filter(
+        batch_no=OuterRef('batch_no')).values('pk'))
+    _backfill(IssuedItem, 'marketing_item', MarketingItem.objects.filter(
+        name=OuterRef('item')).order_by('pk').values('pk'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Inventory', '0031_normalised_foreign_keys'),
+    ]
+
+    operations = [
+        migrations.RunPython(link_rows, migrations.RunPython.noop),
+    ]
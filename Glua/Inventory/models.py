@@ -1,8 +1,11 @@
+from collections import defaultdict
+
 from django.db import models
 from django.contrib.auth.models import User
 from django.utils import timezone
 from django.core.exceptions import ValidationError
-from django.db.models.signals import pre_save
+from django.db.models import F, Q, Sum
+from django.db.models.signals import pre_save, post_save, post_delete
 from django.dispatch import receiver
 from django.core.exceptions import PermissionDenied
 from django.utils.timezone import now
@@ -81,6 +84,11 @@ class Drug(models.Model):
         """Meta definition for Drug."""
         verbose_name = 'Drug'
         verbose_name_plural = 'Drugs'
+        indexes = [
+            models.Index(fields=['expiry_date', 'stock'], name='drug_expiry_stock_idx'),
+            models.Index(fields=['stock'], name='drug_stock_idx'),
+            models.Index(fields=['name'], name='drug_name_idx'),
+        ]
 
     def __str__(self):
         """Unicode representation of Drug."""
@@ -98,15 +106,27 @@ class Drug(models.Model):
     #     super(Drug, self).save(*args, **kwargs)
 
 
+class SaleQuerySet(models.QuerySet):
+    def for_report(self):
+        """Sales with the client and seller the bin and history pages print per row."""
+        return self.select_related('client', 'seller')
+
+
 class Sale(models.Model):
     seller = models.ForeignKey(
         User, on_delete=models.PROTECT, null=True, blank=True)
+    # drug_sold and batch_no keep the names as sold; drug links the row for joins and grouping.
+    # Its index is the leading column of sale_drug_id_date_idx.
+    drug = models.ForeignKey(
+        Drug, on_delete=models.SET_NULL, null=True, blank=True, related_name='sales', db_index=False)
     drug_sold = models.CharField(max_length=200)
     date_sold = models.DateTimeField(auto_now_add=True)
     client = models.ForeignKey(Client, on_delete=models.PROTECT, null=True, blank=True)
     batch_no = models.CharField(max_length=200, null=True, blank=True)
     quantity = models.FloatField(null=True, blank=True)
     remaining_quantity = models.FloatField(null=True, blank=True)
+
+    objects = SaleQuerySet.as_manager()
     # buying_price = models.FloatField(null=True, blank=True)
 
     # def total(self):
@@ -123,11 +143,98 @@ class Sale(models.Model):
         """Meta definition for Sale."""
         verbose_name = 'Sale'
         verbose_name_plural = 'Sales'
+        indexes = [
+            models.Index(fields=['date_sold'], name='sale_date_sold_idx'),
+            models.Index(fields=['drug_sold', 'date_sold'], name='sale_drug_date_idx'),
+            models.Index(fields=['drug', 'date_sold'], name='sale_drug_id_date_idx'),
+            models.Index(fields=['batch_no'], name='sale_batch_no_idx'),
+        ]
 
     def __str__(self):
         return f'{self.drug_sold} sold on {self.date_sold}'
 
 
+class ProductSalesTotal(models.Model):
+    """Running total of quantity sold per product, maintained from Sale writes."""
+    drug_sold = models.CharField(max_length=200, unique=True)
+    total_quantity = models.FloatField(default=0)
+
+    class Meta:
+        """Meta definition for ProductSalesTotal."""
+        verbose_name = 'Product Sales Total'
+        verbose_name_plural = 'Product Sales Totals'
+        ordering = ['-total_quantity']
+
+    def __str__(self):
+        return f'{self.drug_sold}: {self.total_quantity}'
+
+    @classmethod
+    def add(cls, drug_sold, quantity):
+        """Add ``quantity`` to the running total for ``drug_sold``."""
+        if not quantity:
+            return
+        updated = cls.objects.filter(drug_sold=drug_sold).update(
+            total_quantity=F('total_quantity') + quantity)
+        if not updated:
+            total, created = cls.objects.get_or_create(
+                drug_sold=drug_sold, defaults={'total_quantity': quantity})
+            if not created:
+                cls.objects.filter(pk=total.pk).update(
+                    total_quantity=F('total_quantity') + quantity)
+
+    @classmethod
+    def rebuild(cls):
+        """Recompute every total from the full sales history.
+
+        Sales linked to a drug still carrying the name they were sold under
+        are summed per ``drug_id``, so the large GROUP BY is on an integer;
+        only the remaining sales are grouped on the name.
+        """
+        names = dict(Drug.objects.values_list('pk', 'name'))
+        linked = Q(drug__isnull=False, drug_sold=F('drug__name'))
+        totals = defaultdict(float)
+        for row in Sale.objects.filter(linked).values('drug').annotate(total=Sum('quantity')).order_by():
+            totals[names[row['drug']]] += row['total'] or 0
+        for row in Sale.objects.exclude(linked).values('drug_sold').annotate(total=Sum('quantity')).order_by():
+            totals[row['drug_sold']] += row['total'] or 0
+
+        cls.objects.all().delete()
+        cls.objects.bulk_create(
+            [cls(drug_sold=drug_sold, total_quantity=total) for drug_sold, total in totals.items()],
+            batch_size=500,
+        )
+        return cls.objects.count()
+
+
+@receiver(pre_save, sender=Sale)
+def remember_sale_for_totals(sender, instance, **kwargs):
+    # An edit moves the sale's quantity between totals; keep what it counted so far
+    if not instance._state.adding and instance.pk is not None:
+        instance._counted = Sale.objects.filter(pk=instance.pk).values_list('drug_sold', 'quantity').first()
+
+
+@receiver(post_save, sender=Sale)
+def add_sale_to_totals(sender, instance, created, **kwargs):
+    counted = None if created else instance.__dict__.pop('_counted', None)
+    if not created and counted in (None, (instance.drug_sold, instance.quantity)):
+        return
+    if counted is not None:
+        ProductSalesTotal.add(counted[0], -(counted[1] or 0))
+    ProductSalesTotal.add(instance.drug_sold, instance.quantity)
+
+
+@receiver(post_delete, sender=Sale)
+def remove_sale_from_totals(sender, instance, **kwargs):
+    if instance.quantity:
+        ProductSalesTotal.add(instance.drug_sold, -instance.quantity)
+
+
+class StockedQuerySet(models.QuerySet):
+    def for_listing(self):
+        """Stock additions with the drug and staff member shown per row."""
+        return self.select_related('drug_name', 'staff')
+
+
 class Stocked(models.Model):
     """Model definition for Stock."""
     drug_name = models.ForeignKey(Drug, on_delete=models.PROTECT)
@@ -137,10 +244,15 @@ class Stocked(models.Model):
     number_added = models.IntegerField()
     total = models.IntegerField(null=True)
 
+    objects = StockedQuerySet.as_manager()
+
     class Meta:
         """Meta definition for Stock."""
         verbose_name = 'Stock Addition'
         verbose_name_plural = 'Stock Additions'
+        indexes = [
+            models.Index(fields=['-date_added'], name='stocked_date_added_idx'),
+        ]
 
     def __str__(self):
         """Unicode representation of Stock."""
@@ -153,6 +265,12 @@ class Stocked(models.Model):
                 setattr(self, field_name, val.capitalize())
         super(Stocked, self).save(*args, **kwargs)
 
+class LockedProductQuerySet(models.QuerySet):
+    def for_listing(self):
+        """Locks with the drug, user and client shown per row."""
+        return self.select_related('drug', 'locked_by', 'client')
+
+
 class LockedProduct(models.Model):
     drug = models.ForeignKey(Drug, on_delete=models.PROTECT)
     locked_by = models.ForeignKey(User, on_delete=models.PROTECT)
@@ -160,6 +278,13 @@ class LockedProduct(models.Model):
     quantity = models.FloatField(null=True, blank=True)
     client = models.ForeignKey(Client, on_delete=models.PROTECT, null=True, blank=True)
 
+    objects = LockedProductQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['-date_locked'], name='locked_date_locked_idx'),
+        ]
+
 @receiver(pre_save, sender=LockedProduct)
 def prevent_locked_drug_update(sender, instance, **kwargs):
     if instance.pk:  # if it's an update (not a new record)
@@ -174,8 +299,16 @@ class MarketingItem(models.Model):
     def __str__(self):
         return self.name
 
+class IssuedItemQuerySet(models.QuerySet):
+    def for_listing(self):
+        """Issued items with the issuing user shown per row."""
+        return self.select_related('issued_by')
+
+
 class IssuedItem(models.Model):
     item = models.CharField(max_length=255, verbose_name="Item")
+    marketing_item = models.ForeignKey(
+        MarketingItem, on_delete=models.SET_NULL, null=True, blank=True, related_name='issues')
     stock = models.PositiveIntegerField(verbose_name="Stock/Quantity")
     issued_to = models.CharField(max_length=255, verbose_name="Issued To")
     quantity_issued = models.PositiveIntegerField(verbose_name="Quantity Issued")
@@ -187,6 +320,8 @@ class IssuedItem(models.Model):
         related_name="issued_items", null=True, blank=True
     )
 
+    objects = IssuedItemQuerySet.as_manager()
+
     def __str__(self):
         return f"{self.item} - Issued to {self.issued_to} by {self.issued_by}"
 
@@ -194,18 +329,36 @@ class IssuedItem(models.Model):
         verbose_name = "Issued Item"
         verbose_name_plural = "Issued Items"
         ordering = ['-date_issued']  # Order by latest issued items first
+        indexes = [
+            models.Index(fields=['-date_issued'], name='issueditem_date_issued_idx'),
+        ]
+
+class PickingListQuerySet(models.QuerySet):
+    def for_listing(self):
+        """Picking list lines with the client shown per row."""
+        return self.select_related('client')
+
 
 class PickingList(models.Model):
     date = models.DateField()
     client = models.ForeignKey(Client, on_delete=models.PROTECT, null=True, blank=True)
+    drug = models.ForeignKey(
+        Drug, on_delete=models.SET_NULL, null=True, blank=True, related_name='picking_lines')
     product = models.CharField(max_length=255)
     batch_no = models.CharField(max_length=100)
     quantity = models.PositiveIntegerField()
     # in_stock = models.ForeignKey(
     #     Drug, on_delete=models.CASCADE, null=True, blank=True)
 
+    objects = PickingListQuerySet.as_manager()
+
     def __str__(self):
         return f"{self.date} - {self.client} - {self.product}"
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['-date'], name='pickinglist_date_idx'),
+        ]
     
 class Cannister(models.Model):
     name = models.CharField(max_length=255)
@@ -216,9 +369,17 @@ class Cannister(models.Model):
     def __str__(self):
         return f"{self.name} - {self.batch_no}"
     
+class IssuedCannisterQuerySet(models.QuerySet):
+    def for_listing(self):
+        """Issues with the client and both staff members the bin card shows per row."""
+        return self.select_related('client', 'staff_on_duty', 'returned_by')
+
+
 class IssuedCannister(models.Model):
     date_issued = models.DateTimeField(default=now)
     date_returned = models.DateTimeField(default=now)
+    cannister = models.ForeignKey(
+        Cannister, on_delete=models.SET_NULL, null=True, blank=True, related_name='issues')
     name = models.CharField(max_length=255)
     batch_no = models.CharField(max_length=100)
     staff_on_duty = models.ForeignKey(User, on_delete=models.CASCADE, related_name="issued_by")
@@ -228,5 +389,68 @@ class IssuedCannister(models.Model):
     balance = models.PositiveIntegerField(null=True, blank=True)
     action = models.BooleanField(default=False)
 
+    objects = IssuedCannisterQuerySet.as_manager()
+
     def __str__(self):
         return f"{self.name} - {self.batch_no} issued to {self.client}, returned {self.action}"
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['-date_issued'], name='issuedcan_date_issued_idx'),
+            models.Index(fields=['batch_no'], name='issuedcan_batch_no_idx'),
+        ]
+
+
+class UserPresence(models.Model):
+    """Last time each user was seen, maintained by ``Inventory.presence``."""
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name='presence')
+    last_seen = models.DateTimeField()
+    logged_in = models.BooleanField(default=True)
+
+    class Meta:
+        """Meta definition for UserPresence."""
+        verbose_name = 'User Presence'
+        verbose_name_plural = 'User Presence'
+        indexes = [
+            models.Index(fields=['logged_in', 'last_seen'], name='presence_online_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.user} last seen {self.last_seen}'
+
+
+class ExportJob(models.Model):
+    """An Excel export produced in the background by ``Inventory.jobs``."""
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (PENDING, 'Pending'),
+        (RUNNING, 'Running'),
+        (DONE, 'Done'),
+        (FAILED, 'Failed'),
+    ]
+
+    kind = models.CharField(max_length=50)
+    params = models.JSONField(default=dict, blank=True)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING)
+    progress = models.PositiveIntegerField(default=0)
+    total = models.PositiveIntegerField(null=True, blank=True)
+    output_path = models.CharField(max_length=500, blank=True)
+    error = models.TextField(blank=True)
+    requested_by = models.ForeignKey(User, on_delete=models.CASCADE, related_name='export_jobs')
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        """Meta definition for ExportJob."""
+        verbose_name = 'Export Job'
+        verbose_name_plural = 'Export Jobs'
+        indexes = [
+            models.Index(fields=['status', 'created_at'], name='exportjob_status_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.kind} export #{self.pk} ({self.status})'
@@ -0,0 +1,252 @@
+"""Pagination helpers for the report lists.
+
+``paginate()`` is the single entry point used by the views. It caps
+``per_page`` and returns either a regular ``Paginator`` page or, in
+keyset mode, a ``KeysetPage`` that seeks to the boundary row with a
+``WHERE (date, id) < (...)`` condition instead of an ``OFFSET`` scan, so
+every page costs the same no matter how deep it is.
+
+Keyset cursors are signed, opaque strings carried in the ``cursor``
+query parameter. They record the ordering and a fingerprint of the
+queryset's filters, so a cursor only continues the listing it came from;
+filters a view reads from the request must be passed to ``paginate()``
+so that the page links carry them.
+"""
+import hashlib
+
+from django.core import signing
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import Q
+from django.utils.functional import cached_property
+
+
+DEFAULT_PER_PAGE = 10
+MAX_PER_PAGE = 100
+CURSOR_SALT = 'Inventory.pagination.cursor'
+
+
+def get_per_page(request, default=DEFAULT_PER_PAGE):
+    """Read ``per_page`` from the query string, clamped to ``1..MAX_PER_PAGE``."""
+    try:
+        per_page = int(request.GET.get('per_page', default))
+    except (TypeError, ValueError):
+        per_page = default
+    return max(1, min(per_page, MAX_PER_PAGE))
+
+
+def estimated_count(queryset):
+    """Cheap row count estimate for an unfiltered queryset, or None.
+
+    Uses planner statistics where the backend keeps them and the highest
+    primary key otherwise; filtered querysets have no cheap estimate.
+    """
+    if queryset.query.where:
+        return None
+    model = queryset.model
+    table = model._meta.db_table
+    connection = connections[queryset.db]
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute('SELECT reltuples::bigint FROM pg_class WHERE relname = %s', [table])
+            row = cursor.fetchone()
+            if row and row[0] > 0:
+                return row[0]
+        elif connection.vendor == 'sqlite':
+            cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'sqlite_stat1'")
+            if cursor.fetchone():
+                cursor.execute('SELECT stat FROM sqlite_stat1 WHERE tbl = %s LIMIT 1', [table])
+                row = cursor.fetchone()
+                if row:
+                    return int(row[0].split()[0])
+    last = model._default_manager.using(queryset.db).order_by('-pk').values_list('pk', flat=True).first()
+    return last or 0
+
+
+class EstimatedCountPaginator(Paginator):
+    """Paginator that sizes itself from ``estimated_count()`` when it can."""
+
+    @cached_property
+    def count(self):
+        estimate = estimated_count(self.object_list)
+        return super().count if estimate is None else estimate
+
+
+class InvalidCursor(ValueError):
+    """A cursor that was tampered with or belongs to another listing."""
+
+
+def scope(queryset):
+    """Fingerprint of ``queryset``'s filters and joins, ignoring its ordering and columns."""
+    sql, params = queryset.order_by().values_list('pk').query.sql_with_params()
+    return hashlib.sha256(repr((sql, params)).encode()).hexdigest()[:16]
+
+
+def _serialise(value):
+    return value.isoformat() if hasattr(value, 'isoformat') else value
+
+
+class KeysetPaginator:
+    """Seek-based paginator over ``queryset`` ordered by ``ordering``.
+
+    ``ordering`` must end in a unique field (normally ``id``) so that
+    every row has a distinct position.
+    """
+
+    def __init__(self, queryset, ordering, per_page=DEFAULT_PER_PAGE, estimate=False):
+        self.queryset = queryset
+        self.ordering = list(ordering)
+        self.per_page = per_page
+        self.estimate = estimate
+
+    @cached_property
+    def count(self):
+        """Estimated total, only computed when ``estimate`` was requested."""
+        return estimated_count(self.queryset) if self.estimate else None
+
+    def _fields(self, reverse=False):
+        fields = []
+        for term in self.ordering:
+            descending = term.startswith('-')
+            fields.append((term.lstrip('-'), descending != reverse))
+        return fields
+
+    def _after(self, values, reverse=False):
+        """Q selecting rows strictly after ``values`` in the (possibly reversed) ordering.
+
+        Expands to ``a <= x AND (a < x OR (a = x AND id < y))`` so the leading
+        bound can be served by the index on the first ordering column.
+        """
+        fields = self._fields(reverse)
+        condition = Q()
+        for idx, (name, descending) in enumerate(fields):
+            term = Q(**{f'{name}__{"lt" if descending else "gt"}': values[idx]})
+            term &= Q(**{prior: values[i] for i, (prior, _) in enumerate(fields[:idx])})
+            condition |= term
+        first, descending = fields[0]
+        return Q(**{f'{first}__{"lte" if descending else "gte"}': values[0]}) & condition
+
+    def _ordered(self, reverse=False):
+        return self.queryset.order_by(*[
+            f'-{name}' if descending else name for name, descending in self._fields(reverse)
+        ])
+
+    @cached_property
+    def scope(self):
+        return scope(self.queryset)
+
+    def _cursor(self, obj, backwards):
+        # Rows are model instances, or dicts from a ``values()`` queryset
+        get = obj.get if isinstance(obj, dict) else lambda name: getattr(obj, name)
+        values = [_serialise(get(name)) for name, _ in self._fields()]
+        position = {'v': values, 'b': backwards, 'o': self.ordering, 's': self.scope}
+        return signing.dumps(position, salt=CURSOR_SALT, compress=True)
+
+    def position(self, cursor):
+        """The position ``cursor`` points at; raises ``InvalidCursor`` unless it was issued for this listing."""
+        try:
+            position = signing.loads(cursor, salt=CURSOR_SALT)
+        except signing.BadSignature:
+            raise InvalidCursor('cursor is not valid')
+        if position.get('o') != self.ordering or position.get('s') != self.scope:
+            raise InvalidCursor('cursor belongs to a different ordering or filter')
+        return position
+
+    def page(self, cursor=None):
+        """The page after ``cursor``; an invalid cursor starts again from the first page."""
+        position = None
+        if cursor:
+            try:
+                position = self.position(cursor)
+            except InvalidCursor:
+                position = None
+
+        backwards = bool(position and position.get('b'))
+        queryset = self._ordered(reverse=backwards)
+        if position:
+            queryset = queryset.filter(self._after(position['v'], reverse=backwards))
+        rows = list(queryset[:self.per_page + 1])
+        has_more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+        if backwards:
+            rows.reverse()
+
+        return KeysetPage(
+            self, rows,
+            has_next=has_more if not backwards else True,
+            has_previous=has_more if backwards else position is not None,
+        )
+
+
+class KeysetPage:
+    """A page of rows with cursors to its neighbours, template-compatible with ``Page``."""
+
+    is_keyset = True
+
+    def __init__(self, paginator, object_list, has_next, has_previous):
+        self.paginator = paginator
+        self.object_list = object_list
+        self._has_next = has_next and bool(object_list)
+        self._has_previous = has_previous and bool(object_list)
+        self.next_query = ''
+        self.previous_query = ''
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    def has_next(self):
+        return self._has_next
+
+    def has_previous(self):
+        return self._has_previous
+
+    def has_other_pages(self):
+        return self._has_next or self._has_previous
+
+    @property
+    def next_cursor(self):
+        return self.paginator._cursor(self.object_list[-1], backwards=False) if self._has_next else None
+
+    @property
+    def previous_cursor(self):
+        return self.paginator._cursor(self.object_list[0], backwards=True) if self._has_previous else None
+
+
+def paginate(request, queryset, ordering, keyset=False, estimate=False, default_per_page=DEFAULT_PER_PAGE,
+             filters=None):
+    """Paginate ``queryset`` for a list view.
+
+    Keyset mode is used when the request carries a ``cursor``, or when the
+    view opts in with ``keyset=True`` and no explicit ``page`` number was
+    asked for. ``estimate`` swaps the exact ``COUNT(*)`` for
+    ``estimated_count()`` where possible. ``filters`` are the parameters
+    the view filtered on, added to the page links when they did not come
+    from the query string.
+    """
+    per_page = get_per_page(request, default_per_page)
+
+    if 'cursor' in request.GET or (keyset and 'page' not in request.GET):
+        page = KeysetPaginator(queryset, ordering, per_page, estimate).page(request.GET.get('cursor'))
+        params = request.GET.copy()
+        for name, value in (filters or {}).items():
+            if value:
+                params[name] = value
+        params['per_page'] = per_page
+        params.pop('page', None)
+        if page.has_next():
+            params['cursor'] = page.next_cursor
+            page.next_query = params.urlencode()
+        if page.has_previous():
+            params['cursor'] = page.previous_cursor
+            page.previous_query = params.urlencode()
+        return page
+
+    paginator_class = EstimatedCountPaginator if estimate else Paginator
+    paginator = paginator_class(queryset.order_by(*ordering), per_page)
+    return paginator.get_page(request.GET.get('page', 1))
@@ -0,0 +1,119 @@
+"""Who is online, without decoding every session.
+
+Each user has one ``UserPresence`` row holding the last time they made a
+request. Login and logout signals set and clear it, and
+``PresenceMiddleware`` refreshes ``last_seen`` at most once every
+``TOUCH_INTERVAL`` seconds per session, or every
+``SESSION_REFRESH_INTERVAL`` if that is longer, since each refresh also
+saves the session. A user counts as online while
+they are logged in and were seen within the session lifetime, which is
+when their session would have expired anyway.
+"""
+from datetime import timedelta
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.contrib.auth.signals import user_logged_in, user_logged_out
+from django.dispatch import receiver
+from django.utils import timezone
+
+from . import live
+from .models import UserPresence
+
+
+# Minimum number of seconds between last_seen writes for one session
+TOUCH_INTERVAL = 60
+SESSION_KEY = '_presence_seen'
+
+
+def online_window():
+    return timedelta(seconds=settings.SESSION_COOKIE_AGE)
+
+
+def mark_seen(user, when=None, logged_in=True):
+    when = when or timezone.now()
+    UserPresence.objects.update_or_create(
+        user_id=user.pk, defaults={'last_seen': when, 'logged_in': logged_in}
+    )
+    return when
+
+
+def touch(request):
+    """Record that ``request.user`` is active, unless it was recorded recently."""
+    now = timezone.now()
+    last = request.session.get(SESSION_KEY)
+    interval = max(TOUCH_INTERVAL, getattr(settings, 'SESSION_REFRESH_INTERVAL', 0))
+    if last is not None and now.timestamp() - last < interval:
+        return
+    mark_seen(request.user, now)
+    request.session[SESSION_KEY] = now.timestamp()
+
+
+def online_presence(now=None):
+    """Queryset of presence rows for users who are online right now."""
+    now = now or timezone.now()
+    return UserPresence.objects.filter(logged_in=True, last_seen__gte=now - online_window())
+
+
+def online_user_ids(now=None):
+    return set(online_presence(now).values_list('user_id', flat=True))
+
+
+def users_with_presence(users=None):
+    """Every user annotated with ``is_online`` and ``last_seen``, in a single query."""
+    now = timezone.now()
+    if users is None:
+        users = list(User.objects.select_related('presence'))
+    cutoff = now - online_window()
+    for user in users:
+        presence = getattr(user, 'presence', None)
+        user.last_seen = presence.last_seen if presence else None
+        user.is_online = bool(presence and presence.logged_in and presence.last_seen >= cutoff)
+    return users
+
+
+async def ausers_with_presence():
+    return users_with_presence([user async for user in User.objects.select_related('presence')])
+
+
+def _touch_if_signed_in(request):
+    user = getattr(request, 'user', None)
+    if user is not None and user.is_authenticated:
+        touch(request)
+
+
+class PresenceMiddleware:
+    """Keep ``UserPresence`` current for authenticated requests."""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        _touch_if_signed_in(request)
+        return self.get_response(request)
+
+    async def __acall__(self, request):
+        await sync_to_async(_touch_if_signed_in)(request)
+        return await self.get_response(request)
+
+
+@receiver(user_logged_in, dispatch_uid='presence_logged_in')
+def presence_logged_in(sender, request, user, **kwargs):
+    when = mark_seen(user)
+    if request is not None and hasattr(request, 'session'):
+        request.session[SESSION_KEY] = when.timestamp()
+    live.presence_changed(user.get_username(), 'online')
+
+
+@receiver(user_logged_out, dispatch_uid='presence_logged_out')
+def presence_logged_out(sender, request, user, **kwargs):
+    if user is not None:
+        mark_seen(user, logged_in=False)
+        live.presence_changed(user.get_username(), 'offline')
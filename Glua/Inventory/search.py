@@ -0,0 +1,339 @@
+"""Full-text search index for the inventory search views.
+
+Each searchable model gets its own index table holding one row per
+object, keyed by the object's primary key:
+
+* SQLite: an FTS5 virtual table with the trigram tokenizer, so a quoted
+  phrase behaves like the ``icontains`` lookups it replaces.
+* PostgreSQL: a plain table with a weighted ``tsvector`` column and a GIN
+  index, matched with prefix queries.
+
+Views call ``search_filter()``, which narrows a queryset with a subquery
+against the index and falls back to the given ``Q`` object when the
+index cannot answer (other database backends, or queries shorter than a
+trigram on SQLite). Rows are kept in sync by signals, and by
+``reindex_updated()`` after the stock ledger's queryset updates. Renaming
+a client or user rewrites the documents that embed the old name after the
+rename commits. The ``rebuild_search_index`` command repopulates
+everything after bulk loads.
+"""
+import sqlite3
+from functools import partial
+
+from django.db import connection, transaction
+from django.db.models.expressions import RawSQL
+from django.db.models.signals import pre_save, post_save, post_delete
+
+from .models import (
+    Drug, Sale, Client, Cannister, IssuedCannister, IssuedItem, MarketingItem, PickingList
+)
+
+
+# Rows are written to the index in batches of this size when rebuilding
+REBUILD_BATCH_SIZE = 2000
+# The trigram tokenizer cannot match anything shorter than this
+MIN_TRIGRAM_LENGTH = 3
+# tsvector weights, assigned to the indexed columns in order
+WEIGHTS = 'ABCD'
+
+
+class SearchIndex:
+    """A searchable model and the lookups that make up its document."""
+
+    def __init__(self, kind, model, columns):
+        self.kind = kind
+        self.model = model
+        self.columns = columns
+
+    @property
+    def table(self):
+        return f'inventory_fts_{self.kind}'
+
+    def column_name(self, lookup):
+        return lookup.replace('__', '_')
+
+    def weight(self, lookup):
+        return WEIGHTS[min(self.columns.index(lookup), len(WEIGHTS) - 1)]
+
+    def documents(self, queryset):
+        """Yield ``(pk, [text, ...])`` for every object in ``queryset``."""
+        rows = queryset.values_list('pk', *self.columns).iterator(chunk_size=REBUILD_BATCH_SIZE)
+        for pk, *values in rows:
+            yield pk, ['' if value is None else str(value) for value in values]
+
+
+INDEXES = {
+    index.kind: index for index in [
+        SearchIndex('drug', Drug, ['name', 'batch_no']),
+        SearchIndex('sale', Sale, ['drug_sold', 'batch_no', 'client__name']),
+        SearchIndex('client', Client, ['name', 'email', 'phone']),
+        SearchIndex('cannister', Cannister, ['name', 'batch_no', 'stock', 'litres']),
+        SearchIndex('issuedcannister', IssuedCannister,
+                    ['name', 'batch_no', 'client__name', 'staff_on_duty__username']),
+        SearchIndex('issueditem', IssuedItem, ['item', 'issued_to', 'issued_by__username']),
+        SearchIndex('marketingitem', MarketingItem, ['name']),
+        SearchIndex('pickinglist', PickingList,
+                    ['product', 'batch_no', 'client__name', 'quantity', 'date']),
+    ]
+}
+
+INDEX_FOR_MODEL = {index.model: index for index in INDEXES.values()}
+
+
+class SQLiteBackend:
+    # The trigram tokenizer shipped with SQLite 3.34
+    supported = sqlite3.sqlite_version_info >= (3, 34)
+
+    def create(self, cursor, index):
+        columns = ', '.join(index.column_name(lookup) for lookup in index.columns)
+        cursor.execute(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {index.table} "
+            f"USING fts5({columns}, tokenize='trigram')"
+        )
+
+    def drop(self, cursor, index):
+        cursor.execute(f'DROP TABLE IF EXISTS {index.table}')
+
+    def write(self, cursor, index, documents):
+        columns = ', '.join(index.column_name(lookup) for lookup in index.columns)
+        placeholders = ', '.join(['%s'] * (len(index.columns) + 1))
+        documents = list(documents)
+        cursor.executemany(f'DELETE FROM {index.table} WHERE rowid = %s', [[pk] for pk, _ in documents])
+        cursor.executemany(
+            f'INSERT INTO {index.table} (rowid, {columns}) VALUES ({placeholders})',
+            [[pk, *values] for pk, values in documents],
+        )
+
+    def delete(self, cursor, index, pk):
+        cursor.execute(f'DELETE FROM {index.table} WHERE rowid = %s', [pk])
+
+    def match(self, index, query, columns=None):
+        if len(query) < MIN_TRIGRAM_LENGTH:
+            return None
+        expression = '"%s"' % query.replace('"', '""')
+        if columns:
+            names = ' '.join(index.column_name(lookup) for lookup in columns)
+            expression = f'{{{names}}} : {expression}'
+        return RawSQL(f'SELECT rowid FROM {index.table} WHERE {index.table} MATCH %s', [expression])
+
+
+class PostgresBackend:
+    supported = True
+
+    def create(self, cursor, index):
+        cursor.execute(
+            f'CREATE TABLE IF NOT EXISTS {index.table} '
+            f'(object_id integer PRIMARY KEY, document tsvector NOT NULL)'
+        )
+        cursor.execute(
+            f'CREATE INDEX IF NOT EXISTS {index.table}_gin ON {index.table} USING GIN (document)'
+        )
+
+    def drop(self, cursor, index):
+        cursor.execute(f'DROP TABLE IF EXISTS {index.table}')
+
+    def _document_sql(self, index):
+        return ' || '.join(
+            f"setweight(to_tsvector('simple', %s), '{index.weight(lookup)}')"
+            for lookup in index.columns
+        )
+
+    def write(self, cursor, index, documents):
+        cursor.executemany(
+            f'INSERT INTO {index.table} (object_id, document) VALUES (%s, {self._document_sql(index)}) '
+            f'ON CONFLICT (object_id) DO UPDATE SET document = EXCLUDED.document',
+            [[pk, *values] for pk, values in documents],
+        )
+
+    def delete(self, cursor, index, pk):
+        cursor.execute(f'DELETE FROM {index.table} WHERE object_id = %s', [pk])
+
+    def match(self, index, query, columns=None):
+        weights = ''.join(index.weight(lookup) for lookup in columns) if columns else ''
+        terms = [''.join(ch for ch in term if ch.isalnum() or ch in '-_.@+') for term in query.split()]
+        terms = [term for term in terms if term]
+        if not terms:
+            return None
+        tsquery = ' & '.join(f"'{term}':*{weights}" for term in terms)
+        return RawSQL(
+            f"SELECT object_id FROM {index.table} WHERE document @@ to_tsquery('simple', %s)",
+            [tsquery],
+        )
+
+
+BACKENDS = {
+    'sqlite': SQLiteBackend(),
+    'postgresql': PostgresBackend(),
+}
+
+_available = {}
+
+
+def backend_for(using):
+    """Return the search backend for ``using``'s database, or None if it has none."""
+    backend = BACKENDS.get(using.vendor)
+    return backend if backend is not None and backend.supported else None
+
+
+def get_backend(using=connection):
+    """Return the search backend for ``using``, or None when it has no index."""
+    backend = backend_for(using)
+    if backend is None:
+        return None
+    if using.alias not in _available:
+        tables = set(using.introspection.table_names(include_views=True))
+        _available[using.alias] = all(index.table in tables for index in INDEXES.values())
+    return backend if _available[using.alias] else None
+
+
+def create_indexes(using=connection):
+    backend = backend_for(using)
+    if backend is None:
+        return
+    with using.cursor() as cursor:
+        for index in INDEXES.values():
+            backend.create(cursor, index)
+    _available.pop(using.alias, None)
+
+
+def drop_indexes(using=connection):
+    backend = backend_for(using)
+    if backend is None:
+        return
+    with using.cursor() as cursor:
+        for index in INDEXES.values():
+            backend.drop(cursor, index)
+    _available.pop(using.alias, None)
+
+
+def reindex(index, queryset=None, using=connection):
+    """Write the documents for ``queryset`` (default: every object) to ``index``."""
+    backend = get_backend(using)
+    if backend is None:
+        return 0
+    queryset = index.model.objects.all() if queryset is None else queryset
+    count = 0
+    batch = []
+    with using.cursor() as cursor:
+        for document in index.documents(queryset):
+            batch.append(document)
+            if len(batch) >= REBUILD_BATCH_SIZE:
+                backend.write(cursor, index, batch)
+                count += len(batch)
+                batch = []
+        if batch:
+            backend.write(cursor, index, batch)
+            count += len(batch)
+    return count
+
+
+def reindex_updated(queryset, fields):
+    """Rewrite the documents of ``queryset`` after an ``update()`` of ``fields``, which sends no signals."""
+    index = INDEX_FOR_MODEL.get(queryset.model)
+    if index is not None and set(fields) & set(index.columns):
+        reindex(index, queryset)
+
+
+def rebuild(using=connection):
+    """Drop, recreate and repopulate every index table."""
+    drop_indexes(using)
+    create_indexes(using)
+    return {kind: reindex(index, using=using) for kind, index in INDEXES.items()}
+
+
+def match(kind, query, columns=None):
+    """Return a subquery of primary keys matching ``query``, or None if the index can't answer."""
+    backend = get_backend()
+    if backend is None:
+        return None
+    return backend.match(INDEXES[kind], query, columns)
+
+
+def search_filter(queryset, kind, query, fallback, columns=None):
+    """Narrow ``queryset`` to objects matching ``query``.
+
+    ``fallback`` is the equivalent ``Q`` lookup, used when the index is
+    unavailable for this backend or query.
+    """
+    if not query:
+        return queryset
+    subquery = match(kind, query, columns)
+    if subquery is None:
+        return queryset.filter(fallback)
+    return queryset.filter(pk__in=subquery)
+
+
+def _index_instance(sender, instance, **kwargs):
+    reindex(INDEX_FOR_MODEL[sender], sender.objects.filter(pk=instance.pk))
+
+
+def _unindex_instance(sender, instance, **kwargs):
+    backend = get_backend()
+    if backend is not None:
+        with connection.cursor() as cursor:
+            backend.delete(cursor, INDEX_FOR_MODEL[sender], instance.pk)
+
+
+for _model in INDEX_FOR_MODEL:
+    post_save.connect(_index_instance, sender=_model, dispatch_uid=f'search_index_{_model.__name__}')
+    post_delete.connect(_unindex_instance, sender=_model, dispatch_uid=f'search_unindex_{_model.__name__}')
+
+
+# Documents that embed a column of a related object, such as a client's
+# name or a user's username: {related model: [(index, relation, field)]}
+EMBEDDED = {}
+for _index in INDEXES.values():
+    for _lookup in _index.columns:
+        if '__' in _lookup:
+            _relation, _field = _lookup.split('__', 1)
+            _related = _index.model._meta.get_field(_relation).related_model
+            EMBEDDED.setdefault(_related, []).append((_index, _relation, _field))
+
+
+def reindex_embedding(model, pk, fields):
+    """Rewrite the documents that embed ``fields`` of the ``model`` object ``pk``.
+
+    A client or user can appear in thousands of rows, so they are written
+    in batches of ``REBUILD_BATCH_SIZE``, each in its own short transaction.
+    """
+    for index, relation, field in EMBEDDED[model]:
+        if field not in fields:
+            continue
+        queryset = index.model.objects.filter(**{relation: pk}).order_by('pk').values_list('pk', flat=True)
+        last = 0
+        while True:
+            pks = list(queryset.filter(pk__gt=last)[:REBUILD_BATCH_SIZE])
+            if not pks:
+                break
+            with transaction.atomic():
+                reindex(index, index.model.objects.filter(pk__in=pks))
+            last = pks[-1]
+
+
+def _embedded_fields(sender):
+    return sorted({field for _, _, field in EMBEDDED[sender]})
+
+
+def _remember_embedded(sender, instance, update_fields=None, **kwargs):
+    # Logins save the user with update_fields=['last_login']; skip the read for those
+    fields = _embedded_fields(sender)
+    if instance._state.adding or instance.pk is None:
+        return
+    if update_fields is not None and not set(update_fields) & set(fields):
+        return
+    instance._embedded = sender.objects.filter(pk=instance.pk).values(*fields).first()
+
+
+def _reindex_embedding(sender, instance, created, **kwargs):
+    """Documents that embed a renamed client or user go stale; rewrite them once the rename commits."""
+    before = None if created else instance.__dict__.pop('_embedded', None)
+    if before is None:
+        return
+    changed = [field for field, value in before.items() if getattr(instance, field) != value]
+    if changed:
+        transaction.on_commit(partial(reindex_embedding, sender, instance.pk, changed))
+
+
+for _model in EMBEDDED:
+    pre_save.connect(_remember_embedded, sender=_model, dispatch_uid=f'search_embedded_{_model.__name__}')
+    post_save.connect(_reindex_embedding, sender=_model, dispatch_uid=f'search_reindex_{_model.__name__}')
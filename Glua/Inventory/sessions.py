@@ -0,0 +1,70 @@
+"""Session expiry refreshed at most once per interval.
+
+With ``SESSION_SAVE_EVERY_REQUEST`` every response rewrites the session
+row just to push its expiry forward. ``SessionRefreshMiddleware`` does
+the same at most once every ``SESSION_REFRESH_INTERVAL`` seconds per
+session, by marking the session modified when its refresh stamp is
+older than that. A session therefore expires between
+``SESSION_COOKIE_AGE - SESSION_REFRESH_INTERVAL`` and
+``SESSION_COOKIE_AGE`` seconds after the last request.
+
+Only sessions of signed-in users are refreshed, so anonymous visitors
+never get a session row, and logging in stamps the new session. The middleware is not loaded while
+``SESSION_SAVE_EVERY_REQUEST`` is on.
+"""
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.contrib.auth.signals import user_logged_in
+from django.core.exceptions import MiddlewareNotUsed
+from django.dispatch import receiver
+
+
+SESSION_KEY = '_session_refreshed'
+
+
+def refresh(request, now=None):
+    """Mark ``request.session`` for saving if its expiry was last pushed back over an interval ago."""
+    now = now or time.time()
+    last = request.session.get(SESSION_KEY)
+    if last is not None and now - last < settings.SESSION_REFRESH_INTERVAL:
+        return False
+    request.session[SESSION_KEY] = now
+    return True
+
+
+@receiver(user_logged_in, dispatch_uid='session_refreshed_on_login')
+def session_refreshed_on_login(sender, request, user, **kwargs):
+    # Login saves a new session anyway; stamp it so the next request needn't
+    if request is not None and hasattr(request, 'session'):
+        request.session[SESSION_KEY] = time.time()
+
+
+def _refresh_if_signed_in(request):
+    user = getattr(request, 'user', None)
+    if user is not None and user.is_authenticated:
+        refresh(request)
+
+
+class SessionRefreshMiddleware:
+    """Extend signed-in sessions without writing them on every request."""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if settings.SESSION_SAVE_EVERY_REQUEST:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        _refresh_if_signed_in(request)
+        return self.get_response(request)
+
+    async def __acall__(self, request):
+        await sync_to_async(_refresh_if_signed_in)(request)
+        return await self.get_response(request)
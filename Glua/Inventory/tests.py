@@ -1,3 +1,1043 @@
-from django.test import TestCase
+import gzip
+import io
+import json
+import os
+import re
+import shutil
+import tempfile
+from datetime import date, timedelta
+from importlib import import_module
+from io import StringIO
+from unittest import skipUnless
+from unittest.mock import patch
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+from asgiref.testing import ApplicationCommunicator
+from channels.layers import get_channel_layer
+from django.apps import apps
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser, User
+from django.core.management import call_command
+from django.db import connection, connections
+from django.db.models import Q, Sum
+from django.contrib.sessions.backends.cache import SessionStore
+from django.test import AsyncRequestFactory, RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from openpyxl import load_workbook
+
+from Glua.consumers import StockConsumer, UserStatusConsumer
+
+from . import (
+    async_views, benchmarks, caching, exports, instrumentation, jobs, ledger, live, metrics, presence, sessions, views,
+)
+from .countries import calling_code_trie, split_phone
+from .dashboard import adashboard_summary, cached_drugs, cached_summary, dashboard_summary
+from .models import (
+    Drug, Sale, Client, Cannister, IssuedCannister, IssuedItem, LockedProduct, PickingList, ProductSalesTotal,
+    Stocked, UserPresence, ExportJob,
+)
+from .pagination import InvalidCursor, KeysetPaginator, MAX_PER_PAGE, get_per_page
+from .search import search_filter
+
+
+def query_plan(queryset):
+    sql, params = queryset.query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute(f'EXPLAIN QUERY PLAN {sql}', params)
+        return ' | '.join(row[-1] for row in cursor.fetchall())
+
+
+@skipUnless(connection.vendor == 'sqlite', 'EXPLAIN QUERY PLAN is SQLite specific')
+class ReportIndexTests(TestCase):
+    """The report and filter views should be served by the declared indexes."""
+
+    def assertUsesIndex(self, queryset, index_name):
+        plan = query_plan(queryset)
+        self.assertIn(index_name, plan, plan)
+
+    def test_bin_report_date_range(self):
+        start = timezone.now() - timedelta(days=30)
+        sales = Sale.objects.filter(date_sold__range=(start, timezone.now())).order_by('date_sold')
+        self.assertUsesIndex(sales, 'sale_date_sold_idx')
+
+    def test_bin_report_latest_first(self):
+        self.assertUsesIndex(Sale.objects.order_by('-date_sold'), 'sale_date_sold_idx')
+
+    def test_sales_for_product_by_date(self):
+        sales = Sale.objects.filter(drug_sold='Paracetamol').order_by('date_sold')
+        self.assertUsesIndex(sales, 'sale_drug_date_idx')
+
+    def test_sales_for_drug_by_date(self):
+        sales = Sale.objects.filter(drug_id=1).order_by('date_sold')
+        self.assertUsesIndex(sales, 'sale_drug_id_date_idx')
+
+    def test_sales_by_batch(self):
+        self.assertUsesIndex(Sale.objects.filter(batch_no='BATCH0001'), 'sale_batch_no_idx')
+
+    def test_expiring_soon(self):
+        today = date.today()
+        drugs = Drug.objects.filter(
+            expiry_date__lte=today + timedelta(days=180), expiry_date__gt=today, stock__gt=0
+        ).order_by('expiry_date')
+        self.assertUsesIndex(drugs, 'drug_expiry_stock_idx')
+
+    def test_out_of_stock(self):
+        self.assertUsesIndex(Drug.objects.filter(stock=0), 'drug_stock_idx')
+
+    def test_bin_card(self):
+        self.assertUsesIndex(IssuedCannister.objects.order_by('-date_issued'), 'issuedcan_date_issued_idx')
+
+    def test_issued_items_report(self):
+        self.assertUsesIndex(IssuedItem.objects.order_by('-date_issued'), 'issueditem_date_issued_idx')
+
+    def test_picking_list(self):
+        self.assertUsesIndex(PickingList.objects.order_by('-date'), 'pickinglist_date_idx')
+
+    def test_stock_added_range(self):
+        start = timezone.now() - timedelta(days=7)
+        stocked = Stocked.objects.filter(date_added__range=(start, timezone.now())).order_by('-date_added')
+        self.assertUsesIndex(stocked, 'stocked_date_added_idx')
+
+
+class SearchIndexTests(TestCase):
+    """Indexed searches should return exactly what the icontains lookups did."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.client_a = Client.objects.create(name='Highland Farms')
+        Sale.objects.create(drug_sold='Paracetamol 500', batch_no='BX-0042', client=cls.client_a, quantity=3)
+        Sale.objects.create(drug_sold='Amoxicillin', batch_no='AM-7781', quantity=1)
+
+    def search_sales(self, query):
+        fallback = Q(drug_sold__icontains=query) | Q(batch_no__icontains=query) | Q(client__name__icontains=query)
+        found = search_filter(Sale.objects.all(), 'sale', query, fallback)
+        self.assertEqual(set(found), set(Sale.objects.filter(fallback)))
+        return found
+
+    def test_matches_substrings_across_columns(self):
+        self.assertEqual(self.search_sales('cetam').count(), 1)
+        self.assertEqual(self.search_sales('0042').count(), 1)
+        self.assertEqual(self.search_sales('highland').count(), 1)
+        self.assertEqual(self.search_sales('am').count(), 2)
+        self.assertEqual(self.search_sales('missing').count(), 0)
+
+    def test_index_follows_writes(self):
+        sale = Sale.objects.create(drug_sold='Ivermectin', quantity=2)
+        self.assertEqual(self.search_sales('vermec').count(), 1)
+        self.client_a.name = 'Lowland Co-op'
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client_a.save()
+        self.assertEqual(self.search_sales('lowland').count(), 1)
+        sale.delete()
+        self.assertEqual(self.search_sales('vermec').count(), 0)
+
+    def test_user_rename_reindexes_after_commit(self):
+        user = User.objects.create_user('jdoe')
+        IssuedItem.objects.create(item='Cap', stock=1, issued_to='Field', quantity_issued=1, issued_by=user)
+        user.username = 'janedoe'
+        with self.captureOnCommitCallbacks() as callbacks:
+            user.save()
+            user.last_login = timezone.now()
+            user.save(update_fields=['last_login'])
+        self.assertEqual(len(callbacks), 1)
+        self.assertFalse(search_filter(IssuedItem.objects.all(), 'issueditem', 'janedoe', Q(pk=None)).exists())
+        callbacks[0]()
+        found = search_filter(IssuedItem.objects.all(), 'issueditem', 'janedoe', Q(pk=None))
+        self.assertEqual(found.count(), 1)
+
+    def test_index_follows_ledger_stock(self):
+        cannister = Cannister.objects.create(name='LN2', batch_no='CN-9', stock=1000, litres='35')
+        user = User.objects.create_user('clerk')
+
+        def by_stock(query):
+            return search_filter(Cannister.objects.all(), 'cannister', query, Q(stock__icontains=query), ['stock'])
+
+        issued = ledger.issue_cannister(cannister, 1, None, user)
+        self.assertEqual((by_stock('999').count(), by_stock('1000').count()), (1, 0))
+        ledger.return_cannister(issued, user)
+        self.assertEqual((by_stock('999').count(), by_stock('1000').count()), (0, 1))
+
+
+class KeysetPaginationTests(TestCase):
+    """Seeking through pages should visit every row once, in order, both ways."""
+
+    @classmethod
+    def setUpTestData(cls):
+        start = timezone.now() - timedelta(days=30)
+        sales = Sale.objects.bulk_create([Sale(drug_sold=f'Drug {idx}', quantity=1) for idx in range(25)])
+        # date_sold is auto_now_add; pairs of sales share a day so the id tie-breaker is exercised,
+        # and later ids get earlier dates so id order alone would be wrong
+        for idx, sale in enumerate(sales):
+            Sale.objects.filter(pk=sale.pk).update(date_sold=start - timedelta(days=idx // 2))
+
+    def walk(self, paginator, cursor=None, forwards=True):
+        pages = []
+        while True:
+            page = paginator.page(cursor)
+            pages.append([sale.pk for sale in page])
+            if not (page.has_next() if forwards else page.has_previous()):
+                return page, pages
+            cursor = page.next_cursor if forwards else page.previous_cursor
+
+    def test_pages_follow_date_then_id(self):
+        paginator = KeysetPaginator(Sale.objects.all(), ('-date_sold', '-id'), per_page=10)
+        last, pages = self.walk(paginator)
+        expected = list(Sale.objects.order_by('-date_sold', '-id').values_list('pk', flat=True))
+        self.assertEqual([len(page) for page in pages], [10, 10, 5])
+        self.assertEqual(sum(pages, []), expected)
+
+        _, back = self.walk(paginator, last.previous_cursor, forwards=False)
+        self.assertEqual(back, [pages[1], pages[0]])
+
+    def test_tampered_cursor_restarts(self):
+        paginator = KeysetPaginator(Sale.objects.all(), ('date_sold', 'id'), per_page=10)
+        page = paginator.page('not-a-cursor')
+        self.assertFalse(page.has_previous())
+        self.assertEqual(len(page), 10)
+
+    def test_cursor_is_bound_to_its_listing(self):
+        cursor = KeysetPaginator(Sale.objects.all(), ('-date_sold', '-id'), per_page=10).page().next_cursor
+        ascending = KeysetPaginator(Sale.objects.all(), ('date_sold', 'id'), per_page=10)
+        filtered = KeysetPaginator(Sale.objects.filter(drug_sold='Drug 3'), ('-date_sold', '-id'), per_page=10)
+        for paginator in (ascending, filtered):
+            with self.assertRaises(InvalidCursor):
+                paginator.position(cursor)
+            self.assertFalse(paginator.page(cursor).has_previous())
+
+    def test_page_links_carry_posted_filters(self):
+        start = (timezone.now() - timedelta(days=60)).date().isoformat()
+        end = timezone.now().date().isoformat()
+        response = self.client.post('/bin-report/', {'start_date': start, 'end_date': end})
+        next_query = response.context['sales'].next_query
+        self.assertIn(f'start_date={start}', next_query)
+
+        response = self.client.get(f'/bin-report/?{next_query}')
+        page = response.context['sales']
+        self.assertTrue(page.has_previous())
+        self.assertEqual(len(page), 10)
+
+    def test_per_page_is_capped(self):
+        request = RequestFactory().get('/', {'per_page': '100000'})
+        self.assertEqual(get_per_page(request), MAX_PER_PAGE)
+
+
+class LedgerTests(TestCase):
+    """Stock changes are conditional on the database balance, not the instance in hand."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('clerk')
+        cls.buyer = Client.objects.create(name='Valley Vets')
+        cls.drug = Drug.objects.create(name='Oxytet', batch_no='OX-1', stock=10, dose_pack=1, reorder_level=2)
+        cls.cannister = Cannister.objects.create(name='LN2', batch_no='CN-1', stock=3, litres='35')
+
+    def stock(self, obj):
+        return type(obj).objects.values_list('stock', flat=True).get(pk=obj.pk)
+
+    def test_sell_records_balance(self):
+        sale = ledger.sell(self.drug, 4, self.buyer, self.user)
+        self.assertEqual(self.stock(self.drug), 6)
+        self.assertEqual(sale.remaining_quantity, 6)
+
+    def test_stale_instance_cannot_oversell(self):
+        stale = Drug.objects.get(pk=self.drug.pk)
+        ledger.sell(self.drug, 8, self.buyer, self.user)
+        self.assertEqual(stale.stock, 10)
+        with self.assertRaises(ledger.InsufficientStock):
+            ledger.sell(stale, 8, self.buyer, self.user)
+        self.assertEqual(self.stock(self.drug), 2)
+        self.assertEqual(Sale.objects.count(), 1)
+
+    def test_unlock_only_restores_once(self):
+        locked = ledger.lock(self.drug, 5, self.buyer, self.user)
+        self.assertEqual(self.stock(self.drug), 5)
+        ledger.unlock(locked)
+        with self.assertRaises(ledger.AlreadyProcessed):
+            ledger.unlock(locked)
+        self.assertEqual(self.stock(self.drug), 10)
+
+    def test_add_stock(self):
+        stocked = ledger.add_stock(self.drug, 15, 'Supplier', self.user)
+        self.assertEqual(stocked.total, 25)
+        self.assertEqual(self.stock(self.drug), 25)
+
+    def test_fractional_quantities_are_refused(self):
+        for quantity in (2.5, 2.0, True):
+            with self.assertRaises(ledger.StockError):
+                ledger.sell(self.drug, quantity, self.buyer, self.user)
+        self.client.force_login(self.user)
+        self.client.post(f'/sell/{self.drug.pk}/', {'quantity': '2.5', 'client': self.buyer.pk})
+        self.client.post(f'/lock/{self.drug.pk}/', {'quantity': '2.5', 'client': self.buyer.pk})
+        self.assertEqual(self.stock(self.drug), 10)
+        self.assertFalse(Sale.objects.exists() or LockedProduct.objects.exists())
+
+    def test_cannister_issue_and_return(self):
+        issued = ledger.issue_cannister(self.cannister, 3, self.buyer, self.user)
+        self.assertEqual(issued.balance, 0)
+        with self.assertRaises(ledger.InsufficientStock):
+            ledger.issue_cannister(self.cannister, 1, self.buyer, self.user)
+        ledger.return_cannister(issued, self.user)
+        with self.assertRaises(ledger.AlreadyProcessed):
+            ledger.return_cannister(issued, self.user)
+        self.assertEqual(self.stock(self.cannister), 3)
+
+
+class PresenceTests(TestCase):
+    """Online status comes from login/logout and recent requests, not session rows."""
+
+    def setUp(self):
+        self.user = User.objects.create_user('nurse', password='pw')
+        User.objects.create_user('idle')
+
+    def test_login_request_and_logout(self):
+        self.assertEqual(presence.online_user_ids(), set())
+        self.client.login(username='nurse', password='pw')
+        self.assertEqual(presence.online_user_ids(), {self.user.pk})
+
+        UserPresence.objects.filter(user=self.user).update(last_seen=timezone.now() - timedelta(days=1))
+        self.assertEqual(presence.online_user_ids(), set())
+        session = self.client.session
+        session[presence.SESSION_KEY] = 0
+        session.save()
+        self.client.get('/bin-report/')
+        self.assertEqual(presence.online_user_ids(), {self.user.pk})
+
+        self.client.logout()
+        self.assertEqual(presence.online_user_ids(), set())
+
+    def test_online_offline_endpoint(self):
+        self.client.login(username='nurse', password='pw')
+        with self.assertNumQueries(1):
+            users = presence.users_with_presence()
+        self.assertEqual({user.username: user.is_online for user in users}, {'nurse': True, 'idle': False})
+
+
+class CachingTests(TestCase):
+    """Cached fragments are reused until a write to one of their tables."""
+
+    def setUp(self):
+        caching.get_cache().clear()
+        self.user = User.objects.create_user('clerk')
+        self.drug = Drug.objects.create(name='Oxytet', batch_no='OX-1', stock=3, dose_pack=1, reorder_level=5)
+
+    def test_summary_is_cached_until_stock_changes(self):
+        self.assertEqual(cached_summary()['low_stock_products'], 1)
+        with self.assertNumQueries(0):
+            cached_summary()
+        ledger.add_stock(self.drug, 10, 'Supplier', self.user)
+        self.assertEqual(cached_summary()['low_stock_products'], 0)
+
+    def test_drug_lists_follow_saves_and_deletes(self):
+        def out_of_stock():
+            return cached_drugs('out_of_stock', Q(stock=0))
+        self.assertEqual(out_of_stock(), [])
+        self.drug.stock = 0
+        self.drug.save()
+        self.assertEqual(out_of_stock(), [self.drug])
+        self.drug.delete()
+        self.assertEqual(out_of_stock(), [])
+
+
+class CountryCodeTests(SimpleTestCase):
+    """Stored phones split on the longest known calling code."""
+
+    def test_split_phone(self):
+        self.assertEqual(split_phone('+254712345678'), ('254', '712345678'))
+        self.assertEqual(split_phone('+1 (555) 010-0000'), ('1', '5550100000'))
+        self.assertEqual(split_phone('0712 345 678'), ('', '0712345678'))
+        self.assertEqual(split_phone(None), ('', ''))
+
+    def test_longest_prefix_wins(self):
+        table = ({'code': '1', 'name': 'A'}, {'code': '1242', 'name': 'B'})
+        with patch('Inventory.countries.country_table', return_value=table):
+            calling_code_trie.cache_clear()
+            try:
+                self.assertEqual(split_phone('+12425550000'), ('1242', '5550000'))
+                self.assertEqual(split_phone('+12125550000'), ('1', '2125550000'))
+                self.assertEqual(split_phone('+999'), ('', '999'))
+            finally:
+                calling_code_trie.cache_clear()
+
+
+class PopulateDummyDataTests(TestCase):
+    """The generator loads the requested scale and a seed makes it repeatable."""
+
+    def populate(self, seed):
+        call_command('populate_dummy_data', drugs=20, clients=5, sales=200, days=14, seed=seed,
+                     batch_size=64, stdout=StringIO())
+        return list(Sale.objects.order_by('date_sold', 'drug_sold').values_list('drug_sold', 'quantity'))
+
+    def test_scale_and_seed(self):
+        first = self.populate(seed=7)
+        self.assertEqual((Drug.objects.count(), Client.objects.count(), len(first)), (20, 5, 200))
+        self.assertEqual(self.populate(seed=7), first)
+        oldest = Sale.objects.order_by('date_sold').values_list('date_sold', flat=True).first()
+        self.assertGreater(oldest, timezone.now() - timedelta(days=15))
+        self.assertEqual(ProductSalesTotal.objects.aggregate(total=Sum('total_quantity'))['total'],
+                         Sale.objects.aggregate(total=Sum('quantity'))['total'])
+
+
+class BenchmarkTests(TestCase):
+    """Every benchmarked endpoint answers on generated data and reports its costs."""
+
+    def test_every_endpoint(self):
+        call_command('populate_dummy_data', drugs=10, clients=5, sales=50, seed=3, stdout=StringIO())
+        results = benchmarks.run(User.objects.get(username='admin'), repeat=1)
+        self.assertEqual(set(results), {endpoint.name for endpoint in benchmarks.ENDPOINTS})
+        for name, result in results.items():
+            self.assertGreater(result['queries'], 0, name)
+            self.assertGreater(result['bytes'], 0, name)
+
+    def test_asgi_load(self):
+        # The WSGI side needs threads, which cannot see this test's transaction
+        call_command('populate_dummy_data', drugs=10, clients=5, sales=50, seed=3, stdout=StringIO())
+        user = User.objects.get(username='admin')
+        for endpoint in benchmarks.LOAD_ENDPOINTS:
+            clients = benchmarks._warm_clients(user, endpoint, 2)
+            result = async_to_sync(benchmarks.load_asgi)(clients, endpoint, 4)
+            self.assertEqual(result['requests'], 4, endpoint.name)
+            self.assertLessEqual(result['p50_ms'], result['max_ms'], endpoint.name)
+
+
+@override_settings(INSTRUMENTATION=True, SLOW_QUERY_MS=0, SLOW_REQUEST_MS=60000)
+class InstrumentationTests(TestCase):
+    """Instrumented requests report their query costs in a header and the log."""
+
+    def setUp(self):
+        self.client.force_login(User.objects.create_user('clerk'))
+
+    def test_server_timing_and_log(self):
+        with self.assertLogs('Inventory.instrumentation', 'INFO') as logs:
+            response = self.client.get('/bin-report/')
+        self.assertRegex(response['Server-Timing'], r'^total;dur=[\d.]+, db;dur=[\d.]+;desc="\d+ queries"$')
+        request_line = next(line for line in logs.output if 'view=bin_report' in line)
+        self.assertIn('status=200', request_line)
+        self.assertTrue(any('slow_query view=bin_report' in line and 'SELECT' in line for line in logs.output))
+
+    def test_counts_repeated_statements(self):
+        timing = instrumentation.RequestTiming()
+        with connection.execute_wrapper(timing):
+            for _ in range(3):
+                list(Drug.objects.filter(pk=1))
+        self.assertEqual((timing.queries, timing.duplicates), (3, 2))
+
+
+class MetricsTests(TestCase):
+    """Requests, stock movements and exports show up in the /metrics exposition."""
+
+    def setUp(self):
+        for metric in metrics.REGISTRY:
+            metric.clear()
+        self.user = User.objects.create_user('clerk')
+        self.drug = Drug.objects.create(name='Oxytet', batch_no='OX-1', stock=10, dose_pack=1, reorder_level=2)
+        self.client.force_login(self.user)
+
+    def test_stock_operations_count_on_commit(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            ledger.sell(self.drug, 4, None, self.user)
+        with self.assertRaises(ledger.InsufficientStock):
+            ledger.sell(self.drug, 40, None, self.user)
+        self.assertEqual(metrics.STOCK_OPERATIONS.value(operation='sale'), 1)
+        self.assertEqual(metrics.STOCK_QUANTITY.value(operation='sale'), 4)
+
+    def test_exposition(self):
+        self.client.get('/bin-report/')
+        self.client.get('/download/top-sold/')
+        with override_settings(METRICS_PUBLIC=True):
+            response = self.client.get('/metrics')
+        self.assertEqual(response['Content-Type'], metrics.CONTENT_TYPE)
+        text = response.content.decode()
+        self.assertIn('inventory_request_duration_seconds_count{view="bin_report",method="GET"} 1', text)
+        self.assertIn('inventory_request_duration_seconds_bucket{view="bin_report",method="GET",le="+Inf"} 1', text)
+        self.assertIn('inventory_export_rows_total{export="top_sold"} 0', text)
+        self.assertIn('# TYPE inventory_db_connections_open gauge', text)
+
+    @override_settings(METRICS_TOKEN='secret')
+    def test_token_or_staff(self):
+        self.assertEqual(self.client.get('/metrics').status_code, 401)
+        self.assertEqual(self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer wrong').status_code, 401)
+        self.client.logout()
+        self.assertEqual(self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer secret').status_code, 200)
+        self.client.force_login(User.objects.create_user('admin2', is_staff=True))
+        self.assertEqual(self.client.get('/metrics').status_code, 200)
+
+    def test_private_unless_waived(self):
+        self.client.logout()
+        self.assertEqual(self.client.get('/metrics').status_code, 401)
+        with override_settings(METRICS_PUBLIC=True):
+            self.assertEqual(self.client.get('/metrics').status_code, 200)
+
+
+class ListingQueryCountTests(TestCase):
+    """Listing pages run the same number of queries however many rows they show."""
+
+    def setUp(self):
+        self.user = User.objects.create_user('clerk')
+        self.client.force_login(self.user)
+        self.rows = 0
+
+    def add_rows(self, count):
+        for _ in range(count):
+            self.rows += 1
+            buyer = Client.objects.create(name=f'Client {self.rows}')
+            drug = Drug.objects.create(name=f'Drug {self.rows}', batch_no=f'B{self.rows}', stock=100,
+                                       dose_pack=1, reorder_level=1)
+            Sale.objects.create(drug_sold=drug.name, batch_no=drug.batch_no, client=buyer, seller=self.user,
+                                quantity=1, remaining_quantity=99)
+            LockedProduct.objects.create(drug=drug, locked_by=self.user, client=buyer, quantity=1)
+            IssuedCannister.objects.create(name='LN2', batch_no=f'C{self.rows}', staff_on_duty=self.user,
+                                           returned_by=self.user, client=buyer, quantity=1)
+            IssuedItem.objects.create(item='Cap', stock=1, issued_to='Field', quantity_issued=1, issued_by=self.user)
+            PickingList.objects.create(date=date.today(), client=buyer, product=drug.name, batch_no=drug.batch_no,
+                                       quantity=1)
+            Stocked.objects.create(drug_name=drug, staff=self.user, number_added=1, total=101)
+
+    def count_queries(self, method, url, data=None):
+        with CaptureQueriesContext(connection) as queries:
+            response = getattr(self.client, method)(url, data or {})
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def assertConstantQueries(self, method, url, data=None):
+        self.add_rows(1)
+        few = self.count_queries(method, url, data)
+        self.add_rows(4)
+        self.assertEqual(self.count_queries(method, url, data), few)
+
+    def test_locked_products(self):
+        self.assertConstantQueries('get', '/locked-products/')
+
+    def test_locked_search(self):
+        self.assertConstantQueries('post', '/locked-products/search/', {'quiz': 'Drug'})
+
+    def test_bin_report(self):
+        self.assertConstantQueries('get', '/bin-report/')
+
+    def test_bin_filter(self):
+        self.assertConstantQueries('post', '/bin_filter/')
+
+    def test_bin_card(self):
+        self.assertConstantQueries('get', '/bin-card/')
+
+    def test_picking_list(self):
+        self.assertConstantQueries('get', '/picking-list/')
+
+    def test_issued_items(self):
+        self.assertConstantQueries('get', '/issued-items/')
+
+    def test_stocked(self):
+        today = date.today()
+        self.assertConstantQueries('get', '/stocked/', {'date_start': today - timedelta(days=1),
+                                                        'date_end': today + timedelta(days=1)})
+
+
+class DrugLinkTests(TestCase):
+    """Movement rows point at the drug, cannister or item they copy their names from."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('clerk')
+        cls.drug = Drug.objects.create(name='Oxytet', batch_no='OX-1', stock=10, dose_pack=1, reorder_level=2)
+        cls.cannister = Cannister.objects.create(name='LN2', batch_no='CN-1', stock=3, litres='35')
+
+    def test_ledger_links_new_rows(self):
+        self.assertEqual(ledger.sell(self.drug, 1, None, self.user).drug, self.drug)
+        issued = ledger.issue_cannister(self.cannister, 1, None, self.user)
+        self.assertEqual(issued.cannister, self.cannister)
+        Cannister.objects.filter(pk=self.cannister.pk).update(batch_no='CN-2')
+        ledger.return_cannister(issued, self.user)
+        self.assertEqual(Cannister.objects.get(pk=self.cannister.pk).stock, 3)
+
+    def test_backfill(self):
+        twin = Drug.objects.create(name='Oxytet', batch_no='OX-2', stock=1, dose_pack=1, reorder_level=2)
+        by_batch = Sale.objects.create(drug_sold='Oxytet', batch_no='OX-2', quantity=1)
+        by_name = Sale.objects.create(drug_sold='Oxytet', batch_no='', quantity=1)
+        unknown = Sale.objects.create(drug_sold='Retired', batch_no='RT-1', quantity=1)
+        issued = IssuedCannister.objects.create(name='LN2', batch_no='CN-1', staff_on_duty=self.user, quantity=1)
+
+        import_module('Inventory.migrations.0032_backfill_foreign_keys').link_rows(apps, None)
+
+        linked = dict(Sale.objects.values_list('pk', 'drug'))
+        self.assertEqual(linked, {by_batch.pk: twin.pk, by_name.pk: self.drug.pk, unknown.pk: None})
+        self.assertEqual(IssuedCannister.objects.get(pk=issued.pk).cannister, self.cannister)
+
+    def test_rebuild_totals_keeps_names_as_sold(self):
+        ledger.sell(self.drug, 2, None, self.user)
+        Drug.objects.filter(pk=self.drug.pk).update(name='Oxytetracycline')
+        ledger.sell(Drug.objects.get(pk=self.drug.pk), 3, None, self.user)
+        Sale.objects.create(drug_sold='Retired', quantity=4)
+        incremental = dict(ProductSalesTotal.objects.values_list('drug_sold', 'total_quantity'))
+        ProductSalesTotal.rebuild()
+        self.assertEqual(dict(ProductSalesTotal.objects.values_list('drug_sold', 'total_quantity')), incremental)
+        self.assertEqual(incremental, {'Oxytet': 2, 'Oxytetracycline': 3, 'Retired': 4})
+
+
+class ProductSalesTotalTests(TestCase):
+    """Running totals follow sales as they are created, edited and deleted."""
+
+    def totals(self):
+        return dict(ProductSalesTotal.objects.values_list('drug_sold', 'total_quantity'))
+
+    def test_create_edit_delete(self):
+        sale = Sale.objects.create(drug_sold='Oxytet', quantity=3)
+        Sale.objects.create(drug_sold='Oxytet', quantity=2)
+        self.assertEqual(self.totals(), {'Oxytet': 5})
+
+        sale.quantity = 7
+        sale.save()
+        self.assertEqual(self.totals(), {'Oxytet': 9})
+
+        sale.drug_sold = 'Ivermectin'
+        sale.save()
+        sale.save()
+        self.assertEqual(self.totals(), {'Oxytet': 2, 'Ivermectin': 7})
+
+        sale.delete()
+        self.assertEqual(self.totals(), {'Oxytet': 2, 'Ivermectin': 0})
+
+    def test_rebuild_repairs_drift(self):
+        sale = Sale.objects.create(drug_sold='Oxytet', quantity=3)
+        Sale.objects.create(drug_sold='Ivermectin', quantity=1)
+        Sale.objects.filter(pk=sale.pk).update(quantity=10)  # update() sends no signals
+        self.assertEqual(self.totals(), {'Oxytet': 3, 'Ivermectin': 1})
+        self.assertEqual(ProductSalesTotal.rebuild(), 2)
+        self.assertEqual(self.totals(), {'Oxytet': 10, 'Ivermectin': 1})
+
+
+class ExportJobTests(TestCase):
+    """Queued exports return at once and are produced by a worker."""
+
+    def setUp(self):
+        root = tempfile.TemporaryDirectory()
+        self.addCleanup(root.cleanup)
+        overrides = override_settings(EXPORT_ROOT=root.name, EXPORT_WORKER_THREADS=0, EXPORT_QUEUE=True)
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+        self.user = User.objects.create_user('clerk')
+        self.client.force_login(self.user)
+        buyer = Client.objects.create(name='Valley Vets')
+        Sale.objects.create(drug_sold='Oxytet', batch_no='OX-1', client=buyer, quantity=3)
+        Sale.objects.create(drug_sold='Ivermectin', batch_no='IV-1', client=buyer, quantity=1)
+
+    def test_queue_poll_download(self):
+        queued = self.client.post('/exports/bin_report/queue/', {'search': 'oxy'})
+        self.assertEqual(queued.status_code, 202)
+        self.assertEqual(self.client.get(queued.json()['status_url']).json()['status'], 'pending')
+
+        self.assertEqual(jobs.run_pending(), 1)
+        status = self.client.get(queued.json()['status_url']).json()
+        self.assertEqual((status['status'], status['progress'], status['total']), ('done', 1, 1))
+
+        response = self.client.get(status['download_url'])
+        workbook = load_workbook(io.BytesIO(b''.join(response.streaming_content)))
+        response.close()
+        rows = list(workbook.active.iter_rows(min_row=3, values_only=True))
+        self.assertEqual([row[0] for row in rows], ['Oxytet'])
+
+    def test_jobs_are_private(self):
+        job = jobs.enqueue('bin_card', {}, self.user)
+        self.client.force_login(User.objects.create_user('other'))
+        self.assertEqual(self.client.get(f'/exports/jobs/{job.pk}/').status_code, 404)
+
+    def test_failure_is_recorded(self):
+        job = jobs.enqueue('missing', {}, self.user)
+        with self.assertLogs('Inventory.jobs', 'ERROR'):
+            jobs.run_pending()
+        job.refresh_from_db()
+        self.assertEqual(job.status, ExportJob.FAILED)
+        self.assertIn('missing', job.error)
+
+    def test_downloads_directly_without_a_worker(self):
+        with override_settings(EXPORT_QUEUE=False):
+            self.assertEqual(self.client.post('/exports/bin_report/queue/').status_code, 503)
+            self.assertContains(self.client.get('/bin-report/'), 'const EXPORT_QUEUE = false;')
+        self.assertFalse(ExportJob.objects.exists())
+
+    def test_direct_download_fails_before_streaming(self):
+        self.assertEqual(self.client.get('/bin-report/download/', {'start_date': '17/10'}).status_code, 400)
+
+        export = exports.EXPORTS['bin_report']
+        with patch.object(export, 'rows', side_effect=RuntimeError('database gone')):
+            with self.assertRaises(RuntimeError):
+                self.client.get('/bin-report/download/')
+
+        def failing_rows(params):
+            yield ('Oxytet', 'OX-1', 3, 'Valley Vets', '2026-10-17')
+            raise RuntimeError('database gone')
+
+        with patch.object(export, 'rows', failing_rows), patch.object(views, 'EXPORT_CHUNK_SIZE', 1):
+            response = self.client.get('/bin-report/download/')
+            self.assertEqual(response.status_code, 200)
+            with self.assertLogs('Inventory.views', 'ERROR'), self.assertRaises(RuntimeError):
+                b''.join(response.streaming_content)
+            response.close()
+
+    def test_stale_jobs_fail_and_are_purged(self):
+        pending = jobs.enqueue('bin_card', {}, self.user)
+        running = jobs.enqueue('bin_card', {}, self.user)
+        fresh = jobs.enqueue('bin_card', {}, self.user)
+        hour_ago = timezone.now() - timedelta(hours=1)
+        ExportJob.objects.filter(pk=pending.pk).update(created_at=hour_ago)
+        ExportJob.objects.filter(pk=running.pk).update(status=ExportJob.RUNNING, started_at=hour_ago)
+
+        with override_settings(EXPORT_JOB_TIMEOUT=600):
+            status = self.client.get(f'/exports/jobs/{pending.pk}/').json()
+            self.assertEqual(status['status'], 'failed')
+            self.assertEqual(jobs.purge_expired(), 0)
+        self.assertEqual(
+            dict(ExportJob.objects.values_list('pk', 'status')),
+            {pending.pk: ExportJob.FAILED, running.pk: ExportJob.FAILED, fresh.pk: ExportJob.PENDING},
+        )
+        with override_settings(EXPORT_JOB_TIMEOUT=600, EXPORT_JOB_TTL=60):
+            self.assertEqual(jobs.purge_expired(now=timezone.now() + timedelta(minutes=5)), 2)
+        self.assertEqual(list(ExportJob.objects.values_list('pk', flat=True)), [fresh.pk])
+
+
+class TemplateCacheTests(SimpleTestCase):
+    """The export template is parsed once and reparsed only when it changes."""
+
+    def setUp(self):
+        root = tempfile.TemporaryDirectory()
+        self.addCleanup(root.cleanup)
+        self.path = os.path.join(root.name, 'template.xlsx')
+        shutil.copy(exports.template_path(), self.path)
+
+    def test_reuses_until_mtime_changes(self):
+        header = exports.template_header(self.path)
+        self.assertIs(exports.template_header(self.path), header)
+
+        mtime = os.stat(self.path).st_mtime + 10
+        os.utime(self.path, (mtime, mtime))
+        self.assertIsNot(exports.template_header(self.path), header)
+
+    def test_streamed_workbook_has_header(self):
+        header = exports.template_header(self.path)
+        data = b''.join(exports.stream_xlsx([('Oxytet', 'OX-1', 3)], header))
+        ws = load_workbook(io.BytesIO(data))[exports.TEMPLATE_SHEET]
+        self.assertEqual(ws.cell(3, 1).value, 'Oxytet')
+        self.assertEqual(ws.cell(3, 3).value, 3)
+        self.assertIsNotNone(ws.cell(2, 1).value)
+
+
+class BulkExportTests(TestCase):
+    """Bulk exports stream every row once and resume from the returned cursor."""
+
+    def setUp(self):
+        self.user = User.objects.create_user('analyst')
+        self.client.force_login(self.user)
+        buyer = Client.objects.create(name='Valley Vets')
+        self.sales = [
+            Sale.objects.create(drug_sold=f'Drug {i}', batch_no=f'B{i}', client=buyer, quantity=i, seller=self.user)
+            for i in range(1, 6)
+        ]
+
+    def get(self, **params):
+        response = self.client.get('/exports/data/sales/', params)
+        body = b''.join(response.streaming_content)
+        response.close()
+        return response, body
+
+    def test_csv_in_batches(self):
+        with patch('Inventory.bulk.BATCH_SIZE', 2):
+            response, body = self.get()
+        lines = body.decode().splitlines()
+        self.assertEqual(lines[0].split(',')[:4], ['id', 'date_sold', 'drug_id', 'drug'])
+        self.assertEqual([line.split(',')[3] for line in lines[1:]], [f'Drug {i}' for i in range(1, 6)])
+        self.assertEqual(response['X-Next-Cursor'], str(self.sales[-1].pk))
+
+    def test_cursor_and_limit(self):
+        response, body = self.get(format='ndjson', since_id=self.sales[0].pk, limit=2)
+        records = [json.loads(line) for line in body.decode().splitlines()]
+        self.assertEqual([r['drug'] for r in records], ['Drug 2', 'Drug 3'])
+        self.assertEqual(records[0]['client'], 'Valley Vets')
+        self.assertEqual(response['X-Next-Cursor'], str(self.sales[2].pk))
+
+        response, body = self.get(format='ndjson', since_id=self.sales[-1].pk)
+        self.assertEqual(body, b'')
+        self.assertEqual(response['X-Next-Cursor'], str(self.sales[-1].pk))
+
+    @override_settings(BULK_EXPORT_LAG=60)
+    def test_recent_rows_wait_for_the_next_pull(self):
+        settled = timezone.now() - timedelta(minutes=5)
+        Sale.objects.filter(pk__in=[sale.pk for sale in self.sales[:3]]).update(date_sold=settled)
+        response, body = self.get(format='ndjson')
+        self.assertEqual([json.loads(line)['drug'] for line in body.decode().splitlines()],
+                         ['Drug 1', 'Drug 2', 'Drug 3'])
+        self.assertEqual(response['X-Next-Cursor'], str(self.sales[3].pk - 1))
+
+    def test_date_range_and_gzip(self):
+        Sale.objects.filter(pk=self.sales[0].pk).update(date_sold=timezone.now() - timedelta(days=30))
+        today = timezone.localdate().isoformat()
+        response, body = self.get(gzip='1', start_date=today, end_date=today)
+        self.assertEqual(response['Content-Type'], 'application/gzip')
+        self.assertEqual(len(gzip.decompress(body).decode().splitlines()), 1 + 4)
+
+    def test_rejects_bad_parameters_and_anonymous(self):
+        self.assertEqual(self.client.get('/exports/data/sales/', {'since_id': 'x'}).status_code, 400)
+        self.assertEqual(self.client.get('/exports/data/unknown/').status_code, 404)
+        self.client.logout()
+        self.assertEqual(self.client.get('/exports/data/sales/').status_code, 401)
+        with override_settings(BULK_EXPORT_TOKEN='secret'):
+            response = self.client.get('/exports/data/stocked/', HTTP_AUTHORIZATION='Bearer secret')
+        self.assertEqual(response.status_code, 200)
+        response.close()
+
+
+class ApiTests(TestCase):
+    """The JSON API pages with cursors and applies batches all or nothing."""
+
+    def setUp(self):
+        self.user = User.objects.create_user('scanner')
+        self.client.force_login(self.user)
+        self.buyer = Client.objects.create(name='Valley Vets')
+        self.drugs = [
+            Drug.objects.create(name=f'Drug {i}', batch_no=f'B{i}', stock=10, dose_pack=1, reorder_level=2)
+            for i in range(1, 6)
+        ]
+
+    def post(self, path, body, **extra):
+        return self.client.post(path, json.dumps(body), content_type='application/json', **extra)
+
+    def test_list_with_fields_and_cursor(self):
+        names = []
+        params = {'fields': 'name,stock', 'per_page': 2}
+        while True:
+            body = self.client.get('/api/drugs/', params).json()
+            self.assertEqual({key for row in body['results'] for key in row}, {'name', 'stock'})
+            names += [row['name'] for row in body['results']]
+            if not body['next_cursor']:
+                break
+            params['cursor'] = body['next_cursor']
+        self.assertEqual(names, [f'Drug {i}' for i in range(1, 6)])
+
+    def test_list_rejects_bad_requests(self):
+        self.assertEqual(self.client.get('/api/drugs/', {'fields': 'name,price'}).status_code, 400)
+        self.assertEqual(self.client.get('/api/drugs/', {'cursor': 'forged'}).status_code, 400)
+        self.assertEqual(self.client.get('/api/unknown/').status_code, 404)
+        self.client.logout()
+        self.assertEqual(self.client.get('/api/clients/').status_code, 401)
+
+    def test_batch_sale(self):
+        response = self.post('/api/sales/batch/', {'client': self.buyer.pk, 'lines': [
+            {'drug': self.drugs[1].pk, 'quantity': 3},
+            {'drug': self.drugs[0].pk, 'quantity': 4},
+            {'drug': self.drugs[1].pk, 'quantity': 2},
+        ]})
+        self.assertEqual(response.status_code, 201)
+        results = response.json()['results']
+        self.assertEqual([(r['drug'], r['remaining_quantity']) for r in results],
+                         [('Drug 2', 7), ('Drug 1', 6), ('Drug 2', 5)])
+        self.assertEqual({r['client'] for r in results}, {'Valley Vets'})
+        self.assertEqual(Drug.objects.get(pk=self.drugs[1].pk).stock, 5)
+
+    def test_failed_line_rolls_back_the_batch(self):
+        response = self.post('/api/locked-products/batch/', {'client': self.buyer.pk, 'lines': [
+            {'drug': self.drugs[0].pk, 'quantity': 4},
+            {'drug': self.drugs[1].pk, 'quantity': 11},
+        ]})
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.json()['line'], 1)
+        self.assertEqual(Drug.objects.get(pk=self.drugs[0].pk).stock, 10)
+        self.assertFalse(LockedProduct.objects.exists())
+
+        response = self.post('/api/sales/batch/', {'lines': [{'drug': self.drugs[0].pk, 'quantity': 1}]})
+        self.assertEqual((response.status_code, response.json()['line']), (400, 0))
+        self.assertFalse(Sale.objects.exists())
+
+    def test_fractional_quantities_are_refused(self):
+        line = {'drug': self.drugs[0].pk, 'quantity': 2.5}
+        for path in ('/api/sales/batch/', '/api/locked-products/batch/', '/api/stock/batch/'):
+            response = self.post(path, {'client': self.buyer.pk, 'lines': [line]})
+            self.assertEqual((response.status_code, response.json()['line']), (400, 0), path)
+        self.assertEqual(Drug.objects.get(pk=self.drugs[0].pk).stock, 10)
+
+    @override_settings(API_TOKENS={'scanner-token': 'scanner'})
+    def test_token_and_csrf(self):
+        csrf_client = type(self.client)(enforce_csrf_checks=True)
+        csrf_client.force_login(self.user)
+        body = json.dumps({'supplier': 'acme', 'lines': [{'drug': self.drugs[2].pk, 'quantity': 5}]})
+        response = csrf_client.post('/api/stock/batch/', body, content_type='application/json')
+        self.assertEqual(response.status_code, 403)
+
+        response = type(self.client)().post(
+            '/api/stock/batch/', body, content_type='application/json', HTTP_AUTHORIZATION='Bearer scanner-token'
+        )
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()['results'][0]['total'], 15)
+        self.assertEqual(response.json()['results'][0]['staff'], 'scanner')
+
+
+@skipUnless(connection.vendor == 'sqlite', 'SQLite pragmas')
+class SQLitePragmaTests(SimpleTestCase):
+    """New SQLite connections run in WAL mode with a busy timeout."""
+
+    def test_pragmas_applied_on_connect(self):
+        root = tempfile.TemporaryDirectory()
+        self.addCleanup(root.cleanup)
+        wrapper = connections['default'].__class__(
+            {**connection.settings_dict, 'NAME': os.path.join(root.name, 'db.sqlite3')}, alias='pragma_test'
+        )
+        self.addCleanup(wrapper.close)
+        with wrapper.cursor() as cursor:
+            cursor.execute('PRAGMA journal_mode')
+            self.assertEqual(cursor.fetchone()[0], 'wal')
+            cursor.execute('PRAGMA synchronous')
+            self.assertEqual(cursor.fetchone()[0], 1)  # NORMAL
+            cursor.execute('PRAGMA busy_timeout')
+            self.assertEqual(cursor.fetchone()[0], settings.SQLITE_PRAGMAS['busy_timeout'])
+
+
+class SessionRefreshTests(TestCase):
+    """Sessions are saved when they change or their refresh is due, not on every request."""
+
+    def setUp(self):
+        User.objects.create_user('nurse', password='pw')
+        self.client.login(username='nurse', password='pw')
+        self.client.get('/bin-report/')
+
+    def session_writes(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get('/bin-report/')
+        return [q['sql'] for q in queries if 'django_session' in q['sql'] and not q['sql'].startswith('SELECT')]
+
+    def test_no_write_within_interval(self):
+        self.assertEqual(self.session_writes(), [])
+
+    def test_write_once_interval_passed(self):
+        session = self.client.session
+        session[sessions.SESSION_KEY] -= settings.SESSION_REFRESH_INTERVAL + 1
+        session.save()
+        self.assertEqual(len(self.session_writes()), 1)
+        self.assertEqual(self.session_writes(), [])
+
+
+class LiveUpdateTests(TestCase):
+    """Committed stock changes and presence are broadcast to open pages."""
+
+    def setUp(self):
+        self.layer = get_channel_layer()
+        self.channel = async_to_sync(self.layer.new_channel)()
+        async_to_sync(self.layer.group_add)(live.STOCK_GROUP, self.channel)
+        self.addCleanup(async_to_sync(self.layer.group_discard), live.STOCK_GROUP, self.channel)
+        self.user = User.objects.create_user('clerk')
+
+    def test_sale_broadcast_after_commit(self):
+        drug = Drug.objects.create(name='Oxytet', batch_no='OX-1', stock=10, dose_pack=1, reorder_level=5)
+        with self.captureOnCommitCallbacks(execute=True):
+            ledger.sell(drug, 7, Client.objects.create(name='Valley Vets'), self.user)
+        message = async_to_sync(self.layer.receive)(self.channel)
+        self.assertEqual(message['operation'], 'sale')
+        self.assertEqual((message['drug']['id'], message['drug']['stock']), (drug.pk, 3))
+        self.assertEqual(message['summary']['low_stock_products'], 1)
+
+    def test_rolled_back_sale_is_not_broadcast(self):
+        drug = Drug.objects.create(name='Oxytet', batch_no='OX-1', stock=1, dose_pack=1, reorder_level=0)
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            with self.assertRaises(ledger.InsufficientStock):
+                ledger.sell(drug, 2, None, self.user)
+        self.assertEqual(callbacks, [])
+
+
+class ConsumerTests(SimpleTestCase):
+    """WebSocket consumers admit signed-in users and relay their group's messages."""
+
+    class SignedIn:
+        is_authenticated = True
+
+        def get_username(self):
+            return 'nurse'
+
+    async def connect(self, consumer, path, user):
+        communicator = ApplicationCommunicator(consumer.as_asgi(), {
+            'type': 'websocket', 'path': path, 'headers': [], 'subprotocols': [], 'user': user,
+        })
+        await communicator.send_input({'type': 'websocket.connect'})
+        reply = await communicator.receive_output()
+        return communicator, reply['type'] == 'websocket.accept'
+
+    async def receive_json(self, communicator):
+        return json.loads((await communicator.receive_output())['text'])
+
+    async def disconnect(self, communicator):
+        await communicator.send_input({'type': 'websocket.disconnect', 'code': 1000})
+        await communicator.wait()
+
+    async def test_anonymous_rejected(self):
+        communicator, connected = await self.connect(StockConsumer, '/ws/stock/', AnonymousUser())
+        self.assertFalse(connected)
+        await self.disconnect(communicator)
+
+    async def test_stock_relayed(self):
+        communicator, connected = await self.connect(StockConsumer, '/ws/stock/', self.SignedIn())
+        self.assertTrue(connected)
+        await get_channel_layer().group_send(live.STOCK_GROUP, {
+            'type': 'stock.changed', 'operation': 'sale', 'drug': {'id': 1, 'stock': 3}, 'summary': {},
+        })
+        self.assertEqual((await self.receive_json(communicator))['drug'], {'id': 1, 'stock': 3})
+        await self.disconnect(communicator)
+
+    async def test_status_uses_signed_in_user(self):
+        communicator, connected = await self.connect(UserStatusConsumer, '/ws/user_status/', self.SignedIn())
+        self.assertTrue(connected)
+        await communicator.send_input({'type': 'websocket.receive', 'text': json.dumps({'user': 'someone-else', 'status': 'offline'})})
+        self.assertEqual(await self.receive_json(communicator), {'user': 'nurse', 'status': 'offline'})
+        await self.disconnect(communicator)
+
+
+class AsyncViewTests(TestCase):
+    """The async report and search views render what their sync namesakes do."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('clerk')
+        today = date.today()
+        Drug.objects.create(name='Oxytet', batch_no='OX-1', stock=2, dose_pack=1, reorder_level=5,
+                            expiry_date=today + timedelta(days=30))
+        Drug.objects.create(name='Ivermectin', batch_no='IV-1', stock=0, dose_pack=1, reorder_level=5)
+        Drug.objects.create(name='Penstrep', batch_no='PS-1', stock=50, dose_pack=1, reorder_level=5)
+        Cannister.objects.create(name='Liquid N2', batch_no='LN-1', stock=3, litres=30)
+        Client.objects.create(name='Valley Vets')
+
+    def request(self, factory, method, data):
+        request = getattr(factory, method)('/', data)
+        request.user = self.user
+        request.session = SessionStore()
+        return request
+
+    async def acall(self, name, method, data):
+        return await getattr(async_views, name)(self.request(AsyncRequestFactory(), method, data))
+
+    def assertSamePage(self, name, method='get', data=None):
+        caching.get_cache().clear()
+        expected = getattr(views, name)(self.request(RequestFactory(), method, data or {}))
+        caching.get_cache().clear()
+        actual = async_to_sync(self.acall)(name, method, data or {})
+
+        def strip(content):
+            return re.sub(rb'name="csrfmiddlewaretoken" value="[^"]*"', b'', content)
+        self.assertEqual(actual.status_code, expected.status_code)
+        self.assertEqual(strip(actual.content), strip(expected.content))
+
+    def test_summary_matches(self):
+        self.assertEqual(async_to_sync(adashboard_summary)(), dashboard_summary())
+
+    def test_reports(self):
+        for name in ['dashboard', 'low_stock_view', 'out_of_stock', 'expiring_soon', 'get_online_offline_users']:
+            with self.subTest(name):
+                self.assertSamePage(name)
+
+    def test_searches(self):
+        self.assertSamePage('search', 'post', {'q': 'Oxy'})
+        self.assertSamePage('search', 'post')
+        self.assertSamePage('searchstock', 'post', {'s': 'Iver'})
+        self.assertSamePage('binsearch', 'get', {'search': 'OX'})
+        self.assertSamePage('locked_search', 'post', {'quiz': 'Oxy'})
+        self.assertSamePage('marketing_search', 'post', {'search': 'Cap'})
+        self.assertSamePage('search_cannister', 'post', {'q': 'Liquid'})
+
+    def test_anonymous_redirected(self):
+        request = AsyncRequestFactory().get('/low-stock/')
+        request.user = AnonymousUser()
+        response = async_to_sync(async_views.low_stock_view)(request)
+        self.assertEqual(response.status_code, 302)
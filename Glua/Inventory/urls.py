@@ -1,11 +1,15 @@
+from django.conf import settings
 from django.contrib import admin
 from django.urls import path
-from . import views
+from . import async_views, views
 from .views import stockingListView, modifyDrugUpdateView
 from django.contrib.auth.decorators import login_required
 
+# Read-only reports and searches have async versions for ASGI deployments
+reports = async_views if settings.ASYNC_VIEWS else views
+
 urlpatterns = [
-    path('', views.dashboard, name='dashboard'),  # Redirect to dashboard by default after login
+    path('', reports.dashboard, name='dashboard'),  # Redirect to dashboard by default after login
     path('create/', views.createDrug, name='create'),
     path('addstock/<int:pk>/', views.addStock, name='addstock'),
     path('stocking/', stockingListView.as_view(), name='stocking'),
@@ -13,20 +17,20 @@ urlpatterns = [
     path('stocked/', views.StockAdded, name='stocked'),
     path('sell/<int:pk>/', views.sellDrug, name='sell'),
     path('lock/<int:pk>/', views.lockDrug, name='lock_item'),
-    path('search/', views.search, name='search'),
-    path('bin-report/search/', views.binsearch, name='bin_search'),
-    path('search/stock/', views.searchstock, name='searchstock'),
+    path('search/', reports.search, name='search'),
+    path('bin-report/search/', reports.binsearch, name='bin_search'),
+    path('search/stock/', reports.searchstock, name='searchstock'),
     path('history/', views.salehistory, name='history'),
     path('today/', views.todaysales, name='today'),
     path('bin-report/', views.bin_report, name='bin_report'),
     path('bin-report/download/', views.download_bin_report_excel, name='download_bin_report_excel'),
-    path('out-of-stock/', views.out_of_stock, name='out_of_stock'),
-    path('expiring-soon/', views.expiring_soon, name='expiring_soon'),
+    path('out-of-stock/', reports.out_of_stock, name='out_of_stock'),
+    path('expiring-soon/', reports.expiring_soon, name='expiring_soon'),
     path('vaccines/', views.home, name='home'),
-    path('low-stock/', views.low_stock_view, name='low_stock'),
-    path('get_online_offline_users/', views.get_online_offline_users, name='get_online_offline_users'),
+    path('low-stock/', reports.low_stock_view, name='low_stock'),
+    path('get_online_offline_users/', reports.get_online_offline_users, name='get_online_offline_users'),
     path('locked-products/', views.locked_products, name='locked_products'),
-    path('locked-products/search/', views.locked_search, name='locked_search'),
+    path('locked-products/search/', reports.locked_search, name='locked_search'),
     path('locked-products/post/<int:lock_id>/', views.post_locked_product, name='post_locked_product'),
     path('locked-products/unlock/<int:lock_id>/', views.unlock_product, name='unlock_product'),
     path('add_user/', views.add_user, name='add_user'),  # URL for adding a user
@@ -35,7 +39,7 @@ urlpatterns = [
     path('bin_filter/', views.bin_filter, name='bin_filter'),
     path('logout-inactivity/', views.logout_due_to_inactivity, name='logout_due_to_inactivity'),
     path('marketing_items/', views.marketing_items, name='marketing_items'),
-    path('marketing-search/', views.marketing_search, name='marketing_search'),  
+    path('marketing-search/', reports.marketing_search, name='marketing_search'),  
     path('issue_item/', views.issue_item, name='issue_item'),
     path('issued-items/', views.issued_items_report, name='issued_items_report'),
     path('issued-items/search/', views.issued_items_search, name='issued_items_search'),
@@ -47,11 +51,21 @@ urlpatterns = [
     path('cannisters/issue/<int:cannister_id>/', views.issue_cannister, name='issue_cannister'),
     path('bin-card/', views.bin_card, name='bin_card'),
     path('bin-card/download/', views.download_bin_card_excel, name='download_bin_card_excel'),
+    path('exports/<str:kind>/queue/', views.queue_export, name='queue_export'),
+    path('exports/jobs/<int:job_id>/', views.export_job_status, name='export_job_status'),
+    path('exports/jobs/<int:job_id>/download/', views.download_export_job, name='download_export_job'),
+    path('exports/data/<str:dataset>/', views.bulk_export, name='bulk_export'),
     path('bin-card/search/', views.bin_search, name='can_search'),
     path('bin-card/filter/', views.can_filter, name='can_filter'),
     path('bin-card/return/<int:issued_cannister_id>/', views.return_cannister, name='return_cannister'),
-    path('search-cannister/', views.search_cannister, name='search_cannister'),
+    path('search-cannister/', reports.search_cannister, name='search_cannister'),
     path('download/top-sold/', views.download_top_sold, name='download_top_sold'),
+    path('metrics', views.metrics_view, name='metrics'),
+    # JSON API
+    path('api/sales/batch/', views.api_sell, name='api_sell'),
+    path('api/locked-products/batch/', views.api_lock, name='api_lock'),
+    path('api/stock/batch/', views.api_add_stock, name='api_add_stock'),
+    path('api/<str:resource>/', views.api_list, name='api_list'),
     # Client management paths
     path('clients/', views.client_list, name='client_list'),
     path('clients/create/', views.create_client, name='create_client'),
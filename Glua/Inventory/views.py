@@ -1,68 +1,54 @@
 import csv
+import logging
+from itertools import chain, islice
 from django.shortcuts import render, redirect, get_object_or_404
-from django.http import HttpResponse
+from django.urls import reverse
+from django.http import HttpResponse, StreamingHttpResponse, FileResponse, Http404
 from django.db.models import Sum, F, Q
-from .models import Drug, Sale, Stocked, LockedProduct, MarketingItem, IssuedItem, PickingList, Cannister, IssuedCannister, Client
+from .models import Drug, Sale, Stocked, LockedProduct, MarketingItem, IssuedItem, PickingList, Cannister, IssuedCannister, Client, ProductSalesTotal, ExportJob
 from .forms import DrugCreation
+from .dashboard import cached_summary, cached_drugs, drug_filters, has_alerts
+from .search import search_filter, match as search_match
+from .exports import (
+    template_header, stream_xlsx, export_params, check_export_params, EXPORTS,
+    EXPORT_CHUNK_SIZE, XLSX_CONTENT_TYPE, TOP_SOLD_ROWS,
+)
+from .pagination import paginate
+from . import api, bulk, caching, jobs, ledger, metrics
+from .presence import users_with_presence
+from .countries import get_countries, split_phone
 from django.contrib import messages
 from django.views.generic import ListView, UpdateView
 from django.contrib.auth.decorators import login_required
 from django.utils import timezone
-from django.utils.timezone import now, localtime, make_aware
+from django.utils.timezone import localtime
 from datetime import datetime, timedelta, time
-from django.db.models import Count
 from django.http import JsonResponse
 from django.contrib.auth.models import User
-from django.contrib.sessions.models import Session
 from django.contrib.auth import logout
-from django.core.paginator import Paginator
 from django.utils.dateparse import parse_date
 from django.views.decorators.csrf import csrf_exempt
-from openpyxl import load_workbook
-from openpyxl.styles import Font, Alignment, PatternFill
+from django.utils.crypto import constant_time_compare
 from django.conf import settings
 import os
-try:
-    import pycountry
-    import phonenumbers
-except Exception:
-    pycountry = None
-    phonenumbers = None
 
 
+logger = logging.getLogger(__name__)
+
 # Create your views here.
 
-def get_countries():
-    """Return a list of country calling codes and names.
-    If `phonenumbers` and `pycountry` are available build a comprehensive list;
-    otherwise return a small default list.
-    """
-    if phonenumbers and pycountry:
-        code_map = phonenumbers.COUNTRY_CODE_TO_REGION_CODE
-        countries_dict = {}
-        for code, regions in code_map.items():
-            names = []
-            for r in regions:
-                try:
-                    country = pycountry.countries.get(alpha_2=r)
-                    if country:
-                        names.append(country.name)
-                    else:
-                        names.append(r)
-                except Exception:
-                    names.append(r)
-            # join unique names for this code
-            countries_dict[str(code)] = ', '.join(sorted(set(names)))
-        countries = [{'code': code, 'name': name} for code, name in sorted(countries_dict.items(), key=lambda x: int(x[0]))]
-        return countries
-    # fallback small list
-    return [
-        {'code': '254', 'name': 'Kenya'},
-        {'code': '1', 'name': 'United States'},
-        {'code': '44', 'name': 'United Kingdom'},
-        {'code': '234', 'name': 'Nigeria'},
-        {'code': '91', 'name': 'India'},
-    ]
+def whole_number(value):
+    """``value`` parsed as an int, or None when it is not a whole number."""
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def client_choices():
+    """All clients ordered by name, for the client dropdowns."""
+    return caching.cached('client_choices', lambda: list(Client.objects.order_by('name')), models=[Client])
+
 
 @login_required
 def home(request):
@@ -74,27 +60,21 @@ def home(request):
     # Get the products with stock below the reorder level
     low_stock = Drug.objects.filter(stock__lte=F('reorder_level'))
 
-    # Pagination handling
-    per_page = request.GET.get('per_page', 10)  # Default to 10 per page
-    page_number = request.GET.get('page', 1)    # Get the current page number
-    drugs = Drug.objects.all().order_by('name')# Get all drugs ordered by name
-
-    # Create a paginator and get the page object for the current page
-    paginator = Paginator(drugs, per_page)
-    page_obj = paginator.get_page(page_number)
+    # Pagination handling, drugs ordered by name
+    page_obj = paginate(request, Drug.objects.all(), ('name', 'id'))
 
     # Get all clients for the dropdown
-    clients = Client.objects.all().order_by('name')
+    clients = client_choices()
 
     # Check if the modal has already been shown in this session
     show_modal = not request.session.get('modal_shown', False)  # Only show modal if 'modal_shown' is not set or False
 
     if show_modal:
-        print("Modal will be shown")
+        logger.debug('Modal will be shown')
         request.session['modal_shown'] = True  # Set the session variable to True after showing the modal
         request.session.modified = True  # Ensure the session is saved
     else:
-        print("Modal already shown in this session")
+        logger.debug('Modal already shown in this session')
 
     # Pass these to the template
     context = {
@@ -137,10 +117,11 @@ def addStock(request, pk):
     drug = Drug.objects.get(id=pk)
     supp = request.POST.get('supplier')
     amount_added = int(request.POST.get('added'))
-    drug.stock += amount_added
-    Stocked.objects.create(
-        drug_name=drug, supplier=supp, staff=request.user, number_added=amount_added, total=drug.stock)
-    drug.save()
+    try:
+        ledger.add_stock(drug, amount_added, supp, request.user)
+    except ledger.StockError as e:
+        messages.error(request, str(e))
+        return redirect('stocking')
     messages.success(request, f'{amount_added} {drug.name} added')
     return redirect('stocking')
 
@@ -156,10 +137,14 @@ class stockingListView(ListView):
 @login_required
 def sellDrug(request, pk):
     if request.method == 'POST':
-        quantity = float(request.POST.get('quantity'))
+        quantity = whole_number(request.POST.get('quantity'))
         client_id = request.POST.get('client')
         drug = get_object_or_404(Drug, pk=pk)
 
+        if quantity is None:
+            messages.error(request, 'Quantity must be a whole number')
+            return redirect('home')
+
         if not client_id:
             messages.error(request, 'Please select a client')
             return redirect('home')
@@ -170,34 +155,28 @@ def sellDrug(request, pk):
             messages.error(request, 'Selected client does not exist')
             return redirect('home')
 
-        if drug.stock >= quantity:
-            # Update drug stock
-            drug.stock -= quantity
-            drug.save()
-
-            # Create sale record
-            Sale.objects.create(
-                seller=request.user,
-                drug_sold=drug.name,
-                client=client,
-                batch_no=drug.batch_no,
-                quantity=quantity,
-                remaining_quantity=drug.stock
-            )
-
+        # Deduct stock and record the sale in one transaction
+        try:
+            ledger.sell(drug, quantity, client, request.user)
             messages.success(request, f'{quantity} {drug.name} sold to {client.name}')
-        else:
+        except ledger.InsufficientStock:
             messages.error(request, 'Not enough stock available')
+        except ledger.StockError as e:
+            messages.error(request, str(e))
 
         return redirect('home')
 
 @login_required
 def lockDrug(request, pk):
     if request.method == 'POST':
-        quantity = float(request.POST.get('quantity'))
+        quantity = whole_number(request.POST.get('quantity'))
         client_id = request.POST.get('client')
         drug = get_object_or_404(Drug, pk=pk)
 
+        if quantity is None:
+            messages.error(request, 'Quantity must be a whole number')
+            return redirect('home')
+
         if not client_id:
             messages.error(request, 'Please select a client')
             return redirect('home')
@@ -208,17 +187,9 @@ def lockDrug(request, pk):
             messages.error(request, 'Selected client does not exist')
             return redirect('home')
 
-        if drug.stock >= quantity:
-            # Lock product by creating a LockedProduct record
-            LockedProduct.objects.create(
-                drug=drug,
-                locked_by=request.user,
-                quantity=quantity,
-                client=client
-            )
-
-            drug.stock -= quantity
-            drug.save()
+        try:
+            # Reserve the stock and create the LockedProduct record together
+            ledger.lock(drug, quantity, client, request.user)
 
     #         last_sale = Sale.objects.filter(drug_sold=drug).order_by('-date_sold').first()
 
@@ -229,11 +200,11 @@ def lockDrug(request, pk):
     #             last_sale.remaining_quantity = drug.stock
     #             last_sale.save()
 
-            # Reduce stock
-
             messages.success(request, f'{quantity} {drug.name} locked.')
-        else:
+        except ledger.InsufficientStock:
             messages.error(request, 'Not enough stock to lock')
+        except ledger.StockError as e:
+            messages.error(request, str(e))
 
         return redirect('home')
 
@@ -243,26 +214,30 @@ def search(request):
     query = request.POST.get('q')
 
     if query:
-        drugs = Drug.objects.filter(
+        drugs = search_filter(
+            Drug.objects.all(), 'drug', query,
             Q(name__icontains=query) | Q(batch_no__icontains=query))
 
     # Get all clients for the dropdown
-    clients = Client.objects.all().order_by('name')
+    clients = client_choices()
 
     context = {'drugs': drugs, 'clients': clients}
     return render(request, 'Inventory/home.html', context)
 
 
 def binsearch(request):
-    bins = Sale.objects.all().order_by('drug_sold')
+    bins = Sale.objects.for_report().order_by('drug_sold')
     
     # Get search query from GET request or fallback to POST request
     query = request.GET.get('search') or request.POST.get('quiz')
 
-    print("Search Query:", query)  # Debugging the query received
+    logger.debug('Search query: %s', query)
 
+    # Searched on the names as sold, not through Sale.drug: a renamed drug must
+    # still find its old sales, and unlinked rows have no drug to join
     if query:
-        bins = bins.filter(
+        bins = search_filter(
+            bins, 'sale', query,
             Q(drug_sold__icontains=query) |
             Q(batch_no__icontains=query) |
             Q(client__name__icontains=query)
@@ -276,7 +251,9 @@ def searchstock(request):
     query = request.POST.get('s')
 
     if query:
-        drugs = Drug.objects.filter(Q(name__icontains=query)).order_by('name')
+        drugs = search_filter(
+            Drug.objects.all(), 'drug', query, Q(name__icontains=query), columns=['name']
+        ).order_by('name')
 
     context = {'drugs': drugs}
     return render(request, 'Inventory/stock.html', context)
@@ -286,7 +263,7 @@ def salehistory(request):
     start_date = request.GET.get('start_date')
     end_date = request.GET.get('end_date')
     if start_date and end_date:
-        sales = Sale.objects.filter(
+        sales = Sale.objects.for_report().filter(
             date_sold__range=[start_date, end_date]).order_by('-date_sold')
         if sales:
             total_sales = sales.aggregate(
@@ -312,7 +289,7 @@ def todaysales(request):
     end_date = datetime.combine(tomorrow, time())
 
     if start_date and end_date:
-        sales = Sale.objects.filter(
+        sales = Sale.objects.for_report().filter(
             date_sold__range=[start_date, end_date]).order_by('-date_sold')
         if sales:
             total_sales = sales.aggregate(
@@ -334,7 +311,7 @@ def StockAdded(request):
     start_date = request.GET.get('date_start')
     end_date = request.GET.get('date_end')
     if start_date and end_date:
-        glua_stocked_days = Stocked.objects.filter(
+        glua_stocked_days = Stocked.objects.for_listing().filter(
             date_added__range=[start_date, end_date]).order_by('-date_added')
         context = {'stocked': glua_stocked_days}
     else:
@@ -351,225 +328,166 @@ class modifyDrugUpdateView(UpdateView):
 
 
 def bin_report(request):
-    # Get all sales ordered by date sold
-    sales = Sale.objects.all().order_by('-date_sold')
-    
-    # Get date range filters from the request
-    start_date = request.POST.get('start_date')
-    end_date = request.POST.get('end_date')
+    # Get all sales, latest first
+    sales = Sale.objects.for_report()
+    ordering = ('-date_sold', '-id')
     
+    # Get date range filters from the form, or from the page links
+    params = request.POST if request.method == 'POST' else request.GET
+    filters = {'start_date': params.get('start_date'), 'end_date': params.get('end_date')}
+
     # Filter sales based on the date range, if provided
-    if start_date and end_date:
+    if filters['start_date'] and filters['end_date']:
         try:
-            start_date = datetime.strptime(start_date, "%Y-%m-%d").date()
-            end_date = datetime.strptime(end_date, "%Y-%m-%d").date()
-            sales = sales.filter(date_sold__range=(start_date, end_date)).order_by('date_sold')
+            start_date = datetime.strptime(filters['start_date'], "%Y-%m-%d").date()
+            end_date = datetime.strptime(filters['end_date'], "%Y-%m-%d").date()
+            sales = sales.filter(date_sold__range=(start_date, end_date))
+            ordering = ('date_sold', 'id')
         except ValueError:
-            pass  # Ignore invalid dates
+            filters = {}  # Ignore invalid dates
 
-    # Pagination setup
-    per_page = int(request.GET.get('per_page', 10))  # Default to 10 items per page
-    paginator = Paginator(sales, per_page)
-    page_number = request.GET.get('page', 1)
-    page_obj = paginator.get_page(page_number)
+    # Keyset pagination, so old pages cost the same as the first one
+    page_obj = paginate(request, sales, ordering, keyset=True, estimate=True, filters=filters)
 
     return render(request, 'Inventory/bin.html', {'sales': page_obj})
 
 @login_required
 def download_bin_report_excel(request):
     """Export bin report as styled Excel file using template"""
-    try:
-        # Load template
-        template_path = os.path.join(settings.BASE_DIR, 'Inventory transfer record template11.xlsx')
-        wb = load_workbook(template_path)
-        ws = wb['Template']  # Work with Template sheet
-        
-        # Delete rows 3 and 4 (template placeholder data)
-        ws.delete_rows(3, 2)
-        
-        # Get all sales
-        sales = Sale.objects.all().order_by('-date_sold')
-        
-        # Apply search filter if provided
-        search_query = request.GET.get('search') or request.GET.get('q') or request.POST.get('q')
-        if search_query:
-            sales = sales.filter(
-                Q(drug_sold__icontains=search_query) |
-                Q(batch_no__icontains=search_query) |
-                Q(client__name__icontains=search_query)
-            )
-        
-        # Apply date range filters
-        start_date = request.GET.get('start_date') or request.POST.get('start_date')
-        end_date = request.GET.get('end_date') or request.POST.get('end_date')
-        
-        if start_date and end_date:
-            try:
-                start_date_obj = datetime.strptime(start_date, "%Y-%m-%d").date()
-                end_date_obj = datetime.strptime(end_date, "%Y-%m-%d").date()
-                sales = sales.filter(date_sold__range=(start_date_obj, end_date_obj)).order_by('date_sold')
-            except ValueError:
-                pass
-        else:
-            sales = sales.order_by('-date_sold')
-        
-        # Start writing data from row 3 (after headers)
-        row_num = 3
-        for sale in sales:
-            ws.cell(row=row_num, column=1, value=sale.drug_sold if sale.drug_sold else '')
-            ws.cell(row=row_num, column=2, value=sale.batch_no if sale.batch_no else '')
-            ws.cell(row=row_num, column=3, value=sale.quantity)
-            ws.cell(row=row_num, column=4, value=sale.client.name if sale.client else '')
-            ws.cell(row=row_num, column=5, value=sale.date_sold.strftime('%Y-%m-%d') if sale.date_sold else '')
-            row_num += 1
-        
-        # Create response
-        response = HttpResponse(
-            content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
-        )
-        response['Content-Disposition'] = 'attachment; filename="bin_report.xlsx"'
-        wb.save(response)
-        return response
-        
-    except Exception as e:
-        return HttpResponse(f"Error generating Excel file: {str(e)}", status=500)
+    return download_excel(request, EXPORTS['bin_report'])
 
 
 @login_required
 def download_bin_card_excel(request):
     """Export bin card as styled Excel file using template"""
+    return download_excel(request, EXPORTS['bin_card'])
+
+
+def download_excel(request, export):
+    """Stream ``export`` with the search and date filters given in the request.
+
+    Anything that can fail before the file is complete is checked while a
+    500 can still be sent: the filters, the template and the first batch of
+    rows. A failure after that can only cut the download short, and is logged.
+    """
+    params = export_params(request)
     try:
-        # Load template
-        template_path = os.path.join(settings.BASE_DIR, 'Inventory transfer record template11.xlsx')
-        wb = load_workbook(template_path)
-        ws = wb['Template']  # Work with Template sheet
-        
-        # Delete rows 3 and 4 (template placeholder data)
-        ws.delete_rows(3, 2)
-        
-        # Get all issued cannisters
-        issued_cannisters = IssuedCannister.objects.all().order_by('-date_issued')
-        
-        # Apply search filter if provided
-        search_query = request.GET.get('search') or request.POST.get('search')
-        if search_query:
-            issued_cannisters = issued_cannisters.filter(
-                Q(name__icontains=search_query) |
-                Q(batch_no__icontains=search_query) |
-                Q(staff_on_duty__username__icontains=search_query)
-            )
-        
-        # Apply date range filters
-        start_date = request.GET.get('start_date') or request.POST.get('start_date')
-        end_date = request.GET.get('end_date') or request.POST.get('end_date')
-        
-        if start_date and end_date:
-            try:
-                start_date_obj = datetime.strptime(start_date, "%Y-%m-%d").date()
-                end_date_obj = datetime.strptime(end_date, "%Y-%m-%d").date()
-                issued_cannisters = issued_cannisters.filter(
-                    date_issued__range=(start_date_obj, end_date_obj)
-                ).order_by('date_issued')
-            except ValueError:
-                pass
-        else:
-            issued_cannisters = issued_cannisters.order_by('-date_issued')
-        
-        # Start writing data from row 3 (after headers)
-        row_num = 3
-        for cannister in issued_cannisters:
-            ws.cell(row=row_num, column=1, value=cannister.name if cannister.name else '')
-            ws.cell(row=row_num, column=2, value=cannister.batch_no if cannister.batch_no else '')
-            ws.cell(row=row_num, column=3, value=cannister.staff_on_duty.username if cannister.staff_on_duty else '')
-            ws.cell(row=row_num, column=4, value=cannister.client.name if cannister.client else '')
-            ws.cell(row=row_num, column=5, value=cannister.quantity)
-            ws.cell(row=row_num, column=6, value=cannister.balance)
-            ws.cell(row=row_num, column=7, value=cannister.date_issued.strftime('%Y-%m-%d') if cannister.date_issued else '')
-            ws.cell(row=row_num, column=8, value=cannister.date_returned.strftime('%Y-%m-%d') if cannister.date_returned else '')
-            row_num += 1
-        
-        # Create response
-        response = HttpResponse(
-            content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
-        )
-        response['Content-Disposition'] = 'attachment; filename="bin_card.xlsx"'
-        wb.save(response)
-        return response
-        
-    except Exception as e:
-        return HttpResponse(f"Error generating Excel file: {str(e)}", status=500)
+        check_export_params(params)
+    except ValueError as e:
+        return HttpResponse(str(e), status=400)
+
+    # Header layout and styles, parsed from the template once per process
+    header = template_header()
+
+    # Rows are produced lazily while the workbook streams out; the first
+    # batch is read now so that a failing query still answers with a 500
+    rows = metrics.track_export(export.name, export.rows(params))
+    first = list(islice(rows, EXPORT_CHUNK_SIZE))
+
+    response = StreamingHttpResponse(
+        _logged_stream(export, stream_xlsx(chain(first, rows), header)), content_type=XLSX_CONTENT_TYPE
+    )
+    response['Content-Disposition'] = f'attachment; filename="{export.filename}"'
+    return response
+
+
+def _logged_stream(export, chunks):
+    try:
+        yield from chunks
+    except Exception:
+        logger.exception('Export %s failed while streaming', export.name)
+        raise
 
 
 @login_required
-def dashboard(request):
-    today = timezone.now().date()
+def queue_export(request, kind):
+    """Queue a background export with the request's filters and return its status URL."""
+    if request.method != 'POST':
+        return JsonResponse({'error': 'POST required'}, status=405)
+    if kind not in EXPORTS:
+        raise Http404
+    if not settings.EXPORT_QUEUE:
+        # No worker would ever pick the job up; the page downloads directly instead
+        return JsonResponse({'error': 'Background exports are not enabled'}, status=503)
+    job = jobs.enqueue(kind, export_params(request), request.user)
+    return JsonResponse(export_job_json(job), status=202)
+
+
+def get_export_job(request, job_id):
+    jobs_visible = ExportJob.objects.all() if request.user.is_staff else request.user.export_jobs.all()
+    return get_object_or_404(jobs_visible, pk=job_id)
+
+
+def export_job_json(job):
+    data = {
+        'id': job.pk,
+        'kind': job.kind,
+        'status': job.status,
+        'progress': job.progress,
+        'total': job.total,
+        'status_url': reverse('export_job_status', args=[job.pk]),
+    }
+    if job.status == ExportJob.DONE:
+        data['download_url'] = reverse('download_export_job', args=[job.pk])
+    if job.status == ExportJob.FAILED:
+        data['error'] = job.error
+    return data
 
-    # Get the expired products (expiry date is in the past)
-    expired_drugs = Drug.objects.filter(expiry_date__lt=today, stock__gt=0)
 
-    # Get the products expiring within the next 10 days
-    expiring_soon = Drug.objects.filter(expiry_date__lte=today + timedelta(days=180), expiry_date__gt=today, stock__gt=0).order_by('expiry_date')
+@login_required
+def export_job_status(request, job_id):
+    job = get_export_job(request, job_id)
+    if jobs.fail_stale(ExportJob.objects.filter(pk=job.pk)):
+        job.refresh_from_db()
+    return JsonResponse(export_job_json(job))
 
-    # Get the products with stock below the reorder level
-    low_stock = Drug.objects.filter(stock__lte=F('reorder_level'), stock__gt=0)
-    out_of_stock = Drug.objects.filter(stock=0)
+
+@login_required
+def download_export_job(request, job_id):
+    job = get_export_job(request, job_id)
+    if job.status != ExportJob.DONE or not os.path.exists(job.output_path):
+        raise Http404
+    return FileResponse(
+        open(job.output_path, 'rb'), as_attachment=True,
+        filename=EXPORTS[job.kind].filename, content_type=XLSX_CONTENT_TYPE,
+    )
+
+
+@login_required
+def dashboard(request):
+    today = timezone.now().date()
+    summary = cached_summary(today)
+    filters = drug_filters(today)
 
     # Check if the modal should be shown (only when there are low stock or expiring soon products)
     show_modal = False
-    if low_stock.exists() or expiring_soon.exists() or out_of_stock.exists():
+    if has_alerts(summary):
         show_modal = not request.session.get('modal_shown', False)  # Only show modal if 'modal_shown' is not set or False
 
     if show_modal:
         request.session['modal_shown'] = True  # Set the session variable to True after showing the modal
         request.session.modified = True  # Ensure the session is saved
 
-    # Summary Data
-    total_products = Drug.objects.count()
-    low_stock_products = Drug.objects.filter(stock__lte=F('reorder_level'), stock__gt=0).count()
-    out_of_stock_products = Drug.objects.filter(stock=0).count()
-    zero_stock_products = Drug.objects.filter(stock__lte=5).count()
-    locked_products = LockedProduct.objects.all().count()
-    marketing_items = MarketingItem.objects.all().count()
-    total_picking_list = PickingList.objects.all().count()
-    cannisters = Cannister.objects.all().count()
-
     # Top Sold Products
-    top_sold_products = (
-        Sale.objects.values("drug_sold")
-        .annotate(total_quantity=Sum("quantity"))
-        .order_by("-total_quantity")[:210000]
-    )
+    top_sold_products = ProductSalesTotal.objects.values("drug_sold", "total_quantity")
 
-    # Calculate the total count of expired and expiring soon drugs
-    total_expiring_count = expired_drugs.count() + expiring_soon.count()
-
-    context = {
-        'total_products': total_products,
-        'low_stock_products': low_stock_products,
-        'out_of_stock_products': out_of_stock_products,
-        'zero_stock_products': zero_stock_products,
+    # The lists below are lazy and only hit the database when the modal renders them
+    context = dict(summary)
+    context.update({
         'top_sold_products': top_sold_products,
-        'expired_drugs_count': expired_drugs.count(),  # Add the count of expired drugs
-        'expiring_soon_count': expiring_soon.count(),  # Add the count of expiring soon drugs
-        'total_expiring_count': total_expiring_count,  # Add the total count of expired and expiring soon drugs
-        'expired_drugs': expired_drugs,  # Pass expired drugs to the template
-        'expiring_soon': expiring_soon,  # Pass expiring soon drugs to the template
-        'low_stock': low_stock,
+        'expired_drugs': Drug.objects.filter(filters['expired']),
+        'expiring_soon': Drug.objects.filter(filters['expiring_soon']).order_by('expiry_date'),
+        'low_stock': Drug.objects.filter(filters['low_stock']),
+        'out_of_stock': Drug.objects.filter(filters['out_of_stock']),
         'show_modal': show_modal,
-        'locked_products': locked_products,
-        'marketing_items': marketing_items,
-        'total_picking_list': total_picking_list,
-        'cannisters':cannisters,
-        'out_of_stock':out_of_stock
-    }
-    print("Context out_of_stock:", list(out_of_stock))
+    })
     return render(request, 'Inventory/dashboard.html', context)
 
 
 @login_required
 def low_stock_view(request):
     # Get the products with stock below or equal to the reorder level
-    low_stock = Drug.objects.filter(stock__lte=F('reorder_level'), stock__gt=0)
+    low_stock = cached_drugs('low_stock', Q(stock__lte=F('reorder_level'), stock__gt=0))
 
     context = {
         'low_stock': low_stock
@@ -578,12 +496,10 @@ def low_stock_view(request):
     return render(request, 'Inventory/lowstock.html', context)
 
 def get_online_offline_users(request):
-    # Get all users
-    all_users = User.objects.all()
-
-    # Split them into online and offline users
-    online_users = [user.username for user in all_users if user.is_active]  # Assuming 'is_active' indicates online status
-    offline_users = [user.username for user in all_users if not user.is_active]  # Assuming 'is_active' indicates offline status
+    # Get all users, split by whether they have been seen within the session lifetime
+    all_users = users_with_presence()
+    online_users = [user.username for user in all_users if user.is_online]
+    offline_users = [user.username for user in all_users if not user.is_online]
 
     # Return as JSON response
     return JsonResponse({
@@ -597,7 +513,7 @@ def locked_products(request):
     Display the list of locked products in ascending order by the drug name.
     """
     # Fetch all locked products and order by the drug's name
-    locked_products = LockedProduct.objects.all().order_by('-date_locked')
+    locked_products = LockedProduct.objects.for_listing().order_by('-date_locked')
     return render(request, 'Inventory/locked.html', {'locked_products': locked_products})
 
 @login_required
@@ -611,18 +527,12 @@ def post_locked_product(request, lock_id):
         client = lock.client  # Assuming 'locked_by' is a User and you need their username as the client.
         drug = lock.drug
 
-        # Create sale record
-        Sale.objects.create(
-            seller=request.user,
-            drug_sold=drug.name,
-            client=client,
-            batch_no=drug.batch_no,
-            quantity=quantity,
-            remaining_quantity=drug.stock
-        )
-
-        # Delete the locked product
-        lock.delete()
+        # Create the sale record and delete the locked product together
+        try:
+            ledger.post_lock(lock, request.user)
+        except ledger.AlreadyProcessed as e:
+            messages.error(request, str(e))
+            return redirect('locked_products')
 
         # Display a success message
         messages.success(request, f'{quantity} {drug.name} sold to {client} and lock removed.')
@@ -639,11 +549,13 @@ def unlock_product(request, lock_id):
     # Fetch the locked product instance
     lock = get_object_or_404(LockedProduct, id=lock_id)
 
-    # Add the locked quantity back to the drug's stock
+    # Delete the lock and add the locked quantity back to the drug's stock
     drug = lock.drug
-    if lock.quantity:  # Ensure the quantity is not None or empty
-        drug.stock += int(lock.quantity)  # Adding the locked quantity back to the stock
-        drug.save()  # Save the updated stock to the database
+    try:
+        ledger.unlock(lock)
+    except ledger.AlreadyProcessed as e:
+        messages.error(request, str(e))
+        return redirect('locked_products')
 
     # Fetch the last sale entry for this drug
     # last_sale = Sale.objects.filter(drug_sold=drug).order_by('-date_sold').first()
@@ -655,9 +567,6 @@ def unlock_product(request, lock_id):
     #     last_sale.remaining_quantity = drug.stock
     #     last_sale.save()  # Save the updated remaining quantity
 
-    # Delete the locked product after updating the stock and sales
-    lock.delete()
-
     # Redirect to the locked products page
     messages.success(request, f"{lock.quantity} {drug.name} unlocked and added back to stock.")
     return redirect('locked_products')
@@ -665,9 +574,11 @@ def unlock_product(request, lock_id):
 
 @login_required
 def locked_search(request):
-    query = request.POST.get('quiz', '')  # Retrieve the search query from the form
-    locked_products = LockedProduct.objects.filter(
-        Q(drug__name__icontains=query) | Q(locked_by__username__icontains=query)
+    query = request.POST.get('quiz', '').strip()  # Retrieve the search query from the form
+    drug_matches = search_match('drug', query, columns=['name']) if query else None
+    drug_q = Q(drug__in=drug_matches) if drug_matches is not None else Q(drug__name__icontains=query)
+    locked_products = LockedProduct.objects.for_listing().filter(
+        drug_q | Q(locked_by__username__icontains=query)
     ).order_by('-date_locked')  # Search for drug name or locked_by username containing the query (case-insensitive)
 
     return render(request, 'Inventory/locked.html', {'locked_products': locked_products})
@@ -701,16 +612,11 @@ def user_management(request):
     # # Update last activity timestamp as a string
     # request.session['last_activity'] = current_time.strftime('%Y-%m-%d %H:%M:%S')
 
-    # Get all users
-    users = User.objects.all()
-
-    # Get session information to track online users and their login times
-    sessions = Session.objects.filter(expire_date__gte=now())
-    online_user_ids = [session.get_decoded().get('_auth_user_id') for session in sessions]
+    # Get all users with their online status from the presence table
+    users = users_with_presence()
 
-    # Annotate users with their online/offline status, login time, and logout time
+    # Annotate users with their login time and logout time
     for user in users:
-        user.is_online = str(user.id) in online_user_ids
         if user.is_online:
             # If the user is online, show login time
             user.login_time = localtime(user.last_login).strftime('%Y-%m-%d %H:%M:%S') if user.last_login else None
@@ -718,7 +624,8 @@ def user_management(request):
         else:
             # If the user is offline, show logout time
             user.login_time = None  # No login time for offline users
-            user.logout_time = localtime(user.last_login).strftime('%Y-%m-%d %H:%M:%S') if user.last_login else "N/A"
+            last_seen = user.last_seen or user.last_login
+            user.logout_time = localtime(last_seen).strftime('%Y-%m-%d %H:%M:%S') if last_seen else "N/A"
 
     context = {
         'users': users,
@@ -758,13 +665,15 @@ def user_logout(request):
 
 @login_required
 def out_of_stock(request):
-    out_of_stock_products = Drug.objects.filter(stock=0)
+    out_of_stock_products = cached_drugs('out_of_stock', Q(stock=0))
     return render(request, 'Inventory/out_of_stock.html', {'out_of_stock': out_of_stock_products})
 
 @login_required
 def expiring_soon(request):
     today = timezone.now().date()
-    expiring_products = Drug.objects.filter(expiry_date__lte=today + timedelta(days=180), stock__gt=0).order_by('expiry_date')
+    expiring_products = cached_drugs(
+        'expiring_soon', Q(expiry_date__lte=today + timedelta(days=180), stock__gt=0), ('expiry_date',), today
+    )
     return render(request, 'Inventory/expiring_soon.html', {'expiring_soon': expiring_products})
 
 blue_shades = [
@@ -808,17 +717,18 @@ def bin_filter(request):
             end_date = parse_date(end_date)
 
         # Filter the sales by date range
+        sales = Sale.objects.for_report()
         if start_date and end_date:
-            sales = Sale.objects.filter(date_sold__range=[start_date, end_date]).order_by('date_sold')
+            sales = sales.filter(date_sold__range=[start_date, end_date]).order_by('date_sold')
         elif start_date:
-            sales = Sale.objects.filter(date_sold__gte=start_date).order_by('date_sold')
+            sales = sales.filter(date_sold__gte=start_date).order_by('date_sold')
         elif end_date:
-            sales = Sale.objects.filter(date_sold__lte=end_date).order_by('date_sold')
+            sales = sales.filter(date_sold__lte=end_date).order_by('date_sold')
         else:
-            sales = Sale.objects.all().order_by('date_sold')  # Default to all if no dates provided
+            sales = sales.order_by('date_sold')  # Default to all if no dates provided
 
     else:
-        sales = Sale.objects.all().order_by('date_sold')  # Default to all sales if not a POST request
+        sales = Sale.objects.for_report().order_by('date_sold')  # Default to all sales if not a POST request
 
     return render(request, 'Inventory/bin.html', {'sales': sales})
 
@@ -842,7 +752,9 @@ def marketing_items(request):
 def marketing_search(request):
     if request.method == 'POST':
         search_query = request.POST.get('search', '').strip()  # Get the search query from the form
-        marketing_items = MarketingItem.objects.filter(name__icontains=search_query)  # Perform a case-insensitive search
+        marketing_items = search_filter(
+            MarketingItem.objects.all(), 'marketingitem', search_query, Q(name__icontains=search_query)
+        )  # Perform a case-insensitive search
 
         # Pass the search results and query back to the template
         return render(request, 'Inventory/marketing_items.html', {
@@ -872,20 +784,12 @@ def issue_item(request):
             elif quantity_issued <= 0:
                 messages.error(request, f"Invalid quantity issued for {marketing_item.name}.")
             else:
-                # Deduct the stock from MarketingItem
-                marketing_item.stock -= quantity_issued
-                marketing_item.save()
-
-                # Create a new IssuedItem entry
-                IssuedItem.objects.create(
-                    item=marketing_item.name,
-                    stock=marketing_item.stock,
-                    issued_to=issued_to,
-                    quantity_issued=quantity_issued,
-                    issued_by=request.user,
-                )
+                # Deduct the stock and create the IssuedItem entry together
+                ledger.issue_item(marketing_item, quantity_issued, issued_to, request.user)
 
                 messages.success(request, f"Issued {quantity_issued} of {marketing_item.name} to {issued_to}.")
+        except ledger.InsufficientStock:
+            messages.error(request, f"Cannot issue more than the available stock for {marketing_item.name}.")
         except ValueError:
             messages.error(request, "Invalid quantity issued. Please enter a valid number.")
         except Exception as e:
@@ -898,19 +802,10 @@ def issued_items_report(request):
     """
     View to display all issued items with pagination.
     """
-    # Fetch all issued items ordered by date
-    issued_items = IssuedItem.objects.all().order_by('-date_issued')
-    
-    # Pagination (default 10 items per page)
-    paginator = Paginator(issued_items, 10)  # Change '10' to your desired items per page
-    page_number = request.GET.get('page', 1)
-    per_page = request.GET.get('per_page', 10)
-    paginator.per_page = int(per_page)
-
-    try:
-        issued_items_page = paginator.page(page_number)
-    except Exception as e:
-        issued_items_page = paginator.page(1)
+    # Fetch all issued items, latest first
+    issued_items_page = paginate(
+        request, IssuedItem.objects.for_listing(), ('-date_issued', '-id'), keyset=True, estimate=True
+    )
 
     context = {
         'issued_items': issued_items_page,
@@ -921,28 +816,23 @@ def issued_items_search(request):
     """
     View to search issued items by query.
     """
-    if request.method == 'POST':
-        query = request.POST.get('query', '').strip()
+    params = request.POST if request.method == 'POST' else request.GET
+    if 'query' in params:
+        query = params.get('query', '').strip()
         if query:
             # Search in item, issued_to, or issued_by fields
-            issued_items = IssuedItem.objects.filter(
+            issued_items = search_filter(
+                IssuedItem.objects.for_listing(), 'issueditem', query,
                 Q(item__icontains=query) |
                 Q(issued_to__icontains=query) |
                 Q(issued_by__username__icontains=query)
             ).order_by('-date_issued')
         else:
-            issued_items = IssuedItem.objects.all()
-
-        # Pagination (default 10 items per page)
-        paginator = Paginator(issued_items, 10)
-        page_number = request.GET.get('page', 1)
-        per_page = request.GET.get('per_page', 10)
-        paginator.per_page = int(per_page)
+            issued_items = IssuedItem.objects.for_listing()
 
-        try:
-            issued_items_page = paginator.page(page_number)
-        except Exception as e:
-            issued_items_page = paginator.page(1)
+        issued_items_page = paginate(
+            request, issued_items, ('-date_issued', '-id'), keyset=True, filters={'query': query}
+        )
 
         context = {
             'issued_items': issued_items_page,
@@ -956,34 +846,29 @@ def issued_items_filter(request):
     """
     View to filter issued items by a date range.
     """
-    if request.method == 'POST':
-        start_date = request.POST.get('start_date')
-        end_date = request.POST.get('end_date')
+    params = request.POST if request.method == 'POST' else request.GET
+    if 'start_date' in params or 'end_date' in params:
+        start_date = params.get('start_date')
+        end_date = params.get('end_date')
 
         # If both dates are provided, filter by range
         if start_date and end_date:
             try:
                 start_date_obj = datetime.strptime(start_date, '%Y-%m-%d')
                 end_date_obj = datetime.strptime(end_date, '%Y-%m-%d')
-                issued_items = IssuedItem.objects.filter(
+                issued_items = IssuedItem.objects.for_listing().filter(
                     date_issued__range=(start_date_obj, end_date_obj)
                 ).order_by('-date_issued')
             except ValueError:
-                issued_items = IssuedItem.objects.all().order_by('-date_issued')
+                issued_items = IssuedItem.objects.for_listing().order_by('-date_issued')
         else:
             # If no valid date range is provided, show all items
-            issued_items = IssuedItem.objects.all().order_by('-date_issued')
-
-        # Pagination (default 10 items per page)
-        paginator = Paginator(issued_items, 10)
-        page_number = request.GET.get('page', 1)
-        per_page = request.GET.get('per_page', 10)
-        paginator.per_page = int(per_page)
+            issued_items = IssuedItem.objects.for_listing().order_by('-date_issued')
 
-        try:
-            issued_items_page = paginator.page(page_number)
-        except Exception as e:
-            issued_items_page = paginator.page(1)
+        issued_items_page = paginate(
+            request, issued_items, ('-date_issued', '-id'), keyset=True,
+            filters={'start_date': start_date, 'end_date': end_date},
+        )
 
         context = {
             'issued_items': issued_items_page,
@@ -1011,12 +896,13 @@ def create_marketing_item(request):
     return render(request, 'Inventory/create_marketing_item.html')
 
 def picking_list_view(request):
-    picking_list = PickingList.objects.all().order_by('-date')
+    picking_list = PickingList.objects.for_listing().order_by('-date')
     
     # Filtering by search query
     query = request.GET.get('search', '')
     if query:
-        picking_list = picking_list.filter(
+        picking_list = search_filter(
+            picking_list, 'pickinglist', query,
             Q(client__name__icontains=query) |  
             Q(product__icontains=query) |
             Q(batch_no__icontains=query) |
@@ -1032,10 +918,7 @@ def picking_list_view(request):
 
     
     # Pagination
-    per_page = int(request.GET.get('per_page', 10))
-    paginator = Paginator(picking_list, per_page)
-    page_number = request.GET.get('page',1)
-    page_obj = paginator.get_page(page_number)
+    page_obj = paginate(request, picking_list, ('-date', '-id'), keyset=True, estimate=True)
     
     return render(request, 'Inventory/picking_list.html', {'picking_list': page_obj})
 
@@ -1079,6 +962,7 @@ def add_to_picking_list(request, drug_id):
         PickingList.objects.create(
             date=timezone.now(),
             client=client,
+            drug=drug,
             product=drug.name,
             batch_no=drug.batch_no,
             quantity=quantity,
@@ -1092,7 +976,7 @@ def add_to_picking_list(request, drug_id):
 
 def cannister_list(request):
     cannisters = Cannister.objects.all()
-    clients = Client.objects.all().order_by('name')
+    clients = client_choices()
     return render(request, 'Inventory/cannister.html', {'cannisters': cannisters, 'clients': clients})
 
 @login_required
@@ -1107,39 +991,29 @@ def issue_cannister(request, cannister_id):
         client = get_object_or_404(Client, id=client_id) if client_id else None
 
         if quantity > 0 and quantity <= cannister.stock:
-            # Deduct stock
-            cannister.stock -= quantity
-            cannister.save()
-
-            # Save issuance record
-            IssuedCannister.objects.create(
-                name=cannister.name,
-                batch_no=cannister.batch_no,
-                staff_on_duty=request.user,
-                client=client,
-                quantity=quantity,
-                balance=cannister.stock
-            )
+            # Deduct stock and save the issuance record
+            try:
+                ledger.issue_cannister(cannister, quantity, client, request.user)
+            except ledger.InsufficientStock:
+                messages.error(request, f'Not enough {cannister.name} in stock')
     
     return redirect('cannister_list')
 
 
 @login_required
 def bin_card(request):
-    issued_cannisters = IssuedCannister.objects.all().order_by('-date_issued')
+    issued_cannisters = IssuedCannister.objects.for_listing().order_by('-date_issued')
 
     # Pagination
-    per_page = request.GET.get('per_page', 10)
-    paginator = Paginator(issued_cannisters, per_page)
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
+    page_obj = paginate(request, issued_cannisters, ('-date_issued', '-id'), keyset=True, estimate=True)
 
     return render(request, 'Inventory/cannister_bin.html', {'issued_cannisters': page_obj})
 
 @login_required
 def bin_search(request):
     query = request.GET.get('search', '')
-    issued_cannisters = IssuedCannister.objects.filter(
+    issued_cannisters = search_filter(
+        IssuedCannister.objects.for_listing(), 'issuedcannister', query,
         Q(name__icontains=query) | 
         Q(batch_no__icontains=query) |
         Q(client__name__icontains=query) |
@@ -1147,28 +1021,26 @@ def bin_search(request):
     ).order_by('-date_issued')
 
     # Pagination
-    per_page = request.GET.get('per_page', 10)
-    paginator = Paginator(issued_cannisters, per_page)
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
+    page_obj = paginate(request, issued_cannisters, ('-date_issued', '-id'), keyset=True, estimate=True)
 
     return render(request, 'Inventory/cannister_bin.html', {'issued_cannisters': page_obj})
 
 @login_required
 def can_filter(request):
-    if request.method == "POST":
-        start_date = request.POST.get('start_date')
-        end_date = request.POST.get('end_date')
+    params = request.POST if request.method == "POST" else request.GET
+    if 'start_date' in params or 'end_date' in params:
+        start_date = params.get('start_date')
+        end_date = params.get('end_date')
 
-        issued_cannisters = IssuedCannister.objects.all()
+        issued_cannisters = IssuedCannister.objects.for_listing()
         if start_date and end_date:
             issued_cannisters = issued_cannisters.filter(date_issued__range=[start_date, end_date])
 
         # Pagination
-        per_page = request.GET.get('per_page', 10)
-        paginator = Paginator(issued_cannisters, per_page)
-        page_number = request.GET.get('page')
-        page_obj = paginator.get_page(page_number)
+        page_obj = paginate(
+            request, issued_cannisters, ('-date_issued', '-id'), keyset=True,
+            filters={'start_date': start_date, 'end_date': end_date},
+        )
 
         return render(request, 'Inventory/cannister_bin.html', {'issued_cannisters': page_obj})
     
@@ -1179,25 +1051,22 @@ def return_cannister(request, issued_cannister_id):
     issued_cannister = get_object_or_404(IssuedCannister, id=issued_cannister_id)
     
     if not issued_cannister.action:  # Ensure it's not already returned
-        issued_cannister.action = True
-        issued_cannister.returned_by = request.user
-        issued_cannister.date_returned = timezone.now()
-        issued_cannister.save()
-
-        # Restore stock in the cannister model
-        cannister = Cannister.objects.get(batch_no=issued_cannister.batch_no)
-        cannister.stock += issued_cannister.quantity
-        cannister.save()
+        # Mark it returned and restore stock in the cannister model
+        try:
+            ledger.return_cannister(issued_cannister, request.user)
+        except ledger.AlreadyProcessed:
+            pass  # Returned by a concurrent request
 
     return redirect('bin_card')
 
 def search_cannister(request):
     query = request.POST.get('q', '')  # Get search input
     results = []
-    clients = Client.objects.all().order_by('name')
+    clients = client_choices()
 
     if query:
-        results = Cannister.objects.filter(
+        results = search_filter(
+            Cannister.objects.all(), 'cannister', query,
             Q(name__icontains=query) | 
             Q(batch_no__icontains=query) | 
             Q(stock__icontains=query) |   # Search by stock
@@ -1207,13 +1076,6 @@ def search_cannister(request):
     return render(request, 'Inventory/cannister.html', {'cannisters': results, 'query': query, 'clients': clients})
 @login_required
 def download_top_sold(request):
-    # Aggregate total quantity sold for each product
-    top_sold_products = (
-        Sale.objects.values('drug_sold')
-        .annotate(total_quantity=Sum('quantity'))
-        .order_by('-total_quantity')
-    )
-
     # Create the HttpResponse object with CSV header
     response = HttpResponse(content_type='text/csv')
     response['Content-Disposition'] = 'attachment; filename="top_sold_products.csv"'
@@ -1221,22 +1083,100 @@ def download_top_sold(request):
     writer = csv.writer(response)
     writer.writerow(['Product Name', 'Total Quantity Sold'])
 
-    for product in top_sold_products:
-        writer.writerow([product['drug_sold'], product['total_quantity']])
+    # Totals are maintained incrementally on every sale
+    writer.writerows(metrics.track_export('top_sold', TOP_SOLD_ROWS.rows(ProductSalesTotal.objects.all())))
 
     return response
 
 
+def bulk_export(request, dataset):
+    """Stream ``dataset`` as CSV or NDJSON, optionally gzipped; see ``Inventory.bulk``."""
+    dataset = bulk.DATASETS.get(dataset)
+    if dataset is None:
+        raise Http404
+    token = settings.BULK_EXPORT_TOKEN
+    if not request.user.is_authenticated and not (
+        token and constant_time_compare(request.headers.get('Authorization', ''), f'Bearer {token}')
+    ):
+        return JsonResponse({'error': 'Authentication required'}, status=401)
+    try:
+        options = bulk.parse_params(request.GET)
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+
+    chunks, cursor = bulk.prepare(dataset, options)
+    filename = f'{dataset.name}.{options["format"]}'
+    if options['gzip']:
+        response = StreamingHttpResponse(chunks, content_type='application/gzip')
+        filename += '.gz'
+    else:
+        response = StreamingHttpResponse(chunks, content_type=bulk.FORMATS[options['format']])
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    response['X-Next-Cursor'] = str(cursor)
+    return response
+
+
+@csrf_exempt  # api.authenticate() checks CSRF for session requests
+def api_list(request, resource):
+    """A page of ``resource`` as JSON; see ``Inventory.api``."""
+    resource = api.RESOURCES.get(resource)
+    if resource is None:
+        raise Http404
+    if request.method != 'GET':
+        return JsonResponse({'error': 'Use GET'}, status=405)
+    try:
+        api.authenticate(request)
+        return JsonResponse(resource.page(request))
+    except api.ApiError as e:
+        return JsonResponse(e.as_json(), status=e.status)
+
+
+def api_batch(request, apply):
+    if request.method != 'POST':
+        return JsonResponse({'error': 'Use POST'}, status=405)
+    try:
+        user = api.authenticate(request)
+        results = apply(api.parse_lines(request), user)
+    except api.ApiError as e:
+        return JsonResponse(e.as_json(), status=e.status)
+    return JsonResponse({'results': results}, status=201)
+
+
+@csrf_exempt
+def api_sell(request):
+    return api_batch(request, api.sell)
+
+
+@csrf_exempt
+def api_lock(request):
+    return api_batch(request, api.lock)
+
+
+@csrf_exempt
+def api_add_stock(request):
+    return api_batch(request, api.add_stock)
+
+
+def metrics_view(request):
+    """Prometheus text exposition of this worker's metrics."""
+    if not settings.METRICS:
+        raise Http404
+    token = settings.METRICS_TOKEN
+    allowed = (
+        settings.METRICS_PUBLIC
+        or request.user.is_staff
+        or (token and constant_time_compare(request.headers.get('Authorization', ''), f'Bearer {token}'))
+    )
+    if not allowed:
+        return HttpResponse('Unauthorized', status=401, content_type='text/plain')
+    return HttpResponse(metrics.render(), content_type=metrics.CONTENT_TYPE)
+
+
 # Client Management Views
 @login_required
 def client_list(request):
     """Display all clients with pagination"""
-    per_page = request.GET.get('per_page', 10)
-    page_number = request.GET.get('page', 1)
-    
-    clients = Client.objects.all().order_by('name')
-    paginator = Paginator(clients, per_page)
-    page_obj = paginator.get_page(page_number)
+    page_obj = paginate(request, Client.objects.all(), ('name', 'id'))
     
     context = {
         'clients': page_obj,
@@ -1320,25 +1260,8 @@ def edit_client(request, pk):
     # Prepare countries list and parse existing phone into code + number
     countries = get_countries()
 
-    # Default parsed values
-    parsed_country = ''
-    parsed_number = ''
-    if client.phone:
-        # Try to parse a leading +<code> from stored phone like +254712345678
-        p = ''.join(ch for ch in client.phone if ch.isdigit() or ch == '+')
-        if p.startswith('+'):
-            p_digits = p[1:]
-            # attempt to match known country codes
-            for c in [c['code'] for c in countries]:
-                if p_digits.startswith(c):
-                    parsed_country = c
-                    parsed_number = p_digits[len(c):]
-                    break
-            if not parsed_country:
-                # fallback: no known code matched; leave full digits in number
-                parsed_number = p_digits
-        else:
-            parsed_number = ''.join(ch for ch in p if ch.isdigit())
+    # Parse a leading +<code> from a stored phone like +254712345678
+    parsed_country, parsed_number = split_phone(client.phone)
 
     context = {
         'client': client,